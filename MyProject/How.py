@@ -1,231 +1,393 @@
-import sqlite3
+import argparse
+import http.cookies
 import http.server
-import socketserver
+import json
 import urllib.parse
+from html import escape
 
-# Initialize database with tables for Teachers, Classes, Students, Results
+from gradebook import (analytics, assets, auth, compression, db, edits, httpcache, metrics, ranking,
+                       ratelimit, render, repository, results, serving, startup, streaming, summary, terms,
+                       writer)
+
+# importer and reportcards are imported by the handlers that use them, so
+# starting the server does not pay for them.
+
+# Initialize database: apply any pending schema migrations (existing data is kept)
 def init_db():
-    conn = sqlite3.connect("gradesystem.db")
-    cursor = conn.cursor()
-
-    # Drop tables if they exist
-    cursor.executescript("""
-    DROP TABLE IF EXISTS Teachers;
-    DROP TABLE IF EXISTS Class;
-    DROP TABLE IF EXISTS Student;
-    DROP TABLE IF EXISTS Results;
-    """)
-
-    # Create tables in specified order
-    cursor.execute("""
-    -- Teachers table
-    CREATE TABLE Teachers (
-        UserID INTEGER PRIMARY KEY AUTOINCREMENT,
-        Username TEXT UNIQUE,
-        Password TEXT,
-        Role TEXT -- 'teacher' or 'pupil'
-    );
-    """)
-    cursor.execute("""
-    -- Classes table
-    CREATE TABLE Class (
-        ClassID INTEGER PRIMARY KEY AUTOINCREMENT,
-        ClassName TEXT UNIQUE
-    );
-    """)
-    cursor.execute("""
-    -- Students table
-    CREATE TABLE Student (
-        StudentID INTEGER PRIMARY KEY AUTOINCREMENT,
-        ExamNumber TEXT,
-        Name TEXT,
-        ClassID INTEGER,
-        FOREIGN KEY (ClassID) REFERENCES Class(ClassID)
-    );
-    """)
-    cursor.execute("""
-    -- Results table
-    CREATE TABLE Results (
-        ResultID INTEGER PRIMARY KEY AUTOINCREMENT,
-        StudentID INTEGER,
-        Subject TEXT,
-        Score INTEGER,
-        Term TEXT,
-        FOREIGN KEY (StudentID) REFERENCES Student(StudentID)
-    );
-    """)
-
-    # Insert sample data
-    cursor.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher1', 'pass123', 'teacher')")
-    cursor.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher2', 'pass123', 'teacher')")
-    cursor.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher3', 'pass123', 'teacher')")
-
-    cursor.execute("INSERT OR IGNORE INTO Class (ClassName) VALUES ('Form 1')")
-    cursor.execute("INSERT OR IGNORE INTO Class (ClassName) VALUES ('Form 2')")
-
-    cursor.execute("INSERT OR IGNORE INTO Student (ExamNumber, Name, ClassID) VALUES ('EXAM001', 'Alice', 1)")
-    cursor.execute("INSERT OR IGNORE INTO Student (ExamNumber, Name, ClassID) VALUES ('EXAM002', 'Bob', 2)")
-    cursor.execute("INSERT OR IGNORE INTO Student (ExamNumber, Name, ClassID) VALUES (170900600401, 'Jimmy Sakala', 'KB3')")
-    cursor.execute("INSERT OR IGNORE INTO Student (ExamNumber, Name, ClassID) VALUES (2023021197, 'James Sakala', 'KB2')")
-
-    cursor.execute("INSERT OR IGNORE INTO Results (StudentID, Subject, Score, Term) VALUES (1, 'Math', 85, 'Term 1')")
-    cursor.execute("INSERT OR IGNORE INTO Results (StudentID, Subject, Score, Term) VALUES (1, 'English', 78, 'Term 1')")
-    cursor.execute("INSERT OR IGNORE INTO Results (StudentID, Subject, Score, Term) VALUES (2, 'Math', 92, 'Term 1')")
-    cursor.execute("INSERT OR IGNORE INTO Results (StudentID, Subject, Score, Term) VALUES (2, 'English', 88, 'Term 1')")
-
-    conn.commit()
-    conn.close()
-
-# Helper function to generate styled HTML with background
-def get_html(content):
+    repository.init_db()
+    render.invalidate_classes()
+
+# Static pages are rendered and encoded once
+LOGIN_PAGE = render.page("""
+            <h2 style="text-align:center;">Login</h2>
+            <form method="post" action="/login">
+                <label>Username:</label>
+                <input type="text" name="username" required />
+                <label>Password:</label>
+                <input type="password" name="password" required />
+                <input type="submit" value="Login" />
+            </form>
+        """)
+
+# One subject/score row of the add form; the page's <template> holds a copy
+# for addResult() in static/teacher.js
+RESULT_ENTRY = """
+                <div class="result-entry">
+                    <input type="text" name="subject[]" placeholder="Subject" required/>
+                    <input type="number" name="score[]" placeholder="Score" min="0" max="100" required/>
+                    <button type="button" onclick="this.parentElement.remove()" class="remove-btn">Remove</button>
+                </div>"""
+
+# The teacher page only changes when the class list does, so it is cached
+# (see render.invalidate_classes)
+def build_teacher_page():
+    options = render.class_options()
+    term_options = render.term_options()
+
+    html_content = f"""
+        <h2>Teacher Dashboard</h2>
+        <a href="/dashboard">View Dashboard</a>
+        <h3 style="margin-top:30px;">Add Results for Student</h3>
+        <form method="post" action="/teacher/add_results">
+            <label>Exam Number:</label>
+            <input type="text" name="exam_number" required />
+
+            <label>Name:</label>
+            <input type="text" name="name" required />
+
+            <label>Class:</label>
+            <select name="class_id" required>
+                {options}
+            </select>
+
+            <label>Term:</label>
+            <select name="term_id" required>
+                {term_options}
+            </select>
+
+            <h4 style="margin-top:20px;">Add Results:</h4>
+            <div id="results-container" style="margin-top:15px;">{RESULT_ENTRY}
+            </div>
+            <template id="result-entry">{RESULT_ENTRY}
+            </template>
+            <button type="button" onclick="addResult()" class="add-btn">Add Another Result</button>
+            <br/><br/>
+            <input type="submit" value="Save Results" class="save-btn"/>
+        </form>
+        <script src="{assets.url('teacher.js')}" defer></script>
+        <h3 style="margin-top:30px;">Bulk Import Results</h3>
+        <form onsubmit="importResults(event)">
+            <label>CSV or JSON file (exam_number, name, class_id, subject, score, term):</label>
+            <input type="file" id="import-file" accept=".csv,.json,.jsonl" required />
+            <input type="submit" value="Import" />
+        </form>
+        <pre id="import-report"></pre>
+        <h3 style="margin-top:30px;">Class Results</h3>
+        <form method="get" action="/teacher/results">
+            <label>Class:</label>
+            <select name="class_id" required>
+                {options}
+            </select>
+            <input type="submit" value="Show Results" />
+        </form>
+        <h3 style="margin-top:30px;">Report Cards</h3>
+        <form method="get" action="/teacher/report_cards">
+            <label>Class:</label>
+            <select name="class_id" required>
+                {options}
+            </select>
+            <label>Term:</label>
+            <select name="term_id">
+                <option value="">All terms</option>
+                {term_options}
+            </select>
+            <label>Format:</label>
+            <select name="format">
+                <option value="html">One printable page</option>
+                <option value="zip">ZIP, one file per pupil</option>
+            </select>
+            <input type="submit" value="Download Report Cards" />
+        </form>
+        <h3 style="margin-top:30px;">Edit Existing Results</h3>
+        <form method="get" action="/teacher">
+            <label>Exam Number:</label>
+            <input type="text" name="exam_number" required />
+            <input type="submit" value="Find Results" />
+        </form>
+        <br/><a href="/logout" style="display:inline-block; margin-top:20px;">Logout</a>
+    """
+    return render.page(html_content)
+
+# Form for students to enter exam number, class and term (the current term
+# unless other term options are given)
+def build_results_form(term_options=None):
+    return """
+            <h2>View Your Results</h2>
+            <form method="get" action="/view_results" class="lookup-form">
+                <label>Enter Exam Number:</label>
+                <input type="text" name="exam_number" required/>
+                <label>Select Class:</label>
+                <select name="class_id" required>
+                    {options}
+                </select>
+                <label>Term:</label>
+                <select name="term_id">
+                    {terms}
+                </select>
+                <br/><br/>
+                <input type="submit" value="View Results" class="save-btn"/>
+            </form>
+        """.replace("{options}", render.class_options()).replace("{terms}", term_options or render.term_options())
+
+# The lookup form on its own, as most visits first see it
+def build_results_page():
+    return render.page(render.fragments.get("results_form", build_results_form))
+
+# Part of every results ETag, so a changed form or page layout is never served as 304
+def results_form_tag():
+    form = render.fragments.get("results_form", build_results_form)
+    return httpcache.make_etag(render.SHELL_PREFIX, form, render.SHELL_SUFFIX)
+
+# Start-up warm-up (gradebook.startup): the lookup form page, gzipped as
+# send_html(static=True) sends it, and the results ETag part
+def warm_results_page():
+    page = render.fragments.get("results_page", build_results_page)
+    if compression.enabled:
+        compression.precompressed(page)
+    render.fragments.get("results_form_tag", results_form_tag)
+
+startup.add_step("results page", warm_results_page)
+
+# Editor for one student's results (see show_result_editor)
+def build_result_editor(exam_number, rows, params):
+    exam = escape(exam_number)
+    message = ""
+    for action in ("updated", "deleted"):
+        if action in params:
+            message += f"<p><b>{escape(params[action][0])} result(s) {action}.</b></p>"
+    if not rows:
+        return f"""
+        <h2>Edit Results</h2>{message}
+        <p>No results found for exam number {exam}.</p>
+        <a href="/teacher">Back</a>
+    """
+    entries = "".join(
+        f"<tr><td><input type='hidden' name='result_id[]' value='{result_id}'/>"
+        f"<input type='text' name='subject[]' value='{escape(str(subject))}' required/></td>"
+        f"<td><input type='number' name='score[]' value='{score}' min='0' max='100' required/></td>"
+        f"<td>{escape(str(term))}</td>"
+        f"<td><input type='checkbox' name='result_id[]' value='{result_id}' form='delete-form'/></td></tr>"
+        for result_id, subject, score, term, _ in rows)
     return f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8" />
-        <meta name="viewport" content="width=device-width, initial-scale=1.0"/>
-        <title>KAFUMBWE GRADE BOOK SYSTEM</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #74ebd5 0%, #ACB6E5 100%);
-                margin: 0;
-                padding: 20px;
-            }}
-            .container {{
-                max-width: 900px;
-                margin: auto;
-                background: rgba(255, 255, 255, 0.9);
-                padding: 30px;
-                border-radius: 12px;
-                box-shadow: 0 8px 20px rgba(0,0,0,0.2);
-            }}
-            h1 {{
-                text-align: center;
-                margin-bottom: 30px;
-                color: #333;
-                font-family: 'Arial Rounded MT Bold', cursive;
-            }}
-            a {{
-                display: inline-block;
-                margin-top: 15px;
-                padding: 10px 20px;
-                background-color: #4CAF50;
-                color: #fff;
-                border-radius: 8px;
-                text-decoration: none;
-                font-weight: bold;
-                transition: background-color 0.3s ease;
-            }}
-            a:hover {{
-                background-color: #45a049;
-            }}
-            form {{
-                background: #fff;
-                padding: 20px;
-                border-radius: 10px;
-                box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            }}
-            label {{
-                display: block;
-                margin-top: 15px;
-                font-weight: 600;
-                color: #555;
-            }}
-            input[type=text], input[type=password], select, input[type=number] {{
-                width: 100%; box-sizing: border-box;
-                padding: 12px 15px;
-                margin-top: 8px;
-                border: 2px solid #ccc;
-                border-radius: 6px;
-                font-size: 1em;
-                transition: border-color 0.2s;
-            }}
-            input[type=text]:focus, input[type=password]:focus, select:focus, input[type=number]:focus {{
-                border-color: #4CAF50;
-                outline: none;
-            }}
-            input[type=submit] {{
-                margin-top: 20px;
-                padding: 12px 25px;
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                cursor: pointer;
-                font-size: 1.1em;
-                transition: background-color 0.3s ease;
-            }}
-            input[type=submit]:hover {{
-                background-color: #45a049;
-            }}
-            /* Styling table for results */
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin-top: 25px;
-            }}
-            th, td {{
-                padding: 14px;
-                border: 1px solid #ddd;
-                text-align: center;
-                border-radius: 4px;
-            }}
-            th {{
-                background-color: #f2f2f2;
-                font-weight: 600;
-            }}
-            /* Buttons inside results table (if any) */
-            .btn {{
-                padding: 6px 12px;
-                border: none;
-                border-radius: 4px;
-                cursor: pointer;
-                font-size: 0.9em;
-                margin: 2px;
-            }}
-            .edit-btn {{
-                background-color: #2196F3;
-                color: white;
-            }}
-            .delete-btn {{
-                background-color: #f44336;
-                color: white;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>KAFUMBWE GRADE BOOK SYSTEM</h1>
-            {content}
-        </div>
-    </body>
-    </html>
+        <h2>Edit Results for {escape(str(rows[0][4]))} ({exam})</h2>{message}
+        <form method="post" action="/teacher/edit_result">
+            <input type="hidden" name="exam_number" value="{exam}"/>
+            <table><tr><th>Subject</th><th>Score</th><th>Term</th><th>Delete</th></tr>{entries}</table>
+            <input type="submit" value="Update Results" />
+        </form>
+        <form id="delete-form" method="post" action="/teacher/delete_result">
+            <input type="hidden" name="exam_number" value="{exam}"/>
+            <input type="submit" value="Delete Selected" class="btn delete-btn" />
+        </form>
+        <a href="/teacher">Back</a>
     """
 
+# Filter form and one page of class results, generated for streaming.send_stream()
+def class_results_parts(filters, rows, next_cursor):
+    options = render.select(render.class_options(), filters["class_id"])
+    term_options = render.select(render.term_options(), filters["term_id"])
+    sorts = "".join(f"<option value='{sort}'{' selected' if sort == filters['sort'] else ''}>{sort.title()}</option>"
+                    for sort in results.SORTS)
+    yield f"""
+        <h2>Class Results</h2>
+        <form method="get" action="/teacher/results">
+            <label>Class:</label>
+            <select name="class_id" required>{options}</select>
+            <label>Term:</label>
+            <select name="term_id"><option value="">All terms</option>{term_options}</select>
+            <label>Subject:</label>
+            <input type="text" name="subject" value="{escape(filters['subject'])}" placeholder="All subjects" />
+            <label>Sort by:</label>
+            <select name="sort">{sorts}</select>
+            <input type="submit" value="Filter" />
+        </form>
+        <table><tr><th>Exam Number</th><th>Name</th><th>Subject</th><th>Score</th><th>Term</th></tr>"""
+    for row in rows:
+        yield (f"<tr><td>{escape(str(row.exam_number))}</td><td>{escape(str(row.name))}</td>"
+               f"<td>{escape(str(row.subject))}</td><td>{row.score}</td><td>{escape(str(row.term))}</td></tr>")
+    yield "</table>"
+    if not rows:
+        yield "<p>No results match these filters.</p>"
+    query = {name: value for name, value in filters.items() if value and name != "cursor"}
+    if filters["cursor"]:
+        yield f"<a href='/teacher/results?{escape(urllib.parse.urlencode(query))}'>First page</a> "
+    if next_cursor:
+        yield f"<a href='/teacher/results?{escape(urllib.parse.urlencode({**query, 'cursor': next_cursor}))}'>Next page</a> "
+    yield '<br/><a href="/teacher">Back</a>'
+
+# A student's results under the lookup form, generated for streaming.send_stream()
+def results_page_parts(form, entry, term, position=None):
+    yield form
+    yield f"<h3 style='margin-top:30px;'>Your Results: {escape(f'{term.year} {term.name}')}</h3>"
+    if not entry.rows:
+        yield "<p>No results found for this student.</p>"
+        return
+    yield from render.result_table(entry.rows)
+    if entry.summary:
+        yield f"<h4>Average: {entry.summary.average:.1f} &nbsp; Status: {entry.summary.status}</h4>"
+    if position:
+        yield (f"<h4>Position: {position.position} of {position.size} &nbsp; "
+               f"Percentile: {position.percentile:.1f}</h4>")
+
+# A batch lookup (results.lookup_many) as a JSON array, one object per exam
+# number, generated for streaming.send_stream()
+def api_results_parts(batch, term):
+    term_name = f"{term.year} {term.name}"
+    yield "["
+    for index, entry in enumerate(batch):
+        item = {"exam_number": entry.exam_number, "found": entry.student_id is not None}
+        if entry.student_id is not None:
+            item.update(name=entry.name, class_id=entry.class_id, term=term_name,
+                        results=[{"subject": subject, "score": score} for subject, score in entry.rows])
+            position = ranking.index.position(entry.student_id, entry.class_id, term)
+            if position:
+                item.update(position=position.position, class_size=position.size, percentile=position.percentile)
+            if entry.summary:
+                item.update(total=entry.summary.total, average=round(entry.summary.average, 1),
+                            status=entry.summary.status)
+        yield ("," if index else "") + json.dumps(item)
+    yield "]"
+
+def _percent(rate):
+    return "-" if rate is None else f"{rate * 100:.1f}%"
+
+# Overview of every class in one term
+def build_dashboard(stats, term):
+    rows = ""
+    for c in sorted(stats.values(), key=lambda c: str(c["class_name"])):
+        top = c["positions"][0]["name"] if c["positions"] else "-"
+        link = "/dashboard?" + urllib.parse.urlencode({"class_id": c["class_id"], "term_id": term.term_id})
+        rows += (f"<tr><td><a href='{escape(link)}'>{escape(str(c['class_name']))}</a></td>"
+                 f"<td>{c['students']}</td><td>{'-' if c['average'] is None else c['average']}</td>"
+                 f"<td>{_percent(c['pass_rate'])}</td><td>{escape(str(top))}</td></tr>")
+    return f"""
+        <h2>Dashboard: {escape(f'{term.year} {term.name}')}</h2>
+        <form method="GET" action="/dashboard">
+            <select name="term_id">{render.select(render.term_options(), term.term_id)}</select>
+            <input type="submit" value="Show Term" />
+        </form>
+        <table><tr><th>Class</th><th>Pupils</th><th>Class Average</th><th>Pass Rate</th><th>Top Pupil</th></tr>{rows}</table>
+        <a href="/teacher">Back</a>
+    """
+
+# Positions, subject statistics and grade distribution for one class in one term
+def build_class_dashboard(c, term):
+    positions = "".join(
+        f"<tr><td>{p['position']}</td><td>{escape(str(p['exam_number']))}</td><td>{escape(str(p['name']))}</td>"
+        f"<td>{p['total']}</td><td>{p['average']}</td><td>{p['status']}</td></tr>" for p in c["positions"])
+    subjects = "".join(
+        f"<tr><td>{escape(str(s['subject']))}</td><td>{s['count']}</td><td>{s['mean']}</td><td>{s['median']}</td>"
+        f"<td>{s['std_dev']}</td><td>{s['min']}</td><td>{s['max']}</td><td>{_percent(s['pass_rate'])}</td></tr>"
+        for s in c["subjects"])
+    grades = "".join(f"<tr><td>{grade}</td><td>{count}</td></tr>" for grade, count in c["grades"].items())
+    return f"""
+        <h2>{escape(str(c['class_name']))}: {escape(f'{term.year} {term.name}')}</h2>
+        <p>{c['students']} pupils, class average {'-' if c['average'] is None else c['average']},
+           pass rate {_percent(c['pass_rate'])} (pass mark {analytics.PASS_MARK})</p>
+        <h3>Positions</h3>
+        <table><tr><th>Position</th><th>Exam Number</th><th>Name</th><th>Total</th><th>Average</th><th>Status</th></tr>{positions}</table>
+        <h3>Subjects</h3>
+        <table><tr><th>Subject</th><th>Entries</th><th>Mean</th><th>Median</th><th>Std Dev</th><th>Min</th><th>Max</th><th>Pass Rate</th></tr>{subjects}</table>
+        <h3>Grade Distribution</h3>
+        <table><tr><th>Grade</th><th>Marks</th></tr>{grades}</table>
+        <a href="/dashboard?term_id={term.term_id}">Back to Dashboard</a>
+    """
+
+# Pages and endpoints only a logged-in teacher may use
+def is_teacher_path(path):
+    return path in ("/teacher", "/dashboard") or path.startswith(("/teacher/", "/api/"))
+
+# Server statistics: open to requests from this machine, to a logged-in
+# teacher otherwise
+def is_stats_path(path):
+    return path in ("/metrics", "/cache_stats")
+
+# Every route served, as labelled in /metrics (see gradebook.metrics)
+ROUTES = ("/", "/login", "/logout", "/dashboard", "/view_results", "/teacher", "/teacher/results",
+          "/teacher/report_cards", "/teacher/add_results", "/teacher/edit_result*", "/teacher/delete_result",
+          "/teacher/import", "/api/results", "/cache_stats", "/metrics", assets.PREFIX + "*")
+
 # Basic server handler
 class GradeSystemHandler(http.server.BaseHTTPRequestHandler):
+    # Drop clients that stall mid-request so they can't hold a worker forever
+    timeout = 30
+
+    # `static` bodies are the same object on every request (cached pages), so
+    # their gzip form is kept too (see gradebook.compression)
+    def send_html(self, body, status=200, validators=None, static=False):
+        body, encoding = compression.encode(self.headers, body, static)
+        self.send_response(status)
+        self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        if validators:
+            httpcache.send_validators(self, *validators)
+        compression.send_headers(self, encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        payload, encoding = compression.encode(self.headers, json.dumps(data).encode())
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        compression.send_headers(self, encoding)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @metrics.instrumented
     def do_GET(self):
         parsed_path = urllib.parse.urlparse(self.path)
         params = urllib.parse.parse_qs(parsed_path.query)
         path = parsed_path.path
+        if (is_teacher_path(path) or is_stats_path(path) and not metrics.is_local(self)) and not self.authorize():
+            return
 
         if path == "/":
             self.show_login()
         elif path == "/dashboard":
-            self.show_dashboard()
+            self.show_dashboard(params)
         elif path == "/view_results":
             self.view_results(params)
         elif path == "/teacher":
             self.show_teacher_page(params)
+        elif path == "/teacher/results":
+            self.show_class_results(params)
+        elif path == "/teacher/report_cards":
+            self.send_report_cards(params)
+        elif path == "/api/results":
+            self.api_results(params)
         elif path == "/logout":
-            self.show_login()
+            self.logout()
+        elif path == "/cache_stats":
+            self.show_cache_stats()
+        elif path == "/metrics":
+            self.show_metrics()
+        elif path.startswith(assets.PREFIX):
+            assets.send(self, path)
         else:
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b"<h1>404 Not Found</h1>")
 
+    @metrics.instrumented
     def do_POST(self):
+        if is_teacher_path(urllib.parse.urlparse(self.path).path) and not self.authorize():
+            return
+        # Uploads are streamed straight from the socket, so route them before reading the body
+        if urllib.parse.urlparse(self.path).path == "/teacher/import":
+            self.process_import()
+            return
+
         length = int(self.headers.get("Content-Length", 0))
         data = urllib.parse.parse_qs(self.rfile.read(length).decode())
 
@@ -239,105 +401,215 @@ class GradeSystemHandler(http.server.BaseHTTPRequestHandler):
             self.edit_result(data, path)
         elif path == "/teacher/delete_result":
             self.delete_result(data)
+        elif path == "/api/results":
+            self.api_results(data)
         else:
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b"<h1>404 Not Found</h1>")
 
     def show_login(self):
-        html = get_html("""
-            <h2 style="text-align:center;">Login</h2>
-            <form method="post" action="/login">
-                <label>Username:</label>
-                <input type="text" name="username" required />
-                <label>Password:</label>
-                <input type="password" name="password" required />
-                <input type="submit" value="Login" />
-            </form>
-        """)
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(html.encode())
+        self.send_html(LOGIN_PAGE, static=True)
+
+    # Class statistics for a term (?term_id=, the current term by default);
+    # ?class_id= shows one class in full, ?format=json returns the raw numbers
+    def show_dashboard(self, params):
+        term = terms.find(params.get("term_id", [""])[0])
+        if term is None:
+            self.send_html(render.page("<p>Term not found.</p><a href='/dashboard'>Back</a>"), status=404)
+            return
+        stats = analytics.engine.snapshot(term)
+        class_id = params.get("class_id", [None])[0]
+        if class_id is not None and class_id not in stats:
+            self.send_html(render.page("<p>Class not found.</p><a href='/dashboard'>Back</a>"), status=404)
+            return
+        if params.get("format", [""])[0] == "json":
+            self.send_json(stats[class_id] if class_id is not None else list(stats.values()))
+            return
+        if class_id is not None:
+            html = build_class_dashboard(stats[class_id], term)
+        else:
+            html = build_dashboard(stats, term)
+        self.send_html(render.page(html))
+
+    # Session for the request's cookie (see gradebook.auth), or None
+    def current_session(self):
+        cookie = http.cookies.SimpleCookie()
+        try:
+            cookie.load(self.headers.get("Cookie", ""))
+        except http.cookies.CookieError:
+            return None
+        morsel = cookie.get(auth.COOKIE_NAME)
+        return auth.sessions.from_cookie(morsel.value) if morsel else None
+
+    # True if a teacher is logged in; otherwise sends the login page (as a
+    # redirect) or an error and returns False
+    def authorize(self):
+        session = self.current_session()
+        if session is not None and session.role == "teacher":
+            return True
+        if session is None and self.command == "GET" and not self.path.startswith("/api/"):
+            self.send_response(302)
+            self.send_header("Location", "/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif session is None:
+            self.send_json({"error": "login required"}, status=401)
+        else:
+            self.send_json({"error": "teachers only"}, status=403)
+        return False
 
     def handle_login(self, data):
         username = data.get("username", [""])[0]
         password = data.get("password", [""])[0]
-        conn = sqlite3.connect("gradesystem.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT Role FROM Teachers WHERE Username=? AND Password=?", (username, password))
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            role = row[0]
-            if role == "teacher":
-                self.send_response(302)
-                self.send_header("Location", "/teacher")
-                self.end_headers()
-            elif role == "pupil":
-                self.send_response(302)
-                self.send_header("Location", "/view_results")
-                self.end_headers()
-        else:
+        wait = ratelimit.check_login(self.client_address[0], username)
+        if wait:
+            ratelimit.send_too_many_requests(self, wait)
+            return
+        conn = db.get_connection()
+        row = repository.find_account(conn, username)
+        if not auth.verify_password(row[0] if row else None, password):
             self.show_login()
+            return
+        stored, role = row
+        # Plaintext or weaker hashes are replaced now that the password is known
+        if auth.needs_rehash(stored):
+            repository.set_password_hash(conn, username, auth.hash_password(password))
+        session = auth.sessions.create(username, role)
+        self.send_response(302)
+        self.send_header("Location", "/teacher" if role == "teacher" else "/view_results")
+        self.send_header("Set-Cookie", f"{auth.COOKIE_NAME}={session.cookie}; Path=/; "
+                                       f"Max-Age={auth.sessions.ttl}; HttpOnly; SameSite=Lax")
+        self.end_headers()
 
-    def show_teacher_page(self, params):
-        # Extract class options
-        conn = sqlite3.connect("gradesystem.db")
-        classes = conn.execute("SELECT ClassID, ClassName FROM Class").fetchall()
-        conn.close()
-        options = "".join([f'<option value="{c[0]}">{c[1]}</option>' for c in classes])
-
-        html_content = f"""
-            <h2>Teacher Dashboard</h2>
-            <a href="/dashboard">View Dashboard</a>
-            <h3 style="margin-top:30px;">Add Results for Student</h3>
-            <form method="post" action="/teacher/add_results">
-                <label>Exam Number:</label>
-                <input type="text" name="exam_number" required />
-
-                <label>Name:</label>
-                <input type="text" name="name" required />
-
-                <label>Class:</label>
-                <select name="class_id" required>
-                    {options}
-                </select>
-
-                <h4 style="margin-top:20px;">Add Results:</h4>
-                <div id="results-container" style="margin-top:15px;">
-                    <div class="result-entry" style="margin-bottom:10px;">
-                        <input type="text" name="subject[]" placeholder="Subject" required style="width:45%; margin-right:10px; padding:8px; border-radius:4px; border:1px solid #ccc;"/>
-                        <input type="number" name="score[]" placeholder="Score" min="0" max="100" required style="width:20%; margin-right:10px; padding:8px; border-radius:4px; border:1px solid #ccc;"/>
-                        <button type="button" onclick="this.parentElement.remove()" style="background:#f44336; color:#fff; border:none; padding:8px 12px; border-radius:4px; cursor:pointer;">Remove</button>
-                        <button type="button" onclick="alert('Update logic goes here')" style="background:#2196F3; color:#fff; border:none; padding:8px 12px; border-radius:4px; cursor:pointer; margin-left:6px;">Update</button>
-                    </div>
-                </div>
-                <button type="button" onclick="addResult()" style="margin-top:10px; padding:8px 16px; border:none; border-radius:4px; background:#2196F3; color:#fff; cursor:pointer;">Add Another Result</button>
-                <br/><br/>
-                <input type="submit" value="Save Results" style="background:#4CAF50; padding:10px 20px; border:none; border-radius:4px; color:#fff; font-size:1em; cursor:pointer;"/>
-            </form>
-            <script>
-                function addResult() {{
-                    const container = document.getElementById('results-container');
-                    const div = document.createElement('div');
-                    div.className = 'result-entry';
-                    div.style.marginBottom = '10px';
-                    div.innerHTML = `
-                        <input type="text" name="subject[]" placeholder="Subject" required style="width:45%; margin-right:10px; padding:8px; border-radius:4px; border:1px solid #ccc;"/>
-                        <input type="number" name="score[]" placeholder="Score" min="0" max="100" required style="width:20%; margin-right:10px; padding:8px; border-radius:4px; border:1px solid #ccc;"/>
-                        <button type="button" onclick="this.parentElement.remove()" style="background:#f44336; color:#fff; border:none; padding:8px 12px; border-radius:4px; cursor:pointer;">Remove</button>
-                        <button type="button" onclick="alert('Update logic goes here')" style="background:#2196F3; color:#fff; border:none; padding:8px 12px; border-radius:4px; cursor:pointer; margin-left:6px;">Update</button>
-                    `;
-                    container.appendChild(div);
-                }}
-            </script>
-            <br/><a href="/logout" style="display:inline-block; margin-top:20px;">Logout</a>
-        """
+    def logout(self):
+        session = self.current_session()
+        if session is not None:
+            auth.sessions.logout(session)
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(len(LOGIN_PAGE)))
+        self.send_header("Set-Cookie", f"{auth.COOKIE_NAME}=; Path=/; Max-Age=0; HttpOnly; SameSite=Lax")
         self.end_headers()
-        self.wfile.write(get_html(html_content).encode())
+        self.wfile.write(LOGIN_PAGE)
+
+    def show_teacher_page(self, params):
+        if "exam_number" in params:
+            self.show_result_editor(params)
+            return
+        self.send_html(render.fragments.get("teacher_page", build_teacher_page), static=True)
+
+    # One page of a class's results, filtered by term/subject, as HTML or (format=json) JSON
+    def show_class_results(self, params):
+        filters = {name: params.get(name, [""])[0].strip()
+                   for name in ("class_id", "term_id", "subject", "sort", "limit", "cursor")}
+        if not filters["class_id"]:
+            self.send_response(302)
+            self.send_header("Location", "/teacher")
+            self.end_headers()
+            return
+        filters["sort"] = filters["sort"] or "name"
+        term = terms.find(filters["term_id"]) if filters["term_id"] else None
+        if filters["term_id"] and term is None:
+            self.send_json({"error": f"no term with id {filters['term_id']}"}, status=400)
+            return
+        try:
+            rows, next_cursor = results.class_results(
+                filters["class_id"], term=term, subject=filters["subject"], sort=filters["sort"],
+                cursor=filters["cursor"], limit=filters["limit"] or results.PAGE_SIZE)
+        except ValueError as exc:
+            self.send_json({"error": str(exc)}, status=400)
+            return
+        if params.get("format", [""])[0] == "json":
+            self.send_json({"results": [row._asdict() for row in rows], "next": next_cursor})
+            return
+        streaming.send_stream(self, render.stream_page(class_results_parts(filters, rows, next_cursor)))
+
+    # Report cards for one class as a download. Rendered in this process: big
+    # batches (the whole school) are for the reportcards command line tool.
+    def send_report_cards(self, params):
+        import shutil
+        import tempfile
+        from gradebook import reportcards
+
+        class_id = params.get("class_id", [""])[0]
+        term_id = params.get("term_id", [""])[0]
+        term = terms.find(term_id) if term_id else None
+        fmt = params.get("format", ["html"])[0]
+        if term_id and term is None:
+            self.send_json({"error": f"no term with id {term_id}"}, status=400)
+            return
+        if not class_id or fmt not in reportcards.FORMATS:
+            self.send_json({"error": f"class_id and a format of {', '.join(reportcards.FORMATS)} are required"},
+                           status=400)
+            return
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as out:
+            report = reportcards.generate(db.get_connection(), out, [class_id], term, fmt, processes=1)
+            size = out.tell()
+            out.seek(0)
+            self.send_response(200)
+            self.send_header("Content-type", "application/zip" if fmt == "zip" else "text/html")
+            self.send_header("Content-Length", str(size))
+            disposition = "attachment" if fmt == "zip" else "inline"
+            filename = f"report-cards-{urllib.parse.quote(class_id, safe='')}.{fmt}"
+            self.send_header("Content-Disposition", f'{disposition}; filename="{filename}"')
+            self.send_header("X-Pupils-Per-Second", f"{report.pupils_per_second:.0f}")
+            self.end_headers()
+            shutil.copyfileobj(out, self.wfile)
+
+    # Every result of one student with editable subject/score and delete checkboxes
+    def show_result_editor(self, params):
+        exam_number = params["exam_number"][0]
+        rows = repository.editor_rows(db.get_connection(), exam_number)
+        self.send_html(render.page(build_result_editor(exam_number, rows, params)))
+
+    def edit_result(self, data, path):
+        # IDs may also come in the query string: /teacher/edit_result?result_id=5
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        result_ids = data.get("result_id[]") or data.get("result_id") or query.get("result_id", [])
+        scores = data.get("score[]") or data.get("score", [])
+        subjects = data.get("subject[]") or data.get("subject")
+        try:
+            updates = edits.parse_updates(result_ids, scores, subjects)
+        except ValueError as exc:
+            self.send_html(render.page(f"<p>{escape(str(exc))}</p><a href='/teacher'>Back</a>"), status=400)
+            return
+        try:
+            affected = edits.update_results(updates)
+        except writer.WriteTimeout:
+            self.send_busy()
+            return
+        self.send_edit_outcome(data, "updated", affected)
+
+    def delete_result(self, data):
+        try:
+            result_ids = edits.parse_ids(data.get("result_id[]") or data.get("result_id", []))
+        except ValueError as exc:
+            self.send_html(render.page(f"<p>{escape(str(exc))}</p><a href='/teacher'>Back</a>"), status=400)
+            return
+        try:
+            affected = edits.delete_results(result_ids)
+        except writer.WriteTimeout:
+            self.send_busy()
+            return
+        self.send_edit_outcome(data, "deleted", affected)
+
+    # The group-commit writer did not get to a save in time; nothing was written
+    def send_busy(self):
+        self.send_html(render.page("<p>The server is too busy to save results right now; nothing was saved. "
+                                   "Please submit them again.</p><a href='/teacher'>Back</a>"), status=503)
+
+    # Forms go back to the editor with a message; API callers get JSON
+    def send_edit_outcome(self, data, action, affected):
+        exam_number = data.get("exam_number", [""])[0]
+        if exam_number and "application/json" not in self.headers.get("Accept", ""):
+            query = urllib.parse.urlencode({"exam_number": exam_number, action: affected})
+            self.send_response(302)
+            self.send_header("Location", f"/teacher?{query}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_json({action: affected})
 
     def process_add_results(self, data):
         exam_number = data.get("exam_number", [""])[0]
@@ -345,89 +617,160 @@ class GradeSystemHandler(http.server.BaseHTTPRequestHandler):
         class_id = data.get("class_id", [""])[0]
         subjects = data.get("subject[]", [])
         scores = data.get("score[]", [])
-        if len(subjects) != len(scores):
-            # Could add error message here
-            self.show_teacher_page({})
+        term = terms.find(data.get("term_id", [""])[0])
+        try:
+            marks = repository.parse_marks(subjects, scores)
+        except ValueError as exc:
+            self.send_html(render.page(f"<p>{escape(str(exc))}</p><a href='/teacher'>Back</a>"), status=400)
+            return
+        if term is None or term.archive_path:
+            self.send_html(render.page("<p>Results can only be added to a term of an open year.</p>"
+                                       "<a href='/teacher'>Back</a>"), status=400)
+            return
+        try:
+            repository.add_results(exam_number, name, class_id, marks, term)
+        except writer.WriteTimeout:
+            self.send_busy()
             return
-        conn = sqlite3.connect("gradesystem.db")
-        cursor = conn.cursor()
-        # Check if student exists
-        cursor.execute("SELECT StudentID FROM Student WHERE ExamNumber=?", (exam_number,))
-        row = cursor.fetchone()
-        if row:
-            student_id = row[0]
-        else:
-            cursor.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)", (exam_number, name, class_id))
-            student_id = cursor.lastrowid
-        # Insert results
-        for subj, score in zip(subjects, scores):
-            cursor.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (?, ?, ?, ?)",
-                           (student_id, subj, int(score), "Term 1"))
-        conn.commit()
-        conn.close()
         self.send_response(302)
         self.send_header("Location", "/teacher")
         self.end_headers()
 
+    def process_import(self):
+        from gradebook import importer
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_response(411)
+            self.end_headers()
+            self.wfile.write(b"<h1>411 Length Required</h1>")
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # Where the body ends is unknown, so the connection cannot be reused
+            self.close_connection = True
+            self.send_json({"error": f"invalid Content-Length {length!r}"}, status=400)
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        fmt = query.get("format", [""])[0] or importer.detect_format(query.get("filename", [""])[0],
+                                                                     self.headers.get("Content-Type", ""))
+        body = importer.BodyReader(self.rfile, length)
+        report = importer.import_stream(body, fmt)
+        if report.terms_created:
+            render.invalidate_classes()
+        self.send_json(report.as_dict())
+
+    def show_metrics(self):
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header("Content-type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Results of many pupils for one term (the current one unless term_id is
+    # given) as a streamed JSON array. Exam numbers are repeated exam_number
+    # fields and/or comma separated; POST them as a form for long lists.
+    def api_results(self, params):
+        exam_numbers = [exam.strip() for value in params.get("exam_number", []) for exam in value.split(",")
+                        if exam.strip()]
+        term_id = params.get("term_id", [""])[0]
+        term = terms.find(term_id)
+        if term is None:
+            self.send_json({"error": f"no term with id {term_id}" if term_id else "no current term"}, status=400)
+            return
+        try:
+            batch = results.lookup_many(exam_numbers, term)
+        except ValueError as exc:
+            self.send_json({"error": str(exc)}, status=400)
+            return
+        streaming.send_stream(self, api_results_parts(batch, term), content_type="application/json")
+
+    # Hit/miss/eviction counters for sizing the result cache
+    def show_cache_stats(self):
+        self.send_json({"results": results.stats(), "rate_limits": ratelimit.stats(), "writer": writer.stats(),
+                        "ranking": ranking.index.stats(), "startup": startup.stats()})
+
     def view_results(self, params):
-        # Show form for students to enter exam number and class
-        html = """
-            <h2>View Your Results</h2>
-            <form method="get" action="/view_results" style="margin-top:20px;">
-                <label>Enter Exam Number:</label>
-                <input type="text" name="exam_number" required style="width:100%; padding:8px; border-radius:4px; border:1px solid #ccc;"/>
-                <label style="margin-top:15px;">Select Class:</label>
-                <select name="class_id" required style="width:100%; padding:8px; border-radius:4px; border:1px solid #ccc;">
-                    {options}
-                </select>
-                <br/><br/>
-                <input type="submit" value="View Results" style="background:#4CAF50; padding:10px 20px; border:none; border-radius:4px; color:#fff; font-size:1em; cursor:pointer;"/>
-            </form>
-        """
-        # Populate class options
-        conn = sqlite3.connect("gradesystem.db")
-        classes = conn.execute("SELECT ClassID, ClassName FROM Class").fetchall()
-        conn.close()
-        options = "".join([f'<option value="{c[0]}">{c[1]}</option>' for c in classes])
-        html = html.replace("{options}", options)
+        if "exam_number" in params and not results.is_cached(params["exam_number"][0],
+                                                             params.get("class_id", [""])[0],
+                                                             params.get("term_id", [""])[0]):
+            wait = ratelimit.check_lookup(self.client_address[0], params["exam_number"][0])
+            if wait:
+                ratelimit.send_too_many_requests(self, wait)
+                return
+
+        # Show form for students to enter exam number, class and term
+        if not params:
+            self.send_html(render.fragments.get("results_page", build_results_page), static=True)
+            return
+        term = terms.find(params.get("term_id", [""])[0])
+        if term is None or term.is_current:
+            html = render.fragments.get("results_form", build_results_form)
+        else:
+            html = build_results_form(render.select(render.term_options(), term.term_id))
 
         # If parameters provided, show results
-        if "exam_number" in params and "class_id" in params:
+        if "exam_number" in params and "class_id" in params and term is not None:
             exam_number = params["exam_number"][0]
             class_id = params["class_id"][0]
-            conn = sqlite3.connect("gradesystem.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT StudentID FROM Student WHERE ExamNumber=? AND ClassID=?", (exam_number, class_id))
-            row = cursor.fetchone()
-            if row:
-                student_id = row[0]
-                cursor.execute("SELECT Subject, Score FROM Results WHERE StudentID=?", (student_id,))
-                results = cursor.fetchall()
-                if results:
-                    table_html = "<table><tr><th>Subject</th><th>Score</th></tr>"
-                    for subj, score in results:
-                        table_html += f"<tr><td>{subj}</td><td>{score}</td></tr>"
-                    table_html += "</table>"
-                else:
-                    table_html = "<p>No results found for this student.</p>"
-            else:
-                table_html = "<p>Student not found. Please check your exam number and class.</p>"
-            conn.close()
-            html += "<h3 style='margin-top:30px;'>Your Results:</h3>" + table_html
+            # Comes from the result cache when possible, so a 304 for an unchanged page costs no DB work
+            entry = results.lookup(exam_number, class_id, term)
+            if entry is not results.NOT_FOUND:
+                # The position also moves when a classmate's marks change,
+                # so the class's ranking version is part of the validators
+                class_version, class_changed = ranking.index.version(class_id, term)
+                etag = httpcache.make_etag(entry.student_id, entry.version, term.term_id, class_version,
+                                           render.fragments.get("results_form_tag", results_form_tag))
+                last_modified = max(entry.updated_at or 0, class_changed) or None
+                if httpcache.not_modified(self.headers, etag, last_modified):
+                    httpcache.send_not_modified(self, etag, last_modified)
+                    return
+                position = ranking.index.position(entry.student_id, class_id, term)
+                streaming.send_stream(self, render.stream_page(results_page_parts(html, entry, term, position)),
+                                      validators=(etag, last_modified))
+                return
+            html += "<h3 style='margin-top:30px;'>Your Results:</h3>" + \
+                "<p>Student not found. Please check your exam number and class.</p>"
+        elif "exam_number" in params:
+            html += "<h3 style='margin-top:30px;'>Your Results:</h3><p>Term not found.</p>"
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(get_html(html).encode())
+        self.send_html(render.page(html))
 
 # Initialize database and run server
 def main():
+    parser = argparse.ArgumentParser(description="Kafumbwe Grade Book server")
+    serving.add_arguments(parser)
+    parser.add_argument("--session-ttl", type=int, default=auth.SESSION_TTL,
+                        help="seconds a login stays valid (default: %(default)s)")
+    parser.add_argument("--hash-cost", type=int, default=None,
+                        help="password hash cost: log2 N for scrypt, iterations for pbkdf2_sha256 "
+                             f"(default: {auth.cost}); passwords are re-hashed at their next login")
+    args = parser.parse_args()
+    metrics.configure(slow_request_ms=args.slow_ms, routes=ROUTES)
+    auth.configure(hash_cost=args.hash_cost, session_ttl=args.session_ttl)
+    ratelimit.configure(args.rate_limit)
+    compression.configure(args.gzip)
+    writer.configure(args.group_commit, args.flush_ms / 1000)
+    startup.configure(args.warm)
+    summary.install()
     init_db()
-    PORT = 3000
-    with socketserver.TCPServer(("", PORT), GradeSystemHandler) as server:
-        print(f"Server running at http://localhost:{3000}")
+    startup.before_listening()
+    if args.use_async:
+        from gradebook import aserver
+        print(f"Server running at http://localhost:{args.port} (asyncio, {args.workers} database thread(s))")
         print("Open your browser and visit that URL.")
-        server.serve_forever()
+        aserver.run(GradeSystemHandler, args.port, workers=args.workers, on_start=startup.listening)
+        return
+    server = serving.PooledHTTPServer(("", args.port), GradeSystemHandler,
+                                      workers=args.workers, backlog=args.backlog)
+    print(f"Server running at http://localhost:{args.port}")
+    print(f"{args.processes} process(es) x {args.workers} worker thread(s), backlog {args.backlog}")
+    print("Open your browser and visit that URL.")
+    serving.serve(server, processes=args.processes, on_start=startup.listening)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
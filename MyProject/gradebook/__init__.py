@@ -0,0 +1 @@
+# Shared building blocks for the Kafumbwe Grade Book front ends (How.py and viewResults.py)
@@ -0,0 +1,240 @@
+# Class-wide statistics for one term: positions, per-subject
+# mean/median/std-dev, grade distributions and pass rates.
+#
+# Everything is computed with a handful of set-based queries over the term's
+# results (or just the classes that changed) rather than per student. Results
+# are kept in memory per term and only the classes marked dirty by a write
+# are recomputed on the next read.
+import math
+import threading
+import time
+
+from gradebook import db, hooks, terms
+
+PASS_MARK = 40
+
+# (minimum score, grade), highest first
+GRADE_BANDS = (
+    (75, "A"),
+    (65, "B"),
+    (50, "C"),
+    (40, "D"),
+    (0, "F"),
+)
+
+# Writes from other processes are picked up by a full refresh this often
+MAX_AGE = 60.0
+
+# SQLite limits the number of ? placeholders in one statement
+_IN_CHUNK = 500
+
+_GRADE_CASE = "CASE " + " ".join(f"WHEN r.Score >= {minimum} THEN '{grade}'" for minimum, grade in GRADE_BANDS[:-1]) + \
+    f" ELSE '{GRADE_BANDS[-1][1]}' END"
+
+
+def _filter(term, class_ids):
+    if class_ids is None:
+        return "WHERE r.TermID = ?", (term.term_id,)
+    placeholders = ",".join("?" * len(class_ids))
+    return (f"WHERE s.ClassID IN ({placeholders}) AND r.TermID = ?",
+            tuple(db.class_id_value(class_id) for class_id in class_ids) + (term.term_id,))
+
+
+def _positions(conn, table, where, params):
+    return conn.execute(f"""
+        WITH averages AS (
+            SELECT s.ClassID, s.StudentID, s.ExamNumber, s.Name,
+                   COUNT(*) AS subjects, SUM(r.Score) AS total, AVG(r.Score) AS average
+            FROM Student s JOIN {table} r ON r.StudentID = s.StudentID
+            {where}
+            GROUP BY s.StudentID
+        )
+        SELECT CAST(ClassID AS TEXT), StudentID, ExamNumber, Name, subjects, total, average,
+               RANK() OVER (PARTITION BY ClassID ORDER BY average DESC) AS position
+        FROM averages
+        ORDER BY ClassID, position, Name
+    """, params)
+
+
+def _subject_stats(conn, table, where, params):
+    return conn.execute(f"""
+        WITH ordered AS (
+            SELECT s.ClassID, r.Subject, r.Score,
+                   ROW_NUMBER() OVER (PARTITION BY s.ClassID, r.Subject ORDER BY r.Score) AS rn,
+                   COUNT(*) OVER (PARTITION BY s.ClassID, r.Subject) AS n
+            FROM {table} r JOIN Student s ON s.StudentID = r.StudentID
+            {where}
+        )
+        SELECT CAST(ClassID AS TEXT), Subject, COUNT(*), AVG(Score), AVG(Score * Score), MIN(Score), MAX(Score),
+               SUM(Score >= {PASS_MARK}),
+               AVG(CASE WHEN rn IN ((n + 1) / 2, (n + 2) / 2) THEN Score END)
+        FROM ordered
+        GROUP BY ClassID, Subject
+        ORDER BY ClassID, Subject
+    """, params)
+
+
+def _grade_counts(conn, table, where, params):
+    return conn.execute(f"""
+        SELECT CAST(s.ClassID AS TEXT), {_GRADE_CASE} AS grade, COUNT(*)
+        FROM {table} r JOIN Student s ON s.StudentID = r.StudentID
+        {where}
+        GROUP BY s.ClassID, grade
+    """, params)
+
+
+def _empty_class(class_id, class_name, term):
+    return {
+        "class_id": class_id,
+        "class_name": class_name,
+        "term_id": term.term_id,
+        "term": f"{term.year} {term.name}",
+        "students": 0,
+        "average": None,
+        "pass_rate": None,
+        "positions": [],
+        "subjects": [],
+        "grades": {grade: 0 for _, grade in GRADE_BANDS},
+    }
+
+
+# Statistics for one term (terms.Term) of the given classes (all classes if
+# class_ids is None), keyed by ClassID as text
+def compute(conn, term, class_ids=None):
+    names = {str(class_id): name for class_id, name in conn.execute("SELECT ClassID, ClassName FROM Class")}
+    table = terms.results_table(conn, term)
+    stats = {}
+
+    def for_class(class_id):
+        if class_id not in stats:
+            stats[class_id] = _empty_class(class_id, names.get(class_id, class_id), term)
+        return stats[class_id]
+
+    chunks = [None] if class_ids is None else \
+        [sorted(class_ids)[i:i + _IN_CHUNK] for i in range(0, len(class_ids), _IN_CHUNK)]
+    for chunk in chunks:
+        where, params = _filter(term, chunk)
+        for class_id, student_id, exam_number, name, subjects, total, average, position in \
+                _positions(conn, table, where, params):
+            for_class(class_id)["positions"].append({
+                "position": position,
+                "student_id": student_id,
+                "exam_number": str(exam_number),
+                "name": name,
+                "subjects": subjects,
+                "total": total,
+                "average": round(average, 2),
+                "status": "Passed" if average >= PASS_MARK else "Failed",
+            })
+        for class_id, subject, n, mean, mean_sq, low, high, passed, median in \
+                _subject_stats(conn, table, where, params):
+            for_class(class_id)["subjects"].append({
+                "subject": subject,
+                "count": n,
+                "mean": round(mean, 2),
+                "median": median,
+                "std_dev": round(math.sqrt(max(0.0, mean_sq - mean * mean)), 2),
+                "min": low,
+                "max": high,
+                "pass_rate": round(passed / n, 4),
+            })
+        for class_id, grade, count in _grade_counts(conn, table, where, params):
+            for_class(class_id)["grades"][grade] = count
+
+    for class_stats in stats.values():
+        positions = class_stats["positions"]
+        class_stats["students"] = len(positions)
+        if positions:
+            class_stats["average"] = round(sum(p["average"] for p in positions) / len(positions), 2)
+            class_stats["pass_rate"] = round(sum(p["status"] == "Passed" for p in positions) / len(positions), 4)
+
+    # Classes without any results still get a (empty) row
+    wanted = names.keys() if class_ids is None else class_ids
+    for class_id in wanted:
+        for_class(class_id)
+    return stats
+
+
+# One term's statistics, the classes written to since and when they were
+# last computed in full
+class _TermStats:
+    __slots__ = ("stats", "dirty", "refreshed_at")
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.dirty = set()
+        self.refreshed_at = time.monotonic()
+
+
+# Keeps computed statistics per term and refreshes only what writes have touched.
+# compute() runs outside the lock, so readers of other terms and the writer
+# thread's mark_dirty() never wait for a recompute; the lock only guards the
+# bookkeeping and the swap of the result.
+class AnalyticsEngine:
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._terms = {}   # TermID -> _TermStats
+        self._computing = set()  # _TermStats of full refreshes under way, not yet in _terms
+        self._lock = threading.Lock()
+
+    # Writes do not say which term they touched, so the classes are
+    # recomputed in every term kept (and in every term being computed, whose
+    # queries may have run before the write)
+    def mark_dirty(self, class_ids=None):
+        with self._lock:
+            if class_ids is None:
+                self._terms.clear()
+                for fresh in self._computing:
+                    fresh.refreshed_at = float("-inf")
+                return
+            class_ids = {str(class_id) for class_id in class_ids}
+            for cached in (*self._terms.values(), *self._computing):
+                cached.dirty.update(class_ids)
+
+    def refresh(self, term, conn=None):
+        conn = conn or db.get_connection()
+        with self._lock:
+            cached = self._terms.get(term.term_id)
+            if cached is None or time.monotonic() - cached.refreshed_at > self.max_age:
+                cached, dirty = _TermStats({}), None
+                self._computing.add(cached)
+            elif cached.dirty:
+                dirty, cached.dirty = cached.dirty, set()
+            else:
+                return cached.stats
+        if dirty is None:
+            try:
+                cached.stats = compute(conn, term)
+            finally:
+                with self._lock:
+                    self._computing.discard(cached)
+            with self._lock:
+                self._terms[term.term_id] = cached
+            return cached.stats
+        try:
+            stats = compute(conn, term, dirty)
+        except BaseException:
+            with self._lock:
+                cached.dirty.update(dirty)
+            raise
+        with self._lock:
+            stats = {**cached.stats, **stats}
+            # Dropped if mark_dirty(None) threw the term away meanwhile
+            if self._terms.get(term.term_id) is cached:
+                cached.stats = stats
+        return stats
+
+    # {ClassID (text): statistics} for the term, recomputing dirty classes first
+    def snapshot(self, term):
+        cached = self._terms.get(term.term_id)
+        if cached is None or cached.dirty or time.monotonic() - cached.refreshed_at > self.max_age:
+            return self.refresh(term)
+        return cached.stats
+
+
+engine = AnalyticsEngine()
+
+
+@hooks.on_results_changed
+def _results_changed(exam_numbers, class_ids):
+    engine.mark_dirty(class_ids)
@@ -0,0 +1,288 @@
+# asyncio front end for the existing BaseHTTPRequestHandler classes.
+#
+# Connections are coroutines, not threads: reading requests and writing
+# responses happens on the event loop, so thousands of idle keep-alive or
+# slow connections cost almost nothing. Once a request has fully arrived it
+# is handed, as bytes, to the unchanged handler class (same routes, same page
+# builders) running on a small thread pool, which is where SQLite is used.
+#
+# Request bodies are buffered (up to MAX_BODY) before the handler runs, so
+# very large bulk imports should go through the threaded server or the CLI.
+# Bodies sent with Transfer-Encoding: chunked are decoded and handed on with
+# a Content-Length; any other transfer coding is answered 501, and a request
+# carrying both framings 400, closing the connection either way.
+# Responses are sent as the handler flushes them, so streamed pages (see
+# gradebook.streaming) reach the client chunk by chunk.
+import asyncio
+import io
+import signal
+import socket
+import sys
+import traceback
+
+from gradebook import serving
+
+KEEPALIVE_TIMEOUT = 30.0     # idle time allowed between requests on one connection
+HEADER_TIMEOUT = 30.0        # time allowed to send a complete request
+MAX_HEADER = 64 * 1024
+MAX_BODY = 16 * 1024 * 1024
+MAX_CONNECTIONS = 10000
+
+_NO_BODY_STATUSES = (b"204", b"304")
+
+
+def _simple_response(status, reason):
+    body = f"<h1>{status} {reason}</h1>".encode()
+    return (f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/html\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n").encode() + body
+
+
+# A request that cannot be read; answered with `status` and the connection
+# closed, since where the next request would start is unknown
+class _Refused(Exception):
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+# wfile for a handler running on a worker thread: output is collected until
+# the handler flushes it (or it grows past FLUSH_SIZE), then written by the
+# event loop. The worker waits for the write to drain, so a slow client
+# applies backpressure instead of the response piling up in memory.
+class _LoopWriter:
+    FLUSH_SIZE = 64 * 1024
+
+    def __init__(self, loop, writer):
+        self._loop = loop
+        self._writer = writer
+        self._buffer = []
+        self._size = 0
+        self.head = None
+
+    def write(self, data):
+        data = bytes(data)
+        if self.head is None:
+            self.head = data
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.FLUSH_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data, self._buffer, self._size = b"".join(self._buffer), [], 0
+        asyncio.run_coroutine_threadsafe(self._send(data), self._loop).result()
+
+    async def _send(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+# Stands in for the socketserver instance handlers expect in self.server
+class _ServerInfo:
+    def __init__(self, server_address):
+        self.server_address = server_address
+        self.server_name = socket.getfqdn(server_address[0] or "localhost")
+        self.server_port = server_address[1]
+
+
+class AsyncHTTPServer:
+    def __init__(self, server_address, handler_class, workers=serving.DEFAULT_WORKERS,
+                 max_connections=MAX_CONNECTIONS):
+        # Same handler, but speaking HTTP/1.1 so connections can be kept alive
+        self.handler_class = type(handler_class.__name__, (handler_class,), {"protocol_version": "HTTP/1.1"})
+        self.server_address = server_address
+        self.workers = max(1, int(workers))
+        self.max_connections = max_connections
+        self.info = _ServerInfo(server_address)
+        self.connections = 0
+        self._server = None
+        self._executor = None
+        self._tasks = set()
+        self._idle = {}  # connection task -> writer, while waiting for its next request
+        self._closing = False
+
+    # Runs the unchanged handler on a worker thread, reading the buffered
+    # request and writing through the event loop. Returns whether the
+    # connection must close afterwards.
+    def _run_handler(self, request, client_address, wfile):
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.request = None
+        handler.server = self.info
+        handler.client_address = client_address
+        handler.rfile = io.BytesIO(request)
+        handler.wfile = wfile
+        handler.close_connection = True
+        try:
+            handler.handle_one_request()
+            wfile.flush()
+        except ConnectionError:
+            return True
+        except Exception:
+            sys.stderr.write(f"Exception while handling a request from {client_address}\n")
+            traceback.print_exc()
+            return True
+        return handler.close_connection or not self._has_framing(wfile.head or b"")
+
+    # A kept-alive response must say where it ends
+    @staticmethod
+    def _has_framing(response):
+        head = response.split(b"\r\n\r\n", 1)[0].lower()
+        status = head[9:12]
+        return status in _NO_BODY_STATUSES or b"\r\ncontent-length:" in head or b"\r\ntransfer-encoding:" in head
+
+    async def _read_request(self, reader, first):
+        timeout = KEEPALIVE_TIMEOUT if not first else HEADER_TIMEOUT
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        # A request has started: shutdown now lets it finish
+        self._idle.pop(asyncio.current_task(), None)
+        length = encoding = None
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                if length is not None or not value.strip().isdigit():
+                    raise _Refused(400, "Bad Request")
+                length = int(value.strip())
+            elif name == b"transfer-encoding":
+                encoding = value.strip().lower()
+        if encoding is not None:
+            # Both framings at once is how requests get smuggled past proxies
+            if length is not None:
+                raise _Refused(400, "Bad Request")
+            if encoding != b"chunked":
+                raise _Refused(501, "Not Implemented")
+            body = await asyncio.wait_for(self._read_chunked(reader), HEADER_TIMEOUT)
+            return self._with_length(head, len(body)) + body
+        if length is not None and length > MAX_BODY:
+            raise _Refused(413, "Request Entity Too Large")
+        body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT) if length else b""
+        return head + body
+
+    # The body of a Transfer-Encoding: chunked request, decoded; trailers are
+    # read and dropped
+    @staticmethod
+    async def _read_chunked(reader):
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            try:
+                chunk_size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise _Refused(400, "Bad Request") from None
+            if chunk_size < 0:
+                raise _Refused(400, "Bad Request")
+            if chunk_size == 0:
+                break
+            size += chunk_size
+            if size > MAX_BODY:
+                raise _Refused(413, "Request Entity Too Large")
+            chunk = await reader.readexactly(chunk_size + 2)
+            if chunk[-2:] != b"\r\n":
+                raise _Refused(400, "Bad Request")
+            chunks.append(chunk[:-2])
+        while await reader.readuntil(b"\r\n") != b"\r\n":
+            pass
+        return b"".join(chunks)
+
+    # The handlers read bodies by Content-Length, so a decoded chunked body
+    # is passed on as if it had been sent with one
+    @staticmethod
+    def _with_length(head, length):
+        lines = [line for line in head[:-4].split(b"\r\n")
+                 if line.partition(b":")[0].strip().lower() != b"transfer-encoding"]
+        return b"\r\n".join(lines) + f"\r\nContent-Length: {length}\r\n\r\n".encode()
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self.connections += 1
+        client_address = writer.get_extra_info("peername") or ("", 0)
+        loop = asyncio.get_running_loop()
+        try:
+            if self.connections > self.max_connections:
+                writer.write(serving.REJECT_RESPONSE)
+                await writer.drain()
+                return
+            first = True
+            while not self._closing:
+                self._idle[task] = writer
+                try:
+                    request = await self._read_request(reader, first)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    writer.write(_simple_response(413, "Request Entity Too Large"))
+                    await writer.drain()
+                    return
+                except _Refused as refused:
+                    writer.write(_simple_response(refused.status, refused.reason))
+                    await writer.drain()
+                    return
+                first = False
+                wfile = _LoopWriter(loop, writer)
+                close = await loop.run_in_executor(self._executor, self._run_handler,
+                                                   request, client_address[:2], wfile)
+                if close:
+                    return
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by shutdown(): end quietly, as for a closed connection
+            if not self._closing:
+                raise
+        finally:
+            self.connections -= 1
+            self._tasks.discard(task)
+            self._idle.pop(task, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # `on_start()` runs once the socket is accepting connections
+    async def serve(self, stop_event=None, on_start=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="grade-async")
+        host, port = self.server_address
+        self._server = await asyncio.start_server(self._handle_connection, host or None, port,
+                                                  limit=MAX_HEADER, backlog=1024, reuse_address=True)
+        stop_event = stop_event or asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        if on_start is not None:
+            on_start()
+        try:
+            await stop_event.wait()
+        finally:
+            await self.shutdown()
+
+    # Stop accepting and close idle connections straight away; requests in
+    # flight get `grace` seconds to finish before their connections are dropped
+    async def shutdown(self, grace=5.0):
+        self._closing = True
+        self._server.close()
+        for writer in list(self._idle.values()):
+            writer.close()
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=grace)
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+
+def run(handler_class, port, workers=serving.DEFAULT_WORKERS, host="", on_start=None):
+    asyncio.run(AsyncHTTPServer((host, port), handler_class, workers=workers).serve(on_start=on_start))
@@ -0,0 +1,71 @@
+# Stylesheet and scripts, served from /static/.
+#
+# Each file in gradebook/static is read (and gzipped) once at import and
+# served under a URL carrying a hash of its content, e.g.
+# /static/style.3f2a9c01b4de.css, with a far-future Cache-Control. Browsers
+# fetch it once and keep it; a changed file gets a new URL in the pages, so
+# nobody is left with a stale copy.
+import collections
+import hashlib
+import os
+
+from gradebook import compression, httpcache
+
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+PREFIX = "/static/"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+Asset = collections.namedtuple("Asset", "url content_type body gzipped etag")
+
+
+def _load(filename):
+    with open(os.path.join(DIRECTORY, filename), "rb") as f:
+        body = f.read()
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    stem, ext = os.path.splitext(filename)
+    return Asset(f"{PREFIX}{stem}.{digest}{ext}", _TYPES[ext], body, compression.gzip(body, level=9), f'"{digest}"')
+
+
+_by_name = {name: _load(name) for name in sorted(os.listdir(DIRECTORY)) if os.path.splitext(name)[1] in _TYPES}
+_by_url = {asset.url: asset for asset in _by_name.values()}
+
+
+# Fingerprinted URL of a file in gradebook/static
+def url(name):
+    return _by_name[name].url
+
+
+# Contents of a file in gradebook/static, for pages that must stand alone
+def text(name):
+    return _by_name[name].body.decode()
+
+
+def send(handler, path):
+    asset = _by_url.get(path)
+    if asset is None:
+        handler.send_response(404)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
+        return
+    if httpcache.not_modified(handler.headers, asset.etag):
+        handler.send_response(304)
+        handler.send_header("ETag", asset.etag)
+        handler.send_header("Cache-Control", CACHE_CONTROL)
+        handler.send_header("Vary", compression.VARY)
+        handler.end_headers()
+        return
+    gzipped = compression.accepts_gzip(handler.headers)
+    body = asset.gzipped if gzipped else asset.body
+    handler.send_response(200)
+    handler.send_header("Content-type", asset.content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.send_header("ETag", asset.etag)
+    handler.send_header("Cache-Control", CACHE_CONTROL)
+    compression.send_headers(handler, "gzip" if gzipped else None)
+    handler.end_headers()
+    handler.wfile.write(body)
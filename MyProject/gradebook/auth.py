@@ -0,0 +1,244 @@
+# Password hashing and login sessions.
+#
+# Passwords are stored as "<algorithm>$<cost>$<salt>$<hash>" (scrypt, or
+# PBKDF2-SHA256 where OpenSSL has no scrypt). A plaintext password left over
+# from before hashing still works once and is replaced by a hash on that login,
+# as is a hash made with an older cost.
+#
+# A login creates a session held in memory, so checking it on later requests
+# is a signature check and a dict lookup, never a database query. The browser
+# gets a cookie carrying the session id, role and expiry, signed with HMAC.
+# Forked server processes (--processes) share the signing key, so a cookie
+# issued by one is accepted by the others; logging out removes the session
+# from the process that handled it and clears the cookie.
+#
+# The key is random per server start (all sessions end on restart) unless
+# GRADEBOOK_SECRET is set.
+#
+#   python -m gradebook.auth set-password teacher1          prompts for the new password
+#   python -m gradebook.auth set-password pupil7 --role pupil
+import argparse
+import base64
+import collections
+import getpass
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+
+from gradebook import db
+
+COOKIE_NAME = "gradebook_session"
+
+ALGORITHMS = ("scrypt", "pbkdf2_sha256")
+# scrypt: log2 of N (r=8, p=1); pbkdf2_sha256: iterations
+DEFAULT_COST = {"scrypt": 14, "pbkdf2_sha256": 600000}
+
+SESSION_TTL = 8 * 60 * 60
+SWEEP_INTERVAL = 60.0
+
+algorithm = "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256"
+cost = DEFAULT_COST[algorithm]
+
+_secret = os.environ.get("GRADEBOOK_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+# Choose the hash for new passwords (existing ones are upgraded on login) and
+# how long sessions last. Call before serving.
+def configure(hash_algorithm=None, hash_cost=None, session_ttl=None):
+    global algorithm, cost
+    if hash_algorithm is not None:
+        if hash_algorithm not in ALGORITHMS:
+            raise ValueError(f"hash algorithm must be one of {', '.join(ALGORITHMS)}")
+        algorithm = hash_algorithm
+        cost = DEFAULT_COST[algorithm]
+    if hash_cost is not None:
+        cost = int(hash_cost)
+    if session_ttl is not None:
+        sessions.ttl = session_ttl
+
+
+def _derive(name, work, password, salt):
+    if name == "scrypt":
+        n = 1 << work
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=8, p=1, maxmem=2 * 128 * 8 * n, dklen=32)
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, work)
+
+
+def hash_password(password, hash_algorithm=None, hash_cost=None):
+    name = hash_algorithm or algorithm
+    work = hash_cost if hash_cost is not None else (cost if name == algorithm else DEFAULT_COST[name])
+    salt = secrets.token_bytes(16)
+    return f"{name}${work}${salt.hex()}${_derive(name, work, password, salt).hex()}"
+
+
+def _parse(stored):
+    parts = str(stored).split("$")
+    if len(parts) != 4 or parts[0] not in ALGORITHMS:
+        return None
+    try:
+        return parts[0], int(parts[1]), bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+    except ValueError:
+        return None
+
+
+def verify_password(stored, password):
+    if stored is None:
+        # Same work as a real check, so unknown usernames take as long as wrong passwords
+        _derive(algorithm, cost, password, b"\0" * 16)
+        return False
+    parsed = _parse(stored)
+    if parsed is None:
+        return hmac.compare_digest(str(stored).encode(), password.encode())
+    name, work, salt, expected = parsed
+    return hmac.compare_digest(_derive(name, work, password, salt), expected)
+
+
+def is_hashed(stored):
+    return _parse(stored) is not None
+
+
+# Whether a stored password should be re-hashed with the current settings
+def needs_rehash(stored):
+    parsed = _parse(stored)
+    return parsed is None or parsed[:2] != (algorithm, cost)
+
+
+# `cookie` is the signed value the browser sends back (see SessionStore.from_cookie)
+Session = collections.namedtuple("Session", "cookie username role expires")
+
+
+def _sign(payload):
+    return base64.urlsafe_b64encode(hmac.digest(_secret, payload, "sha256")).rstrip(b"=")
+
+
+# Sessions in memory, keyed by their cookie value, so a request with a known
+# cookie costs one dict lookup. Expired sessions are dropped when looked up
+# and by a sweep that runs at most every `sweep_interval` seconds,
+# piggybacked on normal calls (no thread, so it survives forking).
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._logged_out = {}  # cookie -> expiry, so a logged-out cookie is not taken back in
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + sweep_interval
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # The cookie carries a random session id, the role, expiry and username,
+    # signed so that any process holding the key can trust it
+    def create(self, username, role):
+        expires = int(time.time() + self.ttl)
+        payload = base64.urlsafe_b64encode(
+            f"{secrets.token_urlsafe(24)}:{role}:{expires}:{username}".encode()).rstrip(b"=")
+        session = Session((payload + b"." + _sign(payload)).decode(), username, role, expires)
+        with self._lock:
+            self._sessions[session.cookie] = session
+        self._maybe_sweep()
+        return session
+
+    # Session for a cookie value, or None if it is forged, expired or logged
+    # out. A valid cookie issued by another server process is taken in.
+    def from_cookie(self, value):
+        now = time.time()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        session = self._sessions.get(value)
+        if session is not None:
+            if session.expires > now:
+                return session
+            self.logout(session)
+            return None
+        return self._adopt(value, now)
+
+    def _adopt(self, value, now):
+        payload, _, signature = str(value or "").encode().partition(b".")
+        if not payload or not hmac.compare_digest(_sign(payload), signature):
+            return None
+        try:
+            _, role, expires, username = base64.urlsafe_b64decode(
+                payload + b"=" * (-len(payload) % 4)).decode().split(":", 3)
+            expires = int(expires)
+        except ValueError:
+            return None
+        if expires <= now or value in self._logged_out:
+            return None
+        session = Session(value, username, role, expires)
+        with self._lock:
+            self._sessions[value] = session
+        return session
+
+    def logout(self, session):
+        with self._lock:
+            self._sessions.pop(session.cookie, None)
+            self._logged_out[session.cookie] = session.expires
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [cookie for cookie, session in self._sessions.items() if session.expires <= now]
+            for cookie in expired:
+                del self._sessions[cookie]
+            for cookie in [cookie for cookie, expires in self._logged_out.items() if expires <= now]:
+                del self._logged_out[cookie]
+            self._next_sweep = now + self.sweep_interval
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if time.time() >= self._next_sweep:
+            self.sweep()
+
+
+sessions = SessionStore()
+
+
+# Set a user's password, adding the user if needed. Returns True if added.
+def set_password(conn, username, password, role=None):
+    with conn:
+        hashed = hash_password(password)
+        cursor = conn.execute("UPDATE Teachers SET Password=?, Role=COALESCE(?, Role) WHERE Username=?",
+                              (hashed, role, username))
+        if cursor.rowcount:
+            return False
+        conn.execute("INSERT INTO Teachers (Username, Password, Role) VALUES (?, ?, ?)",
+                     (username, hashed, role or "teacher"))
+        return True
+
+
+def main(argv=None):
+    from gradebook import migrations
+
+    parser = argparse.ArgumentParser(description="Manage login accounts")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default=algorithm,
+                        help="password hash (default: %(default)s)")
+    parser.add_argument("--cost", type=int, help="hash cost: log2 N for scrypt, iterations for pbkdf2_sha256")
+    commands = parser.add_subparsers(dest="command", required=True)
+    set_pw = commands.add_parser("set-password", help="set a password, adding the account if needed")
+    set_pw.add_argument("username")
+    set_pw.add_argument("--role", choices=["teacher", "pupil"], help="role (default: teacher for new accounts)")
+    args = parser.parse_args(argv)
+
+    configure(hash_algorithm=args.algorithm, hash_cost=args.cost)
+    password = getpass.getpass("New password: ")
+    if not password or password != getpass.getpass("Repeat password: "):
+        print("Passwords are empty or do not match", file=sys.stderr)
+        return 1
+    conn = db.connect(args.db)
+    try:
+        migrations.migrate(conn)
+        added = set_password(conn, args.username, password, args.role)
+    finally:
+        conn.close()
+    print(f"{'Added' if added else 'Updated'} {args.username}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,815 @@
+# Benchmarks for the grade book servers.
+#
+#   python -m gradebook.benchmark serve --processes 1 2 4 --workers 8 32
+#   python -m gradebook.benchmark render
+#   python -m gradebook.benchmark async --idle 0 1000 5000
+#   python -m gradebook.benchmark load --concurrency 50 --output run.json --compare last.json
+#   python -m gradebook.benchmark seed --db school.db
+#   python -m gradebook.benchmark auth --costs 12 14 15
+#   python -m gradebook.benchmark ratelimit
+#   python -m gradebook.benchmark batch --pupils 5000 --batch-size 500
+#   python -m gradebook.benchmark writes --concurrency 50 --flush-ms 0 2 10
+#   python -m gradebook.benchmark ranking --students 10000
+#   python -m gradebook.benchmark startup --restarts 5
+#
+# Run from the MyProject directory. Servers are started as subprocesses in a
+# scratch directory so the real gradesystem.db is never touched.
+import argparse
+import http.client
+import json
+import platform
+import random
+import sqlite3
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib.parse
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15.0, poll=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(poll)
+    raise RuntimeError(f"server did not start listening on port {port}")
+
+
+# Start one of the front-end scripts (How.py / viewResults.py) on a free port
+def start_server(script, extra_args, cwd, poll=0.05):
+    port = free_port()
+    cmd = [sys.executable, os.path.join(PROJECT_DIR, script), "--port", str(port)] + list(extra_args)
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, poll=poll)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc, port
+
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# A request is either a GET path or (method, path, form body)
+def _as_request(item):
+    if isinstance(item, str):
+        return "GET", item, None
+    return item
+
+
+def _endpoint(path):
+    return path.split("?", 1)[0]
+
+
+def _client_thread(port, requests, start, count, latencies, errors, extra_headers=None):
+    for i in range(start, start + count):
+        method, path, body = _as_request(requests[i % len(requests)])
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body is not None else {}
+        headers.update(extra_headers or {})
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status >= 500:
+                errors.append((_endpoint(path), response.status))
+                continue
+        except OSError as exc:
+            errors.append((_endpoint(path), type(exc).__name__))
+            continue
+        latencies.append((_endpoint(path), time.perf_counter() - start))
+
+
+def _client_process(port, requests, threads, per_thread, offset, headers=None):
+    latencies, errors = [], []
+    # Each client starts at a different point so the request mix is spread out
+    workers = [threading.Thread(target=_client_thread,
+                                args=(port, requests, (offset + n) * per_thread, per_thread, latencies, errors,
+                                      headers))
+               for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _latency_stats(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "req_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+# Fire `total` requests (see _as_request) at the server from `concurrency`
+# simultaneous clients, each sending `headers` too. Clients are spread over
+# several processes so the load generator itself is not limited to one core.
+# The result has overall stats plus the same stats per endpoint under
+# "endpoints".
+def run_load(port, requests, concurrency, total, client_processes=None, headers=None):
+    client_processes = max(1, min(concurrency, client_processes or os.cpu_count() or 1))
+    threads = [concurrency // client_processes + (1 if i < concurrency % client_processes else 0)
+               for i in range(client_processes)]
+    per_thread = max(1, total // concurrency)
+    offsets = [sum(threads[:i]) for i in range(len(threads))]
+    started = time.perf_counter()
+    with multiprocessing.Pool(client_processes) as pool:
+        parts = pool.starmap(_client_process, [(port, requests, n, per_thread, offset, headers)
+                                               for n, offset in zip(threads, offsets) if n])
+    elapsed = time.perf_counter() - started
+    latencies = [lat for part, _ in parts for lat in part]
+    errors = [err for _, part in parts for err in part]
+    stats = _latency_stats([lat for _, lat in latencies], errors, elapsed)
+    stats["endpoints"] = {
+        endpoint: _latency_stats([lat for name, lat in latencies if name == endpoint],
+                                 [err for name, err in errors if name == endpoint], elapsed)
+        for endpoint in sorted({name for name, _ in latencies} | {name for name, _ in errors})
+    }
+    return stats
+
+
+# Log in and return the Cookie header that keeps the session
+def login_cookie(port, username="teacher1", password="pass123"):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("POST", "/login", body=urllib.parse.urlencode({"username": username, "password": password}),
+                 headers={"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    cookie = response.getheader("Set-Cookie")
+    if not cookie:
+        raise RuntimeError(f"login as {username} failed (status {response.status})")
+    return {"Cookie": cookie.split(";", 1)[0]}
+
+
+def print_row(label, stats):
+    print(f"{label:<28} {stats['req_per_s']:>9.1f} req/s  p50 {stats['p50_ms']:>7.1f} ms  "
+          f"p95 {stats['p95_ms']:>7.1f} ms  p99 {stats['p99_ms']:>7.1f} ms  errors {stats['errors']}")
+
+
+# Compare req/s on /view_results across process and worker counts
+def bench_serve(args):
+    paths = ["/view_results?exam_number=EXAM001&class_id=1", "/view_results?exam_number=EXAM002&class_id=2"]
+    print(f"{args.script}: {args.concurrency} concurrent clients, {args.requests} requests per run, "
+          f"{os.cpu_count()} CPU(s)")
+    with tempfile.TemporaryDirectory() as scratch:
+        for processes in args.processes:
+            for workers in args.workers:
+                proc, port = start_server(args.script, ["--workers", str(workers), "--processes", str(processes),
+                                                        "--backlog", str(args.backlog), "--no-rate-limit"], scratch)
+                try:
+                    run_load(port, paths, min(args.concurrency, 8), 50)  # warm up
+                    stats = run_load(port, paths, args.concurrency, args.requests)
+                finally:
+                    stop_server(proc)
+                print_row(f"processes={processes} workers={workers}", stats)
+
+
+# Time page rendering with and without the fragment cache
+def bench_render(args):
+    import How
+    from gradebook import db, migrations, render
+
+    with tempfile.TemporaryDirectory() as scratch:
+        db.DB_PATH = os.path.join(scratch, "gradesystem.db")
+        conn = db.connect()
+        migrations.migrate(conn)
+        conn.executemany("INSERT OR IGNORE INTO Class (ClassName) VALUES (?)",
+                         [(f"Form {n}",) for n in range(3, args.classes + 1)])
+        conn.commit()
+        conn.close()
+
+        def uncached_teacher():
+            render.invalidate_classes()
+            return How.build_teacher_page()
+
+        def uncached_results():
+            render.invalidate_classes()
+            return render.get_html(How.build_results_form()).encode()
+
+        def cached_teacher():
+            return render.fragments.get("teacher_page", How.build_teacher_page)
+
+        def cached_results():
+            return render.page(render.fragments.get("results_form", How.build_results_form))
+
+        print(f"{args.classes} classes, {args.number} renders each")
+        for name, before, after in (("teacher page", uncached_teacher, cached_teacher),
+                                    ("view_results form", uncached_results, cached_results)):
+            before_s = min(timeit.repeat(before, number=args.number, repeat=3)) / args.number
+            after_s = min(timeit.repeat(after, number=args.number, repeat=3)) / args.number
+            print(f"{name:<20} before {before_s * 1e6:>8.1f} us  after {after_s * 1e6:>8.1f} us  "
+                  f"({before_s / after_s:.1f}x)")
+        db.pool.close_all()
+
+
+# Hold `count` connections open that have sent only part of a request, like
+# slow or idle keep-alive clients
+def open_idle_connections(port, count):
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < count + 1024:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, count + 1024), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    idle = []
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        sock.sendall(b"GET /view_results HTTP/1.1\r\nHost: localhost\r\n")
+        idle.append(sock)
+    return idle
+
+
+# Threaded pool vs asyncio server while many idle connections are held open
+def bench_async(args):
+    paths = ["/view_results?exam_number=EXAM001&class_id=1", "/view_results?exam_number=EXAM002&class_id=2"]
+    print(f"{args.script}: {args.concurrency} concurrent clients, {args.requests} requests per run, "
+          f"{args.workers} workers")
+    with tempfile.TemporaryDirectory() as scratch:
+        for mode, extra in (("threaded", []), ("async", ["--async"])):
+            for count in args.idle:
+                proc, port = start_server(args.script, ["--workers", str(args.workers),
+                                                        "--backlog", str(args.backlog), "--no-rate-limit"] + extra,
+                                          scratch)
+                idle = []
+                try:
+                    run_load(port, paths, min(args.concurrency, 8), 50)  # warm up
+                    idle = open_idle_connections(port, count)
+                    stats = run_load(port, paths, args.concurrency, args.requests)
+                finally:
+                    for sock in idle:
+                        sock.close()
+                    stop_server(proc)
+                print_row(f"{mode} idle={count}", stats)
+
+
+SUBJECTS = ("Mathematics", "English", "Science", "Biology", "Chemistry", "Physics", "Geography", "History",
+            "Civic Education", "Religious Education", "Computer Studies", "Agriculture", "Art", "Music", "French")
+
+
+def _exam_number(n):
+    return f"SYN{n:05d}"
+
+
+# Fill a database with a synthetic school: `classes` classes, `students`
+# pupils spread across them and one mark per subject per term (of the
+# current academic year) for each. Migrations are applied first; returns the
+# number of Results rows written.
+def seed_school(db_path, classes=50, students=5000, subjects=15, terms=3, seed=1):
+    from gradebook import db, migrations, summary
+    from gradebook import terms as term_table
+
+    rng = random.Random(seed)
+    conn = db.connect(db_path)
+    try:
+        migrations.migrate(conn)
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO Class (ClassName) VALUES (?)",
+                             [(f"Grade {8 + n // 10} {chr(ord('A') + n % 10)}",) for n in range(classes)])
+            class_ids = [row[0] for row in conn.execute("SELECT ClassID FROM Class ORDER BY ClassID LIMIT ?",
+                                                        (classes,))]
+            conn.executemany("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)",
+                             [(_exam_number(n), f"Pupil {n}", class_ids[n % len(class_ids)])
+                              for n in range(students)])
+            rows = conn.execute("SELECT StudentID FROM Student WHERE ExamNumber LIKE 'SYN%'").fetchall()
+            term_ids = [term_table.resolve(conn, f"Term {t + 1}")[0] for t in range(terms)]
+            marks = [(student_id, SUBJECTS[s % len(SUBJECTS)], rng.randint(10, 100), f"Term {t + 1}", term_ids[t])
+                     for (student_id,) in rows for t in range(terms) for s in range(subjects)]
+            conn.executemany("INSERT INTO Results (StudentID, Subject, Score, Term, TermID) VALUES (?, ?, ?, ?, ?)",
+                             marks)
+        summary.refresh_ranks(conn)
+        return len(marks)
+    finally:
+        conn.close()
+
+
+# The request mix for a seeded school: `weights` maps endpoint to its share
+def school_requests(students, classes, weights, count=2000, seed=2):
+    rng = random.Random(seed)
+    login = urllib.parse.urlencode({"username": "teacher1", "password": "pass123"})
+    builders = {
+        "/login": lambda n: ("POST", "/login", login),
+        "/teacher": lambda n: "/teacher",
+        "/view_results": lambda n: "/view_results?" + urllib.parse.urlencode(
+            {"exam_number": _exam_number(n), "class_id": n % classes + 1}),
+        "/teacher/add_results": lambda n: ("POST", "/teacher/add_results", urllib.parse.urlencode(
+            {"exam_number": _exam_number(n), "name": f"Pupil {n}", "class_id": n % classes + 1,
+             "subject[]": rng.choice(SUBJECTS), "score[]": rng.randint(10, 100)}, doseq=True)),
+    }
+    endpoints = [endpoint for endpoint in weights if weights[endpoint] > 0]
+    picks = rng.choices(endpoints, [weights[endpoint] for endpoint in endpoints], k=count)
+    return [builders[endpoint](rng.randrange(students)) for endpoint in picks]
+
+
+# Time spent in SQLite for one request of each endpoint, measured in this
+# process against the seeded database (writes are rolled back)
+def profile_db(db_path, students, classes, number=200):
+    conn = sqlite3.connect(db_path)
+    rng = random.Random(3)
+    term_id, term = conn.execute("SELECT TermID, Name FROM Term WHERE IsCurrent=1").fetchone()
+
+    def login():
+        conn.execute("SELECT Password, Role FROM Teachers WHERE Username=?", ("teacher1",)).fetchone()
+
+    def teacher():
+        conn.execute("SELECT ClassID, ClassName FROM Class").fetchall()
+
+    def view_results():
+        n = rng.randrange(students)
+        row = conn.execute("""
+            SELECT s.StudentID, s.ResultsVersion, s.ResultsUpdatedAt,
+                   ss.Total, ss.Subjects, ss.Average, ss.Status, ss.ClassRank
+            FROM Student s LEFT JOIN StudentSummary ss ON ss.StudentID = s.StudentID AND ss.TermID = ?
+            WHERE s.ExamNumber=? AND s.ClassID=?
+        """, (term_id, _exam_number(n), n % classes + 1)).fetchone()
+        if row:
+            conn.execute("SELECT Subject, Score FROM Results WHERE StudentID=? AND TermID=?",
+                         (row[0], term_id)).fetchall()
+
+    def add_results():
+        n = rng.randrange(students)
+        row = conn.execute("SELECT StudentID, ClassID FROM Student WHERE ExamNumber=?", (_exam_number(n),)).fetchone()
+        conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term, TermID) VALUES (?, ?, ?, ?, ?)",
+                     (row[0], "Mathematics", 50, term, term_id))
+        conn.rollback()
+
+    try:
+        timings = {}
+        for endpoint, fn in (("/login", login), ("/teacher", teacher), ("/view_results", view_results),
+                             ("/teacher/add_results", add_results)):
+            timings[endpoint] = min(timeit.repeat(fn, number=number, repeat=3)) / number * 1000
+        return timings
+    finally:
+        conn.close()
+
+
+# Per-route {"requests", "sql_queries", "sql_ms"} averages from the
+# server's /metrics (includes the warm-up requests)
+def scrape_metrics(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    conn.close()
+    totals = {}
+    for line in text.splitlines():
+        if line.startswith("#") or "{" not in line:
+            continue
+        name, rest = line.split("{", 1)
+        labels, value = rest.rsplit("} ", 1)
+        route = dict(part.split("=", 1) for part in labels.split(","))['route'].strip('"')
+        entry = totals.setdefault(route, {"requests": 0, "queries": 0, "seconds": 0.0, "statuses": {}})
+        if name == "gradebook_http_requests_total":
+            entry["requests"] += int(value)
+            status = labels.rsplit('status="', 1)[1].rstrip('"')
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + int(value)
+        elif name == "gradebook_sql_queries_total":
+            entry["queries"] += int(value)
+        elif name == "gradebook_sql_seconds_total":
+            entry["seconds"] += float(value)
+    return {route: {"requests": entry["requests"],
+                    "statuses": entry["statuses"],
+                    "sql_queries": entry["queries"] / entry["requests"],
+                    "sql_ms": entry["seconds"] * 1000 / entry["requests"]}
+            for route, entry in totals.items() if entry["requests"]}
+
+
+def _parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        endpoint, _, weight = part.partition("=")
+        weights[endpoint.strip()] = float(weight)
+    return weights
+
+
+def print_comparison(current, previous):
+    print(f"\nCompared with {previous['meta']['started']}:")
+    for endpoint, stats in current["load"]["endpoints"].items():
+        before = previous["load"]["endpoints"].get(endpoint)
+        if not before:
+            continue
+        print(f"{endpoint:<28} req/s {before['req_per_s']:>8.1f} -> {stats['req_per_s']:>8.1f}  "
+              f"p95 {before['p95_ms']:>7.1f} -> {stats['p95_ms']:>7.1f} ms  "
+              f"p99 {before['p99_ms']:>7.1f} -> {stats['p99_ms']:>7.1f} ms")
+
+
+# Seed a synthetic school, drive a mix of endpoints and save the results as JSON
+def bench_load(args):
+    weights = _parse_mix(args.mix)
+    unknown = set(weights) - {"/login", "/teacher", "/view_results", "/teacher/add_results"}
+    if unknown:
+        raise SystemExit(f"unknown endpoint(s) in --mix: {', '.join(sorted(unknown))}")
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = os.path.join(scratch, "gradesystem.db")
+        started = time.perf_counter()
+        rows = seed_school(db_path, args.classes, args.students, args.subjects, args.terms)
+        seed_seconds = time.perf_counter() - started
+        print(f"Seeded {args.classes} classes, {args.students} students, {rows} results in {seed_seconds:.1f}s")
+        db_ms = profile_db(db_path, args.students, args.classes)
+
+        # All clients share one IP, so the per-IP limits would cap the run
+        server_args = ["--workers", str(args.workers), "--backlog", str(args.backlog), "--no-rate-limit"] + \
+            args.server_args
+        proc, port = start_server(args.script, server_args, scratch)
+        try:
+            requests = school_requests(args.students, args.classes, weights, count=max(args.requests, 2000))
+            session = login_cookie(port)
+            run_load(port, requests, min(args.concurrency, 8), 100, headers=session)  # warm up
+            stats = run_load(port, requests, args.concurrency, args.requests, headers=session)
+            server = scrape_metrics(port)
+        finally:
+            stop_server(proc)
+
+    print(f"{args.script}: {args.concurrency} concurrent clients, {args.requests} requests")
+    print_row("all", stats)
+    for endpoint, endpoint_stats in stats["endpoints"].items():
+        print_row(endpoint, endpoint_stats)
+        line = f"{'':<28} db {db_ms[endpoint]:.3f} ms per request in isolation"
+        if endpoint in server:
+            line += (f", {server[endpoint]['sql_ms']:.3f} ms / {server[endpoint]['sql_queries']:.1f} statements "
+                     f"in the server")
+        print(line)
+
+    result = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "script": args.script,
+            "server_args": server_args,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "mix": weights,
+            "school": {"classes": args.classes, "students": args.students, "subjects": args.subjects,
+                       "terms": args.terms, "results": rows, "seed_seconds": seed_seconds},
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+        },
+        "load": stats,
+        "db_ms": db_ms,
+        "server": server,
+    }
+    output = args.output or f"benchmark-load-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+
+def bench_seed(args):
+    started = time.perf_counter()
+    rows = seed_school(args.db, args.classes, args.students, args.subjects, args.terms)
+    print(f"Seeded {args.db}: {args.classes} classes, {args.students} students, {rows} results "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+# What a login costs (hashing the password) against what checking the
+# session on every later request costs, with a per-request database lookup
+# of the account for comparison
+def bench_auth(args):
+    from gradebook import auth
+
+    name = args.algorithm or auth.algorithm
+    costs = args.costs or {"scrypt": [12, 13, 14], "pbkdf2_sha256": [200000, 600000]}[name]
+    print(f"Login: {name} password hash, {args.logins} logins per cost")
+    for cost in costs:
+        stored = auth.hash_password("pass123", name, cost)
+        seconds = min(timeit.repeat(lambda: auth.verify_password(stored, "pass123"), number=args.logins, repeat=3))
+        print(f"  cost {cost:>7}  {seconds / args.logins * 1000:>9.2f} ms per login")
+
+    store = auth.SessionStore()
+    cookies = [store.create(f"teacher{n}", "teacher").cookie for n in range(args.sessions)]
+    cookie = cookies[len(cookies) // 2]
+    per_request = min(timeit.repeat(lambda: store.from_cookie(cookie), number=args.number, repeat=3)) / args.number
+    # A cookie issued by another server process is verified once, then served from the store
+    other = auth.SessionStore()
+    first_seen = min(timeit.repeat(lambda: other._adopt(cookie, time.time()),
+                                   number=args.number // 10, repeat=3)) / (args.number // 10)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        conn = sqlite3.connect(os.path.join(scratch, "auth.db"))
+        conn.execute("CREATE TABLE Teachers (UserID INTEGER PRIMARY KEY, Username TEXT UNIQUE, Password TEXT, Role TEXT)")
+        conn.executemany("INSERT INTO Teachers (Username, Password, Role) VALUES (?, ?, 'teacher')",
+                         [(f"teacher{n}", "x") for n in range(args.sessions)])
+        conn.commit()
+
+        def lookup():
+            conn.execute("SELECT Role FROM Teachers WHERE Username=?", ("teacher1",)).fetchone()
+        per_query = min(timeit.repeat(lookup, number=args.number, repeat=3)) / args.number
+        conn.close()
+
+    print(f"Per request, {args.sessions} live sessions:")
+    print(f"  in-memory session                   {per_request * 1e6:>8.2f} us")
+    print(f"  signature check (first request)     {first_seen * 1e6:>8.2f} us")
+    print(f"  database lookup of the account      {per_query * 1e6:>8.2f} us")
+
+
+# A scraper enumerating exam numbers and guessing passwords from one IP,
+# with and without the rate limits: how many requests got through and how
+# much SQL the server ran for them
+def bench_ratelimit(args):
+    guesses = urllib.parse.urlencode({"username": "teacher1", "password": "guess"})
+    requests = []
+    for n in range(args.requests):
+        if n % 10 == 0:
+            requests.append(("POST", "/login", guesses))
+        else:
+            requests.append("/view_results?" + urllib.parse.urlencode(
+                {"exam_number": _exam_number(n % args.students), "class_id": n % args.classes + 1}))
+    print(f"Scraper: {args.concurrency} connections from one IP, {args.requests} requests "
+          f"(90% exam number enumeration, 10% password guesses)")
+    with tempfile.TemporaryDirectory() as scratch:
+        seed_school(os.path.join(scratch, "gradesystem.db"), args.classes, args.students, terms=1)
+        for label, extra in (("no limits", ["--no-rate-limit"]), ("rate limited", [])):
+            proc, port = start_server("How.py", ["--hash-cost", "12"] + extra, scratch)
+            try:
+                stats = run_load(port, requests, args.concurrency, args.requests)
+                server = scrape_metrics(port)
+            finally:
+                stop_server(proc)
+            print_row(label, stats)
+            for route in ("/view_results", "/login"):
+                entry = server.get(route, {"requests": 0, "statuses": {}, "sql_queries": 0.0})
+                served = entry["requests"] - entry["statuses"].get("429", 0)
+                print(f"{'':<28} {route:<14} {served:>6} served  {entry['statuses'].get('429', 0):>6} refused (429)  "
+                      f"{entry['requests'] * entry['sql_queries']:>8.0f} SQL statements")
+
+
+# Sending every pupil's results to another system (SMS, notice board): one
+# /view_results page per pupil vs /api/results batches of exam numbers
+def bench_batch(args):
+    classes = args.classes
+    exam_numbers = [_exam_number(n) for n in range(args.pupils)]
+    pages = ["/view_results?" + urllib.parse.urlencode({"exam_number": exam, "class_id": n % classes + 1})
+             for n, exam in enumerate(exam_numbers)]
+    batches = [("POST", "/api/results", urllib.parse.urlencode({"exam_number": exam_numbers[i:i + args.batch_size]},
+                                                              doseq=True))
+               for i in range(0, len(exam_numbers), args.batch_size)]
+    print(f"Results of {args.pupils} pupils, {args.concurrency} client connections")
+    with tempfile.TemporaryDirectory() as scratch:
+        seed_school(os.path.join(scratch, "gradesystem.db"), classes, max(args.students, args.pupils), terms=1)
+        proc, port = start_server("How.py", ["--no-rate-limit"], scratch)
+        try:
+            cookie = login_cookie(port)
+            runs = [("one page per pupil", "/view_results", run_load(port, pages, args.concurrency, len(pages))),
+                    (f"batches of {args.batch_size}", "/api/results",
+                     run_load(port, batches, min(args.concurrency, len(batches)), len(batches), headers=cookie))]
+            server = scrape_metrics(port)
+        finally:
+            stop_server(proc)
+    for label, route, stats in runs:
+        entry = server.get(route, {"requests": 0, "sql_queries": 0.0})
+        print(f"{label:<28} {stats['requests']:>6} requests  {stats['seconds']:>7.2f} s  "
+              f"p50 {stats['p50_ms']:>7.1f} ms  {entry['requests'] * entry['sql_queries']:>7.0f} SQL statements  "
+              f"errors {stats['errors']}")
+
+
+# Many teachers saving results at once: one transaction per submission on
+# the request threads vs the group-commit writer at different flush intervals
+def bench_writes(args):
+    requests = school_requests(args.students, args.classes, {"/teacher/add_results": 1}, count=args.requests)
+    print(f"{args.concurrency} teachers saving results, {args.requests} submissions, {args.workers} worker threads")
+    setups = [("one commit per submission", ["--no-group-commit"])]
+    setups += [(f"group commit, flush {flush:g} ms", ["--flush-ms", str(flush)]) for flush in args.flush_ms]
+    for label, extra in setups:
+        with tempfile.TemporaryDirectory() as scratch:
+            seed_school(os.path.join(scratch, "gradesystem.db"), args.classes, args.students, terms=1)
+            proc, port = start_server("How.py", ["--no-rate-limit", "--workers", str(args.workers)] + extra, scratch)
+            try:
+                stats = run_load(port, requests, args.concurrency, args.requests, headers=login_cookie(port))
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                conn.request("GET", "/cache_stats")
+                writes = json.loads(conn.getresponse().read())["writer"]
+                conn.close()
+            finally:
+                stop_server(proc)
+        print_row(label, stats)
+        if writes.get("batches"):
+            print(f"{'':<28} {writes['batches']} commits, {writes['mean_batch']} submissions per commit "
+                  f"(largest {writes['largest_batch']})")
+
+
+# A pupil's position in class: ranking the class in SQL on every request vs
+# the in-memory index (gradebook.ranking), and what keeping the index costs
+def bench_ranking(args):
+    from gradebook import db, ranking, terms
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "gradesystem.db")
+        seed_school(path, args.classes, args.students, terms=args.terms)
+        db.DB_PATH = path
+        conn = db.get_connection()
+        term = terms.find()
+        student_id, class_id = conn.execute(
+            "SELECT StudentID, ClassID FROM Student WHERE ExamNumber=?", (_exam_number(args.students // 2),)).fetchone()
+
+        def sql_position():
+            conn.execute("""
+                SELECT position FROM (
+                    SELECT s.StudentID, RANK() OVER (ORDER BY AVG(r.Score) DESC) AS position
+                    FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+                    WHERE s.ClassID=? AND r.TermID=? GROUP BY s.StudentID)
+                WHERE StudentID=?""", (class_id, term.term_id, student_id)).fetchone()
+
+        index = ranking.RankingIndex()
+        builds = []
+        for _ in range(3):
+            index.build(conn)
+            builds.append(index.seconds)
+        per_sql = min(timeit.repeat(sql_position, number=args.number // 10, repeat=3)) / (args.number // 10)
+        per_lookup = min(timeit.repeat(lambda: index.position(student_id, class_id, term),
+                                       number=args.number, repeat=3)) / args.number
+        exams = [_exam_number(n) for n in range(0, args.students, max(1, args.students // 100))][:100]
+        per_update = min(timeit.repeat(lambda: index.update(exams[:1], conn), number=100, repeat=3)) / 100
+        per_batch = min(timeit.repeat(lambda: index.update(exams, conn), number=10, repeat=3)) / 10
+        stats = index.stats()
+        conn.close()
+    print(f"{args.students} pupils in {args.classes} classes, {args.terms} term(s): "
+          f"{stats['classes']} class rankings")
+    print(f"  index build (startup)           {min(builds) * 1000:>9.1f} ms")
+    print(f"  position via SQL RANK()         {per_sql * 1e6:>9.1f} us per request")
+    print(f"  position from the index         {per_lookup * 1e6:>9.1f} us per request")
+    print(f"  update after one pupil's save   {per_update * 1e6:>9.1f} us")
+    print(f"  update after {len(exams)} pupils' saves   {per_batch * 1e6:>9.1f} us")
+
+
+# Restarting a server: how long until it accepts connections and until it
+# has sent a first results page, for each --warm mode
+def bench_startup(args):
+    page = "/view_results?" + urllib.parse.urlencode({"exam_number": _exam_number(0), "class_id": 1})
+    print(f"{args.script}: {args.students} pupils in {args.classes} classes, {args.terms} term(s), "
+          f"median of {args.restarts} restarts")
+    with tempfile.TemporaryDirectory() as scratch:
+        seed_school(os.path.join(scratch, "gradesystem.db"), args.classes, args.students, terms=args.terms)
+        for mode in args.modes:
+            listening, answered = [], []
+            for _ in range(args.restarts):
+                started = time.perf_counter()
+                proc, port = start_server(args.script, ["--warm", mode, "--no-rate-limit"], scratch, poll=0.002)
+                try:
+                    listening.append(time.perf_counter() - started)
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                    conn.request("GET", page)
+                    conn.getresponse().read()
+                    conn.close()
+                    answered.append(time.perf_counter() - started)
+                finally:
+                    stop_server(proc)
+            print(f"  --warm {mode:<11} listening after {statistics.median(listening) * 1000:>6.0f} ms  "
+                  f"first results page after {statistics.median(answered) * 1000:>6.0f} ms")
+
+
+def _add_school_arguments(parser):
+    parser.add_argument("--classes", type=int, default=50)
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--subjects", type=int, default=15, choices=range(1, len(SUBJECTS) + 1), metavar="N")
+    parser.add_argument("--terms", type=int, default=3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kafumbwe Grade Book benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="req/s on /view_results for different server pool sizes")
+    serve.add_argument("--script", default="How.py", choices=["How.py", "viewResults.py"])
+    serve.add_argument("--processes", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    serve.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    serve.add_argument("--backlog", type=int, default=1024)
+    serve.add_argument("--concurrency", type=int, default=200)
+    serve.add_argument("--requests", type=int, default=4000)
+    serve.set_defaults(func=bench_serve)
+
+    render = commands.add_parser("render", help="page render time with and without the fragment cache")
+    render.add_argument("--classes", type=int, default=50)
+    render.add_argument("--number", type=int, default=2000)
+    render.set_defaults(func=bench_render)
+
+    asynchronous = commands.add_parser("async", help="threaded vs asyncio server with idle connections held open")
+    asynchronous.add_argument("--script", default="How.py", choices=["How.py", "viewResults.py"])
+    asynchronous.add_argument("--idle", type=int, nargs="+", default=[0, 1000])
+    asynchronous.add_argument("--workers", type=int, default=32)
+    asynchronous.add_argument("--backlog", type=int, default=1024)
+    asynchronous.add_argument("--concurrency", type=int, default=50)
+    asynchronous.add_argument("--requests", type=int, default=2000)
+    asynchronous.set_defaults(func=bench_async)
+
+    load = commands.add_parser("load", help="seed a synthetic school and load-test the main endpoints")
+    load.add_argument("--script", default="How.py", choices=["How.py"])
+    _add_school_arguments(load)
+    load.add_argument("--mix", default="/view_results=70,/login=10,/teacher=10,/teacher/add_results=10",
+                      help="endpoint=weight pairs (default: %(default)s)")
+    load.add_argument("--workers", type=int, default=32)
+    load.add_argument("--backlog", type=int, default=1024)
+    load.add_argument("--concurrency", type=int, default=50)
+    load.add_argument("--requests", type=int, default=5000)
+    load.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                      help="extra options passed to the server, e.g. --server-args --async")
+    load.add_argument("--output", help="JSON file for the results (default: benchmark-load-<time>.json)")
+    load.add_argument("--compare", help="earlier JSON results to compare against")
+    load.set_defaults(func=bench_load)
+
+    seed = commands.add_parser("seed", help="fill a database with a synthetic school")
+    seed.add_argument("--db", required=True, help="database file to seed")
+    _add_school_arguments(seed)
+    seed.set_defaults(func=bench_seed)
+
+    auth = commands.add_parser("auth", help="login (password hashing) cost vs per-request session checks")
+    auth.add_argument("--algorithm", choices=["scrypt", "pbkdf2_sha256"], help="default: the server's")
+    auth.add_argument("--costs", type=int, nargs="+",
+                      help="scrypt log2 N values (default: 12 13 14), or pbkdf2_sha256 iteration counts "
+                           "(default: 200000 600000)")
+    auth.add_argument("--logins", type=int, default=5)
+    auth.add_argument("--sessions", type=int, default=10000)
+    auth.add_argument("--number", type=int, default=100000)
+    auth.set_defaults(func=bench_auth)
+
+    limits = commands.add_parser("ratelimit", help="SQL reached by a one-IP scraper with and without rate limits")
+    limits.add_argument("--classes", type=int, default=20)
+    limits.add_argument("--students", type=int, default=2000)
+    limits.add_argument("--concurrency", type=int, default=20)
+    limits.add_argument("--requests", type=int, default=4000)
+    limits.set_defaults(func=bench_ratelimit)
+
+    batch = commands.add_parser("batch", help="every pupil's results: one page each vs batched /api/results")
+    batch.add_argument("--classes", type=int, default=50)
+    batch.add_argument("--students", type=int, default=5000)
+    batch.add_argument("--pupils", type=int, default=5000, help="pupils whose results are fetched")
+    batch.add_argument("--batch-size", type=int, default=500, help="exam numbers per /api/results request")
+    batch.add_argument("--concurrency", type=int, default=10)
+    batch.set_defaults(func=bench_batch)
+
+    writes = commands.add_parser("writes", help="concurrent teacher submissions with and without group commit")
+    writes.add_argument("--classes", type=int, default=50)
+    writes.add_argument("--students", type=int, default=5000)
+    writes.add_argument("--concurrency", type=int, default=50)
+    writes.add_argument("--workers", type=int, default=32)
+    writes.add_argument("--requests", type=int, default=3000)
+    writes.add_argument("--flush-ms", type=float, nargs="+", default=[0, 2, 10])
+    writes.set_defaults(func=bench_writes)
+
+    positions = commands.add_parser("ranking", help="class positions: SQL per request vs the in-memory index")
+    positions.add_argument("--classes", type=int, default=100)
+    positions.add_argument("--students", type=int, default=10000)
+    positions.add_argument("--terms", type=int, default=3)
+    positions.add_argument("--number", type=int, default=10000, help="lookups timed")
+    positions.set_defaults(func=bench_ranking)
+
+    restarts = commands.add_parser("startup", help="time until a restarted server listens and answers, per --warm mode")
+    restarts.add_argument("--script", choices=("How.py", "viewResults.py"), default="How.py")
+    restarts.add_argument("--classes", type=int, default=100)
+    restarts.add_argument("--students", type=int, default=10000)
+    restarts.add_argument("--terms", type=int, default=3)
+    restarts.add_argument("--restarts", type=int, default=5)
+    restarts.add_argument("--modes", nargs="+", choices=("background", "before", "off"),
+                          default=["before", "background", "off"])
+    restarts.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
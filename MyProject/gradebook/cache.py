@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+# Bounded, thread-safe LRU cache with optional expiry.
+#
+# Entries can be stored under a tag (e.g. an exam number) so every entry for
+# that tag can be invalidated at once. A read that raced with an
+# invalidation is not stored (see generation()).
+class LRUCache:
+    def __init__(self, max_entries, max_age=None):
+        self.max_entries = max(1, int(max_entries))
+        self.max_age = max_age
+        self._entries = OrderedDict()  # key -> (value, tag, stored_at)
+        self._tags = {}                # tag -> set of keys
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # Returns `default` when the key is absent or expired
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, tag, stored_at = entry
+            if self.max_age is not None and time.monotonic() - stored_at > self.max_age:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Whether a fresh entry is held for `key`; not counted as a hit or miss
+    # and leaves the LRU order alone
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            return entry is not _MISSING and (self.max_age is None or
+                                              time.monotonic() - entry[2] <= self.max_age)
+
+    # Take this before reading the database and pass it to set(): if anything
+    # was invalidated in between, the value read may already be stale.
+    def generation(self):
+        return self._generation
+
+    def set(self, key, value, tag=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tag, time.monotonic())
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._generation += 1
+            for key in self._tags.pop(tag, ()):
+                if key in self._entries:
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, tag, _ = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_age": self.max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
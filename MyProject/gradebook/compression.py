@@ -0,0 +1,95 @@
+# gzip response bodies for clients that accept it (Accept-Encoding).
+#
+# Pages are mostly repeated markup and shrink several times over, which on a
+# slow school network saves more time than anything done on the server.
+# Bodies that are the same for every request (the login and teacher pages,
+# the lookup form, /static/ files) are compressed once and the result kept;
+# other pages are compressed per response, and streamed pages chunk by chunk
+# with a sync flush so each chunk still reaches the browser when written.
+#
+# Only gzip is offered: Brotli would need a package outside the standard
+# library, and every browser accepts gzip.
+import collections
+import threading
+import zlib
+
+MIN_SIZE = 1024     # smaller bodies are sent as they are
+VARY = "Accept-Encoding"   # request headers a compressible response depends on
+LEVEL = 6
+CACHE_SIZE = 64     # precompressed bodies kept
+
+enabled = True
+
+_cache = collections.OrderedDict()  # body -> gzipped body, least recently used first
+_lock = threading.Lock()
+
+
+def configure(enable=True):
+    global enabled
+    enabled = enable
+
+
+# Whether the request's Accept-Encoding allows gzip (q=0 refuses it)
+def accepts_gzip(headers):
+    if not enabled:
+        return False
+    weights = {}
+    for coding in (headers.get("Accept-Encoding") or "").split(","):
+        name, _, params = coding.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    return weights.get("gzip", weights.get("x-gzip", weights.get("*", 0.0))) > 0
+
+
+def gzip(body, level=LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+# gzip(body), compressed on first use and then served from memory
+def precompressed(body):
+    with _lock:
+        gzipped = _cache.get(body)
+        if gzipped is not None:
+            _cache.move_to_end(body)
+            return gzipped
+    gzipped = gzip(body)
+    with _lock:
+        _cache[body] = gzipped
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return gzipped
+
+
+# (body to send, Content-Encoding or None). `static` bodies are the same for
+# every request and are compressed once (see precompressed).
+def encode(headers, body, static=False):
+    if len(body) < MIN_SIZE or not accepts_gzip(headers):
+        return body, None
+    return (precompressed(body) if static else gzip(body)), "gzip"
+
+
+def send_headers(handler, encoding):
+    handler.send_header("Vary", VARY)
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+
+
+# gzip for a streamed body: every compress() call ends with a sync flush, so
+# what has been produced so far can be decompressed by the browser straight away
+class StreamCompressor:
+    def __init__(self, level=LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+
+from gradebook import metrics
+
+DB_PATH = "gradesystem.db"
+
+# Seconds a connection waits on a locked database before raising "database is locked"
+BUSY_TIMEOUT = 5.0
+
+# Prepared statements kept per connection (sqlite3's default is 128). Pooled
+# connections live as long as their worker thread, so each fixed statement
+# (see gradebook.repository) is compiled once per thread.
+STATEMENT_CACHE_SIZE = 512
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers no longer block the writer (and vice versa)
+    "PRAGMA synchronous=NORMAL",    # safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           factory=metrics.InstrumentedConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# One long-lived connection per thread. Worker threads keep their connection
+# between requests, so a request never pays for opening the database file.
+class ConnectionPool:
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+
+    # Connections must not cross a fork; the child starts with an empty pool
+    def _reset_after_fork(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+
+pool = ConnectionPool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=pool._reset_after_fork)
+
+
+# A class id (often text, from a form or a hook) as the ClassID column holds
+# it: whole numbers as INTEGER, anything else ('KB3') as TEXT. Comparing the
+# bare column with these values lets SQLite search its ClassID indexes,
+# where CAST(ClassID AS TEXT) would scan them.
+def class_id_value(class_id):
+    text = str(class_id).strip()
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+# The calling thread's pooled connection. Use it as `with conn:` around writes
+# so the transaction is committed or rolled back as a unit.
+def get_connection():
+    return pool.get()
@@ -0,0 +1,88 @@
+# Batched edit/delete of existing results.
+#
+# A whole batch is one submission to the group-commit writer (gradebook.writer)
+# and runs with executemany, so correcting a class's marks is one round trip
+# and either all of it applies or none. The writer reports the students
+# changed to hooks.results_changed() so caches and statistics follow.
+from gradebook import writer
+
+# SQLite limits the number of ? placeholders in one statement
+_IN_CHUNK = 500
+
+
+# (ExamNumber, ClassID) of the students owning the given results
+def _owners(conn, result_ids):
+    owners = set()
+    for i in range(0, len(result_ids), _IN_CHUNK):
+        chunk = result_ids[i:i + _IN_CHUNK]
+        owners.update(conn.execute(f"""
+            SELECT DISTINCT s.ExamNumber, s.ClassID
+            FROM Results r JOIN Student s ON s.StudentID = r.StudentID
+            WHERE r.ResultID IN ({','.join('?' * len(chunk))})
+        """, chunk).fetchall())
+    return owners
+
+
+def parse_score(value):
+    try:
+        score = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"score must be a whole number, got {value!r}") from None
+    if not 0 <= score <= 100:
+        raise ValueError(f"score must be between 0 and 100, got {score}")
+    return score
+
+
+def _result_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid result id {value!r}") from None
+
+
+# Validate parallel lists from a form into [(subject or None, score, result_id)].
+# Raises ValueError describing the first bad entry.
+def parse_updates(result_ids, scores, subjects=None):
+    if len(result_ids) != len(scores) or (subjects and len(subjects) != len(result_ids)):
+        raise ValueError("result ids, scores and subjects do not match up")
+    subjects = subjects or [None] * len(result_ids)
+    updates = []
+    for result_id, score, subject in zip(result_ids, scores, subjects):
+        subject = subject.strip() if subject else None
+        updates.append((subject or None, parse_score(score), _result_id(result_id)))
+    return updates
+
+
+def parse_ids(result_ids):
+    return [_result_id(result_id) for result_id in result_ids]
+
+
+# Apply [(subject or None, score, result_id)]; returns the number of rows
+# updated. Raises writer.WriteTimeout if the writer was too busy to start it.
+def update_results(updates):
+    affected = []
+
+    def work(conn):
+        owners = _owners(conn, [result_id for _, _, result_id in updates])
+        cursor = conn.executemany(
+            "UPDATE Results SET Subject = COALESCE(?, Subject), Score = ? WHERE ResultID = ?", updates)
+        affected.append(max(cursor.rowcount, 0))
+        return [exam for exam, _ in owners], [class_id for _, class_id in owners]
+
+    writer.write(work)
+    return affected[-1]
+
+
+# Delete the given ResultIDs; returns the number of rows deleted. Raises
+# writer.WriteTimeout if the writer was too busy to start it.
+def delete_results(result_ids):
+    affected = []
+
+    def work(conn):
+        owners = _owners(conn, result_ids)
+        cursor = conn.executemany("DELETE FROM Results WHERE ResultID = ?", [(result_id,) for result_id in result_ids])
+        affected.append(max(cursor.rowcount, 0))
+        return [exam for exam, _ in owners], [class_id for _, class_id in owners]
+
+    writer.write(work)
+    return affected[-1]
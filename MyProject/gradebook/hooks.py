@@ -0,0 +1,19 @@
+# Notifications for code that keeps derived data (caches, statistics) in sync
+# with the Results table. Write paths call results_changed() after their
+# transaction commits; modules that derive data register a listener.
+_listeners = []
+
+
+def on_results_changed(listener):
+    _listeners.append(listener)
+    return listener
+
+
+# exam_numbers: students whose results changed.
+# class_ids: classes affected, or None if unknown (listeners then assume all).
+def results_changed(exam_numbers=(), class_ids=None):
+    exam_numbers = [str(exam) for exam in exam_numbers]
+    if class_ids is not None:
+        class_ids = {str(class_id) for class_id in class_ids}
+    for listener in _listeners:
+        listener(exam_numbers, class_ids)
@@ -0,0 +1,63 @@
+# Conditional GET (ETag / Last-Modified / 304) for result pages.
+#
+# Every student row carries ResultsVersion and ResultsUpdatedAt, which
+# triggers bump whenever one of their results changes (migration 4). The
+# ETag of a results page is derived from that version, so a pupil who
+# refreshes an unchanged page gets a 304 instead of a re-rendered page.
+import email.utils
+import hashlib
+
+from gradebook import compression
+
+# Pages must be revalidated on every view, but a 304 is cheap
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+# True when the request's validators show the client already has this version
+def not_modified(headers, etag, last_modified=None):
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/"x" and "x" match
+        wanted = etag[2:] if etag.startswith("W/") else etag
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if (tag[2:] if tag.startswith("W/") else tag) == wanted:
+                return True
+        return False
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def send_validators(handler, etag, last_modified=None):
+    handler.send_header("ETag", etag)
+    if last_modified is not None:
+        handler.send_header("Last-Modified", http_date(last_modified))
+    handler.send_header("Cache-Control", CACHE_CONTROL)
+
+
+# A 304 repeats the headers a cache keys the stored 200 on, Vary included
+# (see compression.send_headers), or the cache may treat it as a different
+# response and keep serving the old one
+def send_not_modified(handler, etag, last_modified=None):
+    handler.send_response(304)
+    send_validators(handler, etag, last_modified)
+    handler.send_header("Vary", compression.VARY)
+    handler.end_headers()
+
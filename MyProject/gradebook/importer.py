@@ -0,0 +1,400 @@
+# Bulk import of results from CSV or JSON.
+#
+# Input is read in chunks and written in batches, so a file with tens of
+# thousands of marks never has to fit in memory. Each record is one mark:
+#
+#   exam_number,name,class_id,subject,score,term
+#   EXAM001,Alice,1,Math,85,Term 1
+#
+# JSON input is either an array of objects with the same keys or one object
+# per line (JSON Lines). `term` names a term of the current academic year
+# (added if it is new) and defaults to the current term.
+#
+# Batches are written by the group-commit writer (gradebook.writer), like
+# every other write. A batch the database refuses is retried one row at a
+# time so the report names the rows that failed.
+#
+#   python -m gradebook.importer marks.csv
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from gradebook import db, migrations, summary, terms, writer
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 1024 * 1024  # characters one JSON record may take
+MAX_REPORTED_ERRORS = 100
+
+# SQLite limits the number of ? placeholders in one statement
+_IN_CHUNK = 500
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.students_created = 0
+        self.students_updated = 0
+        self.terms_created = 0
+        self.error_count = 0
+        self.errors = []  # (row, message), capped at MAX_REPORTED_ERRORS
+        self.seconds = 0.0
+
+    def add_error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "students_created": self.students_created,
+            "students_updated": self.students_updated,
+            "terms_created": self.terms_created,
+            "error_count": self.error_count,
+            "errors": [{"row": row, "message": message} for row, message in self.errors],
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+# Limits a raw socket/file stream to `length` bytes so a request body can be
+# wrapped in io.TextIOWrapper without reading past it
+class BodyReader(io.RawIOBase):
+    def __init__(self, raw, length):
+        self.raw = raw
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.raw.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+# Input that cannot be read any further, at `row` (a CSV line or JSON record number)
+class RecordError(ValueError):
+    def __init__(self, row, message):
+        super().__init__(f"row {row}: {message}")
+        self.row = row
+        self.message = message
+
+
+def iter_csv_records(text):
+    reader = csv.DictReader(text)
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as exc:
+        raise RecordError(reader.line_num, str(exc)) from None
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# How far before the end of the buffered text a decode error may be and
+# still be input cut short (an unfinished literal such as "-Infinity")
+_TRUNCATION_SLACK = 16
+
+
+# Yields objects from a JSON array or from JSON Lines, decoding one record at
+# a time from a small rolling buffer. The buffer is only compacted when more
+# input is read, so each character is copied a bounded number of times.
+def iter_json_records(text, chunk_size=CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    in_array = None
+    index = 0
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            if in_array is None:
+                in_array = buffer[pos] == "["
+                if in_array:
+                    pos += 1
+                continue
+            if in_array and buffer[pos] == ",":
+                pos += 1
+                continue
+            if in_array and buffer[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                cut_short = exc.msg.startswith("Unterminated string") or exc.pos >= len(buffer) - _TRUNCATION_SLACK
+                if eof or not cut_short:
+                    raise RecordError(index + 1, f"invalid JSON: {exc.msg}") from None
+                if len(buffer) - pos > MAX_RECORD_SIZE:
+                    raise RecordError(index + 1, f"record is longer than {MAX_RECORD_SIZE} characters") from None
+            else:
+                # A bare number at the end of the buffer may be cut short; wait for more input
+                if end < len(buffer) or eof or isinstance(record, (dict, list)):
+                    index += 1
+                    pos = end
+                    yield index, record
+                    continue
+        if eof:
+            if in_array:
+                raise RecordError(index + 1, "JSON array is not closed")
+            return
+        chunk = text.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+# Returns (exam_number, name, class_id, subject, score, term or None) or raises ValueError
+def validate(record):
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+
+    def field(key, required=True):
+        value = record.get(key)
+        value = "" if value is None else str(value).strip()
+        if required and not value:
+            raise ValueError(f"missing {key}")
+        return value
+
+    exam_number = field("exam_number")
+    name = field("name")
+    class_id = field("class_id")
+    subject = field("subject")
+    try:
+        score = int(field("score"))
+    except ValueError:
+        raise ValueError(f"score must be a whole number, got {record.get('score')!r}") from None
+    if not 0 <= score <= 100:
+        raise ValueError(f"score must be between 0 and 100, got {score}")
+    term = field("term", required=False) or None
+    return exam_number, name, class_id, subject, score, term
+
+
+# Insert missing students and refresh name/class of existing ones; fills
+# student_ids (ExamNumber -> StudentID) for every exam number in the batch
+def _upsert_students(conn, students, student_ids, report):
+    unknown = [exam for exam in students if exam not in student_ids]
+    for i in range(0, len(unknown), _IN_CHUNK):
+        chunk = unknown[i:i + _IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        for student_id, exam_number in conn.execute(
+                f"SELECT StudentID, ExamNumber FROM Student WHERE ExamNumber IN ({placeholders})", chunk):
+            student_ids.setdefault(str(exam_number), student_id)
+
+    new = [(exam, name, class_id) for exam, (name, class_id) in students.items() if exam not in student_ids]
+    existing = [(name, class_id, student_ids[exam]) for exam, (name, class_id) in students.items()
+                if exam in student_ids]
+    if new:
+        conn.executemany("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)", new)
+        report.students_created += len(new)
+        for i in range(0, len(new), _IN_CHUNK):
+            chunk = [row[0] for row in new[i:i + _IN_CHUNK]]
+            placeholders = ",".join("?" * len(chunk))
+            for student_id, exam_number in conn.execute(
+                    f"SELECT StudentID, ExamNumber FROM Student WHERE ExamNumber IN ({placeholders})", chunk):
+                student_ids.setdefault(str(exam_number), student_id)
+    if existing:
+        cursor = conn.executemany(
+            "UPDATE Student SET Name=?, ClassID=? WHERE StudentID=? AND (Name IS NOT ? OR ClassID IS NOT ?)",
+            [(name, class_id, sid, name, class_id) for name, class_id, sid in existing])
+        report.students_updated += max(cursor.rowcount, 0)
+
+
+# Fills term_ids (term name, None for the current term -> (TermID, name)) for
+# every term in the batch
+def _resolve_terms(conn, batch, term_ids, report):
+    for *_, term in batch:
+        if term in term_ids:
+            continue
+        if term is None:
+            current = terms.current(conn)
+            term_ids[None] = (current.term_id, current.name)
+        else:
+            term_id, created = terms.resolve(conn, term)
+            term_ids[term] = (term_id, term)
+            report.terms_created += created
+
+
+# Write validated rows inside the caller's transaction. Returns (students
+# created, students updated, terms created); student_ids and term_ids are
+# filled as for _upsert_students/_resolve_terms.
+def _write_rows(conn, rows, student_ids, term_ids):
+    counts = ImportReport()
+    students = {}
+    for exam_number, name, class_id, _, _, _ in rows:
+        students[exam_number] = (name, class_id)
+    _upsert_students(conn, students, student_ids, counts)
+    _resolve_terms(conn, rows, term_ids, counts)
+    conn.executemany(
+        "INSERT INTO Results (StudentID, Subject, Score, Term, TermID) VALUES (?, ?, ?, ?, ?)",
+        [(student_ids[exam], subject, score, term_ids[term][1], term_ids[term][0])
+         for exam, _, _, subject, score, term in rows])
+    return counts.students_created, counts.students_updated, counts.terms_created
+
+
+# _write_rows in a savepoint: on a database error nothing of `rows` is kept,
+# including the IDs it looked up, and the error is raised
+def _try_rows(conn, rows, student_ids, term_ids):
+    known = dict(student_ids), dict(term_ids)
+    conn.execute("SAVEPOINT import_rows")
+    try:
+        counts = _write_rows(conn, rows, student_ids, term_ids)
+    except sqlite3.Error:
+        conn.execute("ROLLBACK TO import_rows")
+        conn.execute("RELEASE import_rows")
+        student_ids.clear()
+        student_ids.update(known[0])
+        term_ids.clear()
+        term_ids.update(known[1])
+        raise
+    conn.execute("RELEASE import_rows")
+    return counts
+
+
+# Write (row number, validated record) pairs as one submission to the writer.
+# If the database refuses the batch, its rows are written one by one and
+# each refused row is reported.
+def _write_batch(batch, student_ids, term_ids, report):
+    outcome = {}
+
+    def work(conn):
+        done, refused, counts = [], [], []
+        try:
+            counts.append(_try_rows(conn, [record for _, record in batch], student_ids, term_ids))
+            done = batch
+        except sqlite3.Error:
+            for row, record in batch:
+                try:
+                    counts.append(_try_rows(conn, [record], student_ids, term_ids))
+                    done.append((row, record))
+                except sqlite3.Error as exc:
+                    refused.append((row, f"not saved: {exc}"))
+        outcome.update(done=len(done), refused=refused, counts=[sum(column) for column in zip((0, 0, 0), *counts)])
+        students = {record[0]: record[2] for _, record in done}
+        # A student moved between classes changes statistics for a class we can't name here
+        return list(students), (None if outcome["counts"][1] else set(students.values()))
+
+    try:
+        writer.write(work)
+    except (sqlite3.Error, writer.WriteTimeout) as exc:
+        # Nothing of the batch was committed, so looked-up IDs may not exist
+        student_ids.clear()
+        term_ids.clear()
+        report.add_error(batch[0][0], f"rows {batch[0][0]}-{batch[-1][0]} not saved: {exc}")
+        return
+    for row, message in outcome["refused"]:
+        report.add_error(row, message)
+    created, updated, terms_created = outcome["counts"]
+    report.students_created += created
+    report.students_updated += updated
+    report.terms_created += terms_created
+    report.imported += outcome["done"]
+
+
+# Validate and write (row, record) pairs in batched transactions
+def import_records(records, batch_size=BATCH_SIZE):
+    report = ImportReport()
+    started = time.perf_counter()
+    student_ids = {}
+    term_ids = {}
+    batch = []
+    records = iter(records)
+    try:
+        while True:
+            try:
+                row, record = next(records)
+            except StopIteration:
+                break
+            except RecordError as exc:
+                # Unreadable input: keep the rows read so far and say where it stopped
+                report.add_error(exc.row, exc.message)
+                break
+            except ValueError as exc:
+                report.add_error(report.rows + 1, str(exc))
+                break
+            report.rows += 1
+            try:
+                batch.append((row, validate(record)))
+            except ValueError as exc:
+                report.add_error(row, str(exc))
+                continue
+            if len(batch) >= batch_size:
+                _write_batch(batch, student_ids, term_ids, report)
+                batch = []
+        if batch:
+            _write_batch(batch, student_ids, term_ids, report)
+    finally:
+        report.seconds = time.perf_counter() - started
+    return report
+
+
+def detect_format(filename="", content_type=""):
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type.endswith("json") or content_type == "application/x-ndjson":
+        return "json"
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in (".json", ".jsonl", ".ndjson"):
+        return "json"
+    return "csv"
+
+
+# Import from a binary stream (file or request body)
+def import_stream(raw, fmt, batch_size=BATCH_SIZE):
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    records = iter_json_records(text) if fmt == "json" else iter_csv_records(text)
+    return import_records(records, batch_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import results from CSV or JSON")
+    parser.add_argument("file", help="CSV, JSON array or JSON Lines file ('-' for stdin)")
+    parser.add_argument("--format", choices=["csv", "json"], help="input format (default: from file extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per transaction (default: %(default)s)")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.file)
+    db.DB_PATH = args.db
+    summary.install()
+    try:
+        migrations.migrate(db.get_connection())
+        if args.file == "-":
+            report = import_stream(sys.stdin.buffer, fmt, args.batch_size)
+        else:
+            with open(args.file, "rb") as raw:
+                report = import_stream(raw, fmt, args.batch_size)
+    finally:
+        db.pool.close_all()
+
+    for row, message in report.errors:
+        print(f"row {row}: {message}" if row is not None else message, file=sys.stderr)
+    if report.error_count > len(report.errors):
+        print(f"... and {report.error_count - len(report.errors)} more errors", file=sys.stderr)
+    print(f"Imported {report.imported} of {report.rows} rows in {report.seconds:.2f}s "
+          f"({report.rows_per_second:.0f} rows/s); {report.students_created} students created, "
+          f"{report.students_updated} updated, {report.terms_created} new terms, {report.error_count} errors")
+    return 1 if report.error_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
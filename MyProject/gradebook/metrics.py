@@ -0,0 +1,289 @@
+# Request-level instrumentation, exposed in Prometheus text format at /metrics.
+#
+# Handlers wrap do_GET/do_POST with @instrumented. Each request then records
+# its latency (histogram per route), status code, bytes written and the number
+# of SQL statements it ran and the time spent in them. SQL is counted by the
+# connection factory db.connect() uses, against whichever request is running
+# on the current thread.
+#
+# Routes are labelled from the fixed table the front end passes to
+# configure(routes=...), so clients cannot create series by requesting made-up
+# paths: anything not in the table (and every 404) is counted as "unmatched".
+#
+# With a slow-request threshold set (configure(slow_request_ms=...)), requests slower
+# than it are written to stderr together with the SQL they executed.
+#
+# Counters are per process: with --processes N each child reports its own.
+import functools
+import ipaddress
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Slow statements beyond this many are not kept for the slow-request log
+MAX_LOGGED_STATEMENTS = 200
+
+slow_ms = None
+_routes = frozenset()
+_route_prefixes = ()
+
+_current = threading.local()
+_lock = threading.Lock()
+_durations = {}       # (route, method) -> [bucket counts..., +Inf count, sum]
+_requests = {}        # (route, method, status) -> count
+_bytes = {}           # route -> bytes written
+_sql = {}             # route -> [statements, seconds]
+_slow_requests = 0
+
+
+# Log requests slower than slow_request_ms (None turns the log off). Must run
+# before connections are opened, as the SQL trace is set up per connection.
+# `routes` are the paths the front end serves; one ending in "*" stands for
+# every path starting with what comes before it.
+def configure(slow_request_ms=None, routes=()):
+    global slow_ms, _routes, _route_prefixes
+    slow_ms = slow_request_ms
+    _routes = frozenset(route for route in routes if not route.endswith("*"))
+    _route_prefixes = tuple(route for route in routes if route.endswith("*"))
+
+
+class _Request:
+    __slots__ = ("queries", "sql_seconds", "statements")
+
+    def __init__(self, trace):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = [] if trace else None
+
+
+def _account(elapsed):
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.queries += 1
+        request.sql_seconds += elapsed
+
+
+def _add_time(elapsed):
+    request = getattr(_current, "request", None)
+    if request is not None:
+        request.sql_seconds += elapsed
+
+
+# Cursor that charges its statements (and fetches) to the current request.
+# Rows read by iterating over the cursor are not timed.
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _account(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _account(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_time(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_time(time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _add_time(time.perf_counter() - start)
+
+
+# Connection factory for sqlite3.connect(). The execute shortcuts are
+# routed through an InstrumentedCursor so they are counted too.
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if slow_ms is not None:
+            self.set_trace_callback(_trace)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _trace(statement):
+    request = getattr(_current, "request", None)
+    if request is None or request.statements is None or len(request.statements) >= MAX_LOGGED_STATEMENTS:
+        return
+    # Statements run by triggers are reported with their parent's SQL again
+    if not request.statements or request.statements[-1] != statement:
+        request.statements.append(statement)
+
+
+# Counts the bytes a handler writes and picks the status code out of the
+# status line
+class _CountingWriter:
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self.written = 0
+        self.status = None
+
+    def write(self, data):
+        if self.status is None and data[:5] == b"HTTP/":
+            try:
+                self.status = int(data[9:12])
+            except ValueError:
+                pass
+        self.written += len(data)
+        return self._wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._wfile, name)
+
+
+def _route(handler, status):
+    if status == 404:
+        return "unmatched"
+    path = urllib.parse.urlparse(handler.path).path or "/"
+    if path in _routes:
+        return path
+    for prefix in _route_prefixes:
+        if path.startswith(prefix[:-1]):
+            return prefix
+    return "unmatched"
+
+
+# Whether the request comes from this machine (where a Prometheus scraper or
+# the benchmark runs); /metrics and /cache_stats are not for anyone else
+def is_local(handler):
+    try:
+        return ipaddress.ip_address(handler.client_address[0]).is_loopback
+    except (ValueError, IndexError, TypeError):
+        return False
+
+
+def _record(route, method, status, elapsed, written, request):
+    global _slow_requests
+    with _lock:
+        buckets = _durations.get((route, method))
+        if buckets is None:
+            buckets = _durations[(route, method)] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                buckets[i] += 1
+        buckets[len(BUCKETS)] += 1
+        buckets[-1] += elapsed
+        key = (route, method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        _bytes[route] = _bytes.get(route, 0) + written
+        sql = _sql.setdefault(route, [0, 0.0])
+        sql[0] += request.queries
+        sql[1] += request.sql_seconds
+        slow = slow_ms is not None and elapsed * 1000 >= slow_ms
+        if slow:
+            _slow_requests += 1
+    return slow
+
+
+def _log_slow(handler, status, elapsed, request):
+    lines = [f"slow request: {handler.command} {handler.path} -> {status} in {elapsed * 1000:.1f} ms, "
+             f"{request.queries} SQL statement(s) taking {request.sql_seconds * 1000:.1f} ms"]
+    lines.extend(f"    {statement}" for statement in request.statements or ())
+    sys.stderr.write("\n".join(lines) + "\n")
+
+
+# Decorator for do_GET/do_POST
+def instrumented(method):
+    @functools.wraps(method)
+    def wrapper(handler):
+        request = _current.request = _Request(trace=slow_ms is not None)
+        writer = handler.wfile = _CountingWriter(handler.wfile)
+        start = time.perf_counter()
+        try:
+            return method(handler)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.request = None
+            handler.wfile = writer._wfile
+            status = writer.status or 0
+            if _record(_route(handler, status), handler.command, status, elapsed, writer.written, request):
+                _log_slow(handler, status, elapsed, request)
+    return wrapper
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+# Everything recorded so far, in Prometheus text exposition format
+def render():
+    with _lock:
+        durations = {key: list(value) for key, value in _durations.items()}
+        requests = dict(_requests)
+        written = dict(_bytes)
+        sql = {route: list(value) for route, value in _sql.items()}
+        slow_requests = _slow_requests
+
+    lines = ["# HELP gradebook_http_request_duration_seconds Time spent handling a request.",
+             "# TYPE gradebook_http_request_duration_seconds histogram"]
+    for (route, method), buckets in sorted(durations.items()):
+        for bound, count in zip(BUCKETS, buckets):
+            lines.append(f"gradebook_http_request_duration_seconds_bucket"
+                         f"{_labels(route=route, method=method, le=bound)} {count}")
+        lines.append(f"gradebook_http_request_duration_seconds_bucket"
+                     f"{_labels(route=route, method=method, le='+Inf')} {buckets[len(BUCKETS)]}")
+        lines.append(f"gradebook_http_request_duration_seconds_sum{_labels(route=route, method=method)} {buckets[-1]}")
+        lines.append(f"gradebook_http_request_duration_seconds_count"
+                     f"{_labels(route=route, method=method)} {buckets[len(BUCKETS)]}")
+
+    lines += ["# HELP gradebook_http_requests_total Requests handled, by status code.",
+              "# TYPE gradebook_http_requests_total counter"]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f"gradebook_http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+
+    lines += ["# HELP gradebook_http_response_bytes_total Bytes written in responses.",
+              "# TYPE gradebook_http_response_bytes_total counter"]
+    for route, count in sorted(written.items()):
+        lines.append(f"gradebook_http_response_bytes_total{_labels(route=route)} {count}")
+
+    lines += ["# HELP gradebook_sql_queries_total SQL statements executed while handling requests.",
+              "# TYPE gradebook_sql_queries_total counter"]
+    for route, (queries, _) in sorted(sql.items()):
+        lines.append(f"gradebook_sql_queries_total{_labels(route=route)} {queries}")
+
+    lines += ["# HELP gradebook_sql_seconds_total Time spent in SQLite while handling requests.",
+              "# TYPE gradebook_sql_seconds_total counter"]
+    for route, (_, seconds) in sorted(sql.items()):
+        lines.append(f"gradebook_sql_seconds_total{_labels(route=route)} {seconds}")
+
+    lines += ["# HELP gradebook_slow_requests_total Requests slower than the slow-request threshold.",
+              "# TYPE gradebook_slow_requests_total counter",
+              f"gradebook_slow_requests_total {slow_requests}"]
+    return ("\n".join(lines) + "\n").encode()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
@@ -0,0 +1,446 @@
+# Versioned schema migrations.
+#
+# The schema version is stored in SQLite's PRAGMA user_version. Each
+# migration runs once, in its own transaction, and bumps the version, so
+# restarting a server never touches existing data.
+#
+#   python -m gradebook.migrations               apply pending migrations
+#   python -m gradebook.migrations --check-plans also verify hot queries use indexes
+import argparse
+import sys
+
+from gradebook import auth, db
+
+
+# A migration that cannot run without losing data; nothing of it was applied
+class MigrationError(RuntimeError):
+    pass
+
+
+def _initial_schema(conn):
+    conn.execute("""
+    -- Teachers table
+    CREATE TABLE IF NOT EXISTS Teachers (
+        UserID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Username TEXT UNIQUE,
+        Password TEXT,
+        Role TEXT -- 'teacher' or 'pupil'
+    )
+    """)
+    conn.execute("""
+    -- Classes table
+    CREATE TABLE IF NOT EXISTS Class (
+        ClassID INTEGER PRIMARY KEY AUTOINCREMENT,
+        ClassName TEXT UNIQUE
+    )
+    """)
+    conn.execute("""
+    -- Students table
+    CREATE TABLE IF NOT EXISTS Student (
+        StudentID INTEGER PRIMARY KEY AUTOINCREMENT,
+        ExamNumber TEXT,
+        Name TEXT,
+        ClassID INTEGER,
+        FOREIGN KEY (ClassID) REFERENCES Class(ClassID)
+    )
+    """)
+    conn.execute("""
+    -- Results table
+    CREATE TABLE IF NOT EXISTS Results (
+        ResultID INTEGER PRIMARY KEY AUTOINCREMENT,
+        StudentID INTEGER,
+        Subject TEXT,
+        Score INTEGER,
+        Term TEXT,
+        FOREIGN KEY (StudentID) REFERENCES Student(StudentID)
+    )
+    """)
+
+
+# Sample data, only written into an empty database
+def _sample_data(conn):
+    conn.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher1', 'pass123', 'teacher')")
+    conn.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher2', 'pass123', 'teacher')")
+    conn.execute("INSERT OR IGNORE INTO Teachers (Username, Password, Role) VALUES ('teacher3', 'pass123', 'teacher')")
+
+    conn.execute("INSERT OR IGNORE INTO Class (ClassName) VALUES ('Form 1')")
+    conn.execute("INSERT OR IGNORE INTO Class (ClassName) VALUES ('Form 2')")
+
+    if conn.execute("SELECT 1 FROM Student LIMIT 1").fetchone():
+        return
+    conn.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES ('EXAM001', 'Alice', 1)")
+    conn.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES ('EXAM002', 'Bob', 2)")
+    conn.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (170900600401, 'Jimmy Sakala', 'KB3')")
+    conn.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (2023021197, 'James Sakala', 'KB2')")
+
+    conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (1, 'Math', 85, 'Term 1')")
+    conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (1, 'English', 78, 'Term 1')")
+    conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (2, 'Math', 92, 'Term 1')")
+    conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (2, 'English', 88, 'Term 1')")
+
+
+# Indexes for the lookups every results page and every add_results does
+def _lookup_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Student_ExamNumber_ClassID ON Student (ExamNumber, ClassID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Results_StudentID ON Results (StudentID)")
+
+
+# Per-student results version for ETags. Triggers bump it whenever one of the
+# student's results (or their name/class) changes, so it can never go stale.
+def _results_version(conn):
+    conn.execute("ALTER TABLE Student ADD COLUMN ResultsVersion INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE Student ADD COLUMN ResultsUpdatedAt INTEGER")
+    conn.execute("UPDATE Student SET ResultsUpdatedAt = CAST(strftime('%s', 'now') AS INTEGER)")
+    bump = """
+        UPDATE Student SET ResultsVersion = ResultsVersion + 1,
+                           ResultsUpdatedAt = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE StudentID = {row}.StudentID;
+    """
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_insert_version AFTER INSERT ON Results
+    BEGIN {bump.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_delete_version AFTER DELETE ON Results
+    BEGIN {bump.format(row="OLD")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_update_version AFTER UPDATE ON Results
+    BEGIN {bump.format(row="OLD")} {bump.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Student_update_version AFTER UPDATE OF ExamNumber, Name, ClassID ON Student
+    BEGIN {bump.format(row="NEW")} END
+    """)
+
+
+# Materialized per-student totals (see gradebook.summary). Triggers keep
+# Total/Subjects/Average/Status exact on every write; ClassRank is refreshed
+# per class by summary.refresh_ranks() after writes commit.
+def _student_summary(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS StudentSummary (
+        StudentID INTEGER PRIMARY KEY,
+        ClassID INTEGER,
+        Total INTEGER NOT NULL,
+        Subjects INTEGER NOT NULL,
+        Average REAL NOT NULL,
+        Status TEXT NOT NULL,
+        ClassRank INTEGER,
+        FOREIGN KEY (StudentID) REFERENCES Student(StudentID)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_StudentSummary_ClassID_Average ON StudentSummary (ClassID, Average DESC)")
+    recompute = """
+        DELETE FROM StudentSummary
+        WHERE StudentID = {row}.StudentID AND NOT EXISTS (SELECT 1 FROM Results WHERE StudentID = {row}.StudentID);
+        INSERT OR REPLACE INTO StudentSummary (StudentID, ClassID, Total, Subjects, Average, Status, ClassRank)
+        SELECT s.StudentID, s.ClassID, SUM(r.Score), COUNT(*), AVG(r.Score),
+               CASE WHEN AVG(r.Score) >= 40 THEN 'Passed' ELSE 'Failed' END,
+               (SELECT ClassRank FROM StudentSummary WHERE StudentID = s.StudentID)
+        FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+        WHERE s.StudentID = {row}.StudentID
+        GROUP BY s.StudentID;
+    """
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_insert_summary AFTER INSERT ON Results
+    BEGIN {recompute.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_delete_summary AFTER DELETE ON Results
+    BEGIN {recompute.format(row="OLD")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_Results_update_summary AFTER UPDATE OF StudentID, Score ON Results
+    BEGIN {recompute.format(row="OLD")} {recompute.format(row="NEW")} END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_Student_class_summary AFTER UPDATE OF ClassID ON Student
+    BEGIN
+        UPDATE StudentSummary SET ClassID = NEW.ClassID, ClassRank = NULL WHERE StudentID = NEW.StudentID;
+    END
+    """)
+    conn.execute("""
+    INSERT OR REPLACE INTO StudentSummary (StudentID, ClassID, Total, Subjects, Average, Status, ClassRank)
+    SELECT StudentID, ClassID, Total, Subjects, Average, Status,
+           RANK() OVER (PARTITION BY ClassID ORDER BY Average DESC)
+    FROM (
+        SELECT s.StudentID, s.ClassID, SUM(r.Score) AS Total, COUNT(*) AS Subjects, AVG(r.Score) AS Average,
+               CASE WHEN AVG(r.Score) >= 40 THEN 'Passed' ELSE 'Failed' END AS Status
+        FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+        GROUP BY s.StudentID
+    )
+    """)
+
+
+# Class listings (/teacher/results) walk a class's students in name order
+def _class_listing_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Student_ClassID_Name ON Student (ClassID, Name)")
+
+
+# Academic years and terms (see gradebook.terms). Existing results are
+# filed under the current calendar year by their Term text; the latest term
+# with results becomes the current term. (StudentID, TermID) replaces the
+# StudentID index so per-term lookups stay on the index as years pile up.
+def _terms(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS AcademicYear (
+        YearID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT UNIQUE NOT NULL,
+        Closed INTEGER NOT NULL DEFAULT 0,
+        ArchivePath TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Term (
+        TermID INTEGER PRIMARY KEY AUTOINCREMENT,
+        YearID INTEGER NOT NULL,
+        Name TEXT NOT NULL,
+        Position INTEGER NOT NULL,
+        IsCurrent INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (YearID, Name),
+        FOREIGN KEY (YearID) REFERENCES AcademicYear(YearID)
+    )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_Term_current ON Term (IsCurrent) WHERE IsCurrent = 1")
+    conn.execute("ALTER TABLE Results ADD COLUMN TermID INTEGER REFERENCES Term(TermID)")
+    conn.execute("UPDATE Results SET Term = 'Term 1' WHERE Term IS NULL OR Term = ''")
+
+    year_id = conn.execute("INSERT INTO AcademicYear (Name) VALUES (strftime('%Y', 'now'))").lastrowid
+    names = {row[0] for row in conn.execute("SELECT DISTINCT Term FROM Results")}
+    used = set(names)
+    names.update(("Term 1", "Term 2", "Term 3"))
+    ordered = sorted(names, key=lambda name: (len(name), name))
+    conn.executemany("INSERT INTO Term (YearID, Name, Position) VALUES (?, ?, ?)",
+                     [(year_id, name, position) for position, name in enumerate(ordered, 1)])
+    current = [name for name in ordered if name in used][-1:] or ["Term 1"]
+    conn.execute("UPDATE Term SET IsCurrent = 1 WHERE YearID = ? AND Name = ?", (year_id, current[0]))
+    conn.execute("UPDATE Results SET TermID = (SELECT TermID FROM Term WHERE Term.Name = Results.Term)")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Results_StudentID_TermID ON Results (StudentID, TermID)")
+    conn.execute("DROP INDEX IF EXISTS idx_Results_StudentID")
+
+
+# Stored passwords become salted hashes (see gradebook.auth)
+def _hashed_passwords(conn):
+    rows = conn.execute("SELECT UserID, Password FROM Teachers WHERE Password IS NOT NULL").fetchall()
+    conn.executemany("UPDATE Teachers SET Password = ? WHERE UserID = ?",
+                     [(auth.hash_password(password), user_id) for user_id, password in rows
+                      if not auth.is_hashed(password)])
+
+
+# One student per exam number, as both front ends assume. Students entered
+# twice (same exam number, name and class) are merged into the first one:
+# their results move with them, the summary triggers follow, and each merge
+# is reported on stderr. Students sharing an exam number but not the name or
+# class are different pupils; rather than lose one, the migration stops and
+# lists them for an operator to renumber. Class ranks are recomputed per
+# (ClassID, TermID) by migration 10, which rebuilds StudentSummary.
+def _unique_exam_numbers(conn):
+    duplicates = conn.execute("""
+        SELECT s.ExamNumber, s.StudentID, s.Name, s.ClassID, first.StudentID, first.Name, first.ClassID
+        FROM Student s
+        JOIN (SELECT ExamNumber, MIN(StudentID) AS StudentID FROM Student GROUP BY ExamNumber) keep
+          ON keep.ExamNumber = s.ExamNumber AND keep.StudentID != s.StudentID
+        JOIN Student first ON first.StudentID = keep.StudentID
+        ORDER BY s.ExamNumber, s.StudentID
+    """).fetchall()
+    conflicts = [row for row in duplicates if (row[2], row[3]) != (row[5], row[6])]
+    if conflicts:
+        raise MigrationError("Students share an exam number but not the name or class; give each a unique exam "
+                             "number and migrate again:\n" + "\n".join(
+                                 f"  {exam}: StudentID {dup} ({name!r}, class {class_id}) and StudentID {keep} "
+                                 f"({keep_name!r}, class {keep_class})"
+                                 for exam, dup, name, class_id, keep, keep_name, keep_class in conflicts))
+    for exam, dup, name, class_id, keep, _, _ in duplicates:
+        moved = conn.execute("UPDATE Results SET StudentID = ? WHERE StudentID = ?", (keep, dup)).rowcount
+        conn.execute("DELETE FROM Student WHERE StudentID = ?", (dup,))
+        sys.stderr.write(f"Merged duplicate student {exam} ({name!r}, class {class_id}): StudentID {dup} into "
+                         f"{keep}, {moved} results moved\n")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_Student_ExamNumber ON Student (ExamNumber)")
+
+
+# StudentSummary becomes one row per student and term (see gradebook.summary),
+# ranked within (ClassID, TermID): a pupil's average and position are those
+# of the term shown, not of every mark stored. Rows are only kept for results
+# with a TermID; archived terms have none (their rows left Results). The
+# TermID index serves the per-term class statistics (gradebook.analytics).
+def _summary_by_term(conn):
+    for trigger in ("trg_Results_insert_summary", "trg_Results_delete_summary", "trg_Results_update_summary",
+                    "trg_Student_class_summary"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS StudentSummary")
+    conn.execute("""
+    CREATE TABLE StudentSummary (
+        StudentID INTEGER NOT NULL,
+        TermID INTEGER NOT NULL,
+        ClassID INTEGER,
+        Total INTEGER NOT NULL,
+        Subjects INTEGER NOT NULL,
+        Average REAL NOT NULL,
+        Status TEXT NOT NULL,
+        ClassRank INTEGER,
+        PRIMARY KEY (StudentID, TermID),
+        FOREIGN KEY (StudentID) REFERENCES Student(StudentID),
+        FOREIGN KEY (TermID) REFERENCES Term(TermID)
+    )
+    """)
+    conn.execute("CREATE INDEX idx_StudentSummary_ClassID_TermID_Average "
+                 "ON StudentSummary (ClassID, TermID, Average DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Results_TermID ON Results (TermID)")
+    recompute = """
+        DELETE FROM StudentSummary
+        WHERE StudentID = {row}.StudentID AND TermID = {row}.TermID
+          AND NOT EXISTS (SELECT 1 FROM Results WHERE StudentID = {row}.StudentID AND TermID = {row}.TermID);
+        INSERT OR REPLACE INTO StudentSummary (StudentID, TermID, ClassID, Total, Subjects, Average, Status, ClassRank)
+        SELECT s.StudentID, r.TermID, s.ClassID, SUM(r.Score), COUNT(*), AVG(r.Score),
+               CASE WHEN AVG(r.Score) >= 40 THEN 'Passed' ELSE 'Failed' END,
+               (SELECT ClassRank FROM StudentSummary WHERE StudentID = s.StudentID AND TermID = r.TermID)
+        FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+        WHERE s.StudentID = {row}.StudentID AND r.TermID = {row}.TermID
+        GROUP BY s.StudentID, r.TermID;
+    """
+    conn.execute(f"""
+    CREATE TRIGGER trg_Results_insert_summary AFTER INSERT ON Results
+    BEGIN {recompute.format(row="NEW")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER trg_Results_delete_summary AFTER DELETE ON Results
+    BEGIN {recompute.format(row="OLD")} END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER trg_Results_update_summary AFTER UPDATE OF StudentID, Score, TermID ON Results
+    BEGIN {recompute.format(row="OLD")} {recompute.format(row="NEW")} END
+    """)
+    conn.execute("""
+    CREATE TRIGGER trg_Student_class_summary AFTER UPDATE OF ClassID ON Student
+    BEGIN
+        UPDATE StudentSummary SET ClassID = NEW.ClassID, ClassRank = NULL WHERE StudentID = NEW.StudentID;
+    END
+    """)
+    conn.execute("""
+    INSERT INTO StudentSummary (StudentID, TermID, ClassID, Total, Subjects, Average, Status, ClassRank)
+    SELECT StudentID, TermID, ClassID, Total, Subjects, Average, Status,
+           RANK() OVER (PARTITION BY ClassID, TermID ORDER BY Average DESC)
+    FROM (
+        SELECT s.StudentID, r.TermID, s.ClassID, SUM(r.Score) AS Total, COUNT(*) AS Subjects, AVG(r.Score) AS Average,
+               CASE WHEN AVG(r.Score) >= 40 THEN 'Passed' ELSE 'Failed' END AS Status
+        FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+        WHERE r.TermID IS NOT NULL
+        GROUP BY s.StudentID, r.TermID
+    )
+    """)
+
+
+# (version, description, step) -- append new migrations at the end, never edit old ones
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "sample data", _sample_data),
+    (3, "indexes on student and result lookups", _lookup_indexes),
+    (4, "per-student results version", _results_version),
+    (5, "materialized student summary", _student_summary),
+    (6, "index for class result listings", _class_listing_index),
+    (7, "academic years and terms", _terms),
+    (8, "hashed passwords", _hashed_passwords),
+    (9, "unique exam numbers", _unique_exam_numbers),
+    (10, "student summary per term", _summary_by_term),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Queries on the request path that must be answered from an index
+HOT_QUERIES = {
+    "student by exam number and class": ("SELECT StudentID FROM Student WHERE ExamNumber=? AND ClassID=?", ("EXAM001", 1)),
+    "student by exam number": ("SELECT StudentID FROM Student WHERE ExamNumber=?", ("EXAM001",)),
+    "results by student": ("SELECT Subject, Score FROM Results WHERE StudentID=?", (1,)),
+    "results by student and term": ("SELECT Subject, Score FROM Results WHERE StudentID=? AND TermID=?", (1, 1)),
+    "summary by student and term": ("SELECT Total, Subjects, Average, Status, ClassRank FROM StudentSummary "
+                                    "WHERE StudentID=? AND TermID=?", (1, 1)),
+    "class ranks by class": ("SELECT StudentID, TermID, Average FROM StudentSummary WHERE ClassID IN (?, ?)",
+                             (1, "KB3")),
+    "class analytics by term": ("SELECT s.ClassID, r.Score FROM Student s JOIN Results r ON r.StudentID = s.StudentID "
+                                "WHERE r.TermID = ?", (1,)),
+    "class analytics by class and term": ("SELECT s.ClassID, r.Score FROM Student s "
+                                          "JOIN Results r ON r.StudentID = s.StudentID "
+                                          "WHERE s.ClassID IN (?, ?) AND r.TermID = ?", (1, "KB3", 1)),
+    "class results by name": ("SELECT r.ResultID FROM Student s JOIN Results r ON r.StudentID = s.StudentID "
+                              "WHERE s.ClassID=? AND (s.Name, s.StudentID, r.ResultID) > (?, ?, ?) "
+                              "ORDER BY s.Name, s.StudentID, r.ResultID LIMIT 50", (1, "", 0, 0)),
+    "batch results by exam numbers": ("SELECT s.StudentID, r.Score FROM json_each(?) wanted "
+                                      "LEFT JOIN Student s ON s.ExamNumber = wanted.value "
+                                      "LEFT JOIN Results r ON r.StudentID = s.StudentID AND r.TermID = ?",
+                                      ('["EXAM001"]', 1)),
+}
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Apply every migration newer than the database's version. Returns the
+# (version, description) pairs that were applied.
+def migrate(conn):
+    applied = []
+    # An up-to-date database (every restart but the first) costs one PRAGMA
+    if schema_version(conn) >= LATEST_VERSION:
+        return applied
+    for version, description, step in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if version <= schema_version(conn):
+                conn.execute("COMMIT")
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append((version, description))
+    return applied
+
+
+# Returns a list of (query name, plan detail) for hot queries that scan a table
+def check_query_plans(conn):
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[-1]
+            # Walking a json_each() list of keys is the point, not a table scan
+            if detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail:
+                problems.append((name, detail))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply Kafumbwe Grade Book schema migrations")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--check-plans", action="store_true", help="fail if a hot query does a table scan")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        try:
+            for version, description in migrate(conn):
+                print(f"Applied migration {version}: {description}")
+        except MigrationError as exc:
+            print(exc, file=sys.stderr)
+            return 1
+        print(f"Schema version {schema_version(conn)}")
+        if args.check_plans:
+            problems = check_query_plans(conn)
+            for name, detail in problems:
+                print(f"Table scan in {name}: {detail}")
+            if problems:
+                return 1
+            print(f"All {len(HOT_QUERIES)} hot queries use an index")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# Position in class for each term, from an in-memory index.
+#
+# For every (class, term) the index keeps the pupils' averages in a sorted
+# list, so a pupil's position ("3rd of 41") and percentile come from two
+# bisections instead of sorting the class on every request. Ties share a
+# position, as with RANK() in StudentSummary.
+#
+# The index is built from one GROUP BY over Results when the server starts
+# (gradebook.startup), or by the first lookup if that comes sooner.
+# Writes report their students through hooks.results_changed(); only those
+# students' averages are read again and moved in the lists. Archived years
+# are read from their archive file the first time one of their terms is
+# asked for. Writes made by another server process are picked up by a
+# background rebuild every MAX_AGE seconds.
+#
+# Each (class, term) also has a version that changes whenever any pupil's
+# average in it does, for the ETag of pages that show positions (see
+# version()). Versions come from one counter that only goes up, started
+# from the clock (in milliseconds) so a restarted server does not hand out
+# a version an earlier one used for other marks. They are per process: a
+# pupil whose requests reach another --processes child gets one full page
+# before 304s resume.
+import bisect
+import collections
+import json
+import threading
+import time
+
+from gradebook import db, hooks, terms
+
+MAX_AGE = 60.0
+
+# position: 1 for the best average; percentile: share of the class below the
+# pupil, counting ties as half (0-100)
+Position = collections.namedtuple("Position", "position size percentile")
+
+_AVERAGES = """
+    SELECT r.StudentID, CAST(s.ClassID AS TEXT), r.TermID, AVG(r.Score)
+    FROM {results} r JOIN Student s ON s.StudentID = r.StudentID
+    {where}
+    GROUP BY r.StudentID, r.TermID
+"""
+
+# Live averages of some students, given as a JSON array of exam numbers
+# (one row with a NULL TermID for a student left without live results)
+_STUDENT_AVERAGES = """
+    SELECT s.StudentID, CAST(s.ClassID AS TEXT), r.TermID, AVG(r.Score)
+    FROM json_each(?) wanted
+    JOIN Student s ON s.ExamNumber = wanted.value
+    LEFT JOIN Results r ON r.StudentID = s.StudentID
+    GROUP BY s.StudentID, r.TermID
+"""
+
+
+class RankingIndex:
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._averages = {}    # (ClassID text, TermID) -> ascending list of averages
+        self._students = {}    # StudentID -> {(ClassID text, TermID): average}
+        self._versions = {}    # (ClassID text, TermID) -> (version, unix time of last change)
+        self._counter = time.time_ns() // 1000000
+        self._archived = set()  # TermIDs loaded from an archive file
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()  # one update() reading and applying at a time
+        self._build_lock = threading.Lock()   # one first build, however many threads need it
+        self._built_at = None
+        self._rebuilding = False
+        self._replay = None     # exam numbers updated while a build is reading
+        self.seconds = 0.0      # time the last full build took
+
+    def _add(self, student_id, key, average):
+        self._students.setdefault(student_id, {})[key] = average
+        bisect.insort(self._averages.setdefault(key, []), average)
+
+    def _remove(self, student_id, key):
+        average = self._students[student_id].pop(key)
+        averages = self._averages[key]
+        del averages[bisect.bisect_left(averages, average)]
+
+    # Give these classes a new version (call with self._lock held)
+    def _touch(self, keys, now):
+        for key in keys:
+            self._counter += 1
+            self._versions[key] = (self._counter, int(now))
+
+    # Read every live term's averages; archived terms are loaded again on demand
+    def build(self, conn=None):
+        started = time.perf_counter()
+        conn = conn or db.get_connection()
+        with self._lock:
+            self._replay = []
+        averages, students = {}, {}
+        for student_id, class_id, term_id, average in conn.execute(_AVERAGES.format(results="Results", where="")):
+            students.setdefault(student_id, {})[(class_id, term_id)] = average
+            averages.setdefault((class_id, term_id), []).append(average)
+        for values in averages.values():
+            values.sort()
+        with self._lock:
+            now = time.time()
+            # Archived terms are dropped here and keep their versions until reloaded
+            keys = {key for key in self._averages if key[1] not in self._archived} | set(averages)
+            changed = {key for key in keys if self._averages.get(key) != averages.get(key)}
+            self._averages, self._students, self._archived = averages, students, set()
+            self._touch(changed, now)
+            self._built_at = time.monotonic()
+            self.seconds = time.perf_counter() - started
+            replay, self._replay = self._replay, None
+        # Writes that landed while the build was reading may be missing from it
+        if replay:
+            self.update(replay, conn)
+        return len(students)
+
+    def _load_archived(self, conn, term):
+        rows = conn.execute(_AVERAGES.format(results=terms.results_table(conn, term), where="WHERE r.TermID=?"),
+                            (term.term_id,)).fetchall()
+        with self._lock:
+            if term.term_id in self._archived:
+                return
+            for student_id, class_id, term_id, average in rows:
+                self._add(student_id, (class_id, term_id), average)
+            self._archived.add(term.term_id)
+            self._touch({(class_id, term_id) for _, class_id, term_id, _ in rows}, time.time())
+
+    # Re-read the live averages of these students and move them in the lists.
+    # Updates read and apply one at a time, so rows read by an earlier update
+    # can never be applied over those of a later one; lookups carry on
+    # meanwhile (they only wait for the apply).
+    def update(self, exam_numbers, conn=None):
+        exam_numbers = [str(exam) for exam in exam_numbers]
+        with self._lock:
+            if self._replay is not None:
+                self._replay.extend(exam_numbers)
+            if self._built_at is None:
+                return
+        conn = conn or db.get_connection()
+        with self._update_lock:
+            rows = conn.execute(_STUDENT_AVERAGES, (json.dumps(exam_numbers),)).fetchall()
+            with self._lock:
+                keys = set()
+                # Every live entry of these students is replaced, which also
+                # follows a pupil who moved class
+                for student_id in {row[0] for row in rows}:
+                    keys.update(key for key in self._students.get(student_id, {}) if key[1] not in self._archived)
+                keys.update((class_id, term_id) for _, class_id, term_id, _ in rows if term_id is not None)
+                before = {key: list(self._averages.get(key, ())) for key in keys}
+                for student_id in {row[0] for row in rows}:
+                    for key in [key for key in self._students.get(student_id, {}) if key[1] not in self._archived]:
+                        self._remove(student_id, key)
+                for student_id, class_id, term_id, average in rows:
+                    if term_id is not None:
+                        self._add(student_id, (class_id, term_id), average)
+                self._touch([key for key in keys if self._averages.get(key, []) != before[key]], time.time())
+
+    # Build the index unless it is built already; a caller arriving during the
+    # first build (e.g. the start-up warm-up) waits for it instead of repeating it
+    def ensure_built(self):
+        with self._build_lock:
+            if self._built_at is None:
+                self.build()
+
+    # Whether the index can answer for `term`. False while another thread is
+    # making the first build: lookups then go without a position rather
+    # than wait for it.
+    def _ensure(self, term):
+        if self._built_at is None:
+            if not self._build_lock.acquire(blocking=False):
+                return False
+            try:
+                if self._built_at is None:
+                    self.build()
+            finally:
+                self._build_lock.release()
+        elif time.monotonic() - self._built_at > self.max_age and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, name="grade-ranking", daemon=True).start()
+        if term is not None and term.archive_path and term.term_id not in self._archived:
+            self._load_archived(db.get_connection(), term)
+        return True
+
+    def _rebuild(self):
+        try:
+            self.build()
+        finally:
+            self._rebuilding = False
+
+    # Position of a pupil in their class for a term (terms.Term), or None if
+    # they have no marks in it (or the index is still being built)
+    def position(self, student_id, class_id, term):
+        if not self._ensure(term):
+            return None
+        key = (str(class_id), term.term_id)
+        with self._lock:
+            average = self._students.get(student_id, {}).get(key)
+            if average is None:
+                return None
+            averages = self._averages[key]
+            below = bisect.bisect_left(averages, average)
+            above = len(averages) - bisect.bisect_right(averages, average)
+            equal = len(averages) - below - above
+        return Position(above + 1, len(averages), round(100.0 * (below + equal / 2) / len(averages), 1))
+
+    # (version, unix time of the last change) of a class's positions in a term
+    def version(self, class_id, term):
+        if not self._ensure(term):
+            return 0, 0
+        with self._lock:
+            return self._versions.get((str(class_id), term.term_id), (0, 0))
+
+    def stats(self):
+        return {"classes": len(self._averages), "students": len(self._students),
+                "build_ms": round(self.seconds * 1000, 1)}
+
+
+index = RankingIndex()
+
+
+@hooks.on_results_changed
+def _results_changed(exam_numbers, class_ids):
+    if exam_numbers:
+        index.update(exam_numbers)
+    elif class_ids is None:
+        index.build()
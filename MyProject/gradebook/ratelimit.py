@@ -0,0 +1,102 @@
+# Token-bucket rate limits for logins and result lookups.
+#
+# Each client IP and each account (username, or exam number for lookups) has
+# a bucket that refills at `rate` tokens per second up to `burst`; a request
+# takes one token or is answered 429 with Retry-After. Checks run before the
+# handler touches the database, so a scraper enumerating exam numbers or
+# guessing passwords costs a dict update per request, not a query. Lookups
+# the result cache can answer (a pupil refreshing, a 304) cost no query
+# either, so the front ends only check lookups that miss it.
+#
+# Buckets live in memory, at most MAX_KEYS per limit; the least recently used
+# are dropped first (a dropped bucket starts full again). Limits are per
+# server process.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+MAX_KEYS = 100000
+
+enabled = True
+
+
+class TokenBuckets:
+    def __init__(self, rate, burst, max_keys=MAX_KEYS):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max(1, int(max_keys))
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    # Take a token for `key`: 0.0 if allowed, otherwise seconds until one is free
+    def take(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            self.rejected += 1
+            return (1.0 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Logins: a few guesses per account, more per IP (a school may share one)
+login_ip = TokenBuckets(rate=1.0, burst=30)
+login_account = TokenBuckets(rate=5 / 60, burst=5)
+# Result lookups: a class checking results together stays well under these
+lookup_ip = TokenBuckets(rate=10.0, burst=60)
+lookup_account = TokenBuckets(rate=1.0, burst=20)
+
+
+def configure(enable=True):
+    global enabled
+    enabled = enable
+
+
+def _check(*limits):
+    if not enabled:
+        return 0.0
+    for buckets, key in limits:
+        wait = buckets.take(key)
+        if wait:
+            return wait
+    return 0.0
+
+
+# Seconds the client must wait before this login may be tried (0.0: go ahead)
+def check_login(ip, username):
+    return _check((login_ip, ip), (login_account, username.lower()))
+
+
+# Seconds the client must wait before this result lookup may be made (0.0: go ahead)
+def check_lookup(ip, exam_number):
+    return _check((lookup_ip, ip), (lookup_account, exam_number))
+
+
+def send_too_many_requests(handler, retry_after):
+    body = b"<h1>429 Too many requests, try again later</h1>"
+    handler.send_response(429)
+    handler.send_header("Retry-After", str(max(1, math.ceil(retry_after))))
+    handler.send_header("Content-type", "text/html")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def stats():
+    return {name: {"keys": len(buckets), "rejected": buckets.rejected}
+            for name, buckets in (("login_ip", login_ip), ("login_account", login_account),
+                                  ("lookup_ip", lookup_ip), ("lookup_account", lookup_account))}
@@ -0,0 +1,128 @@
+# Page rendering helpers shared by the handlers.
+#
+# The page shell (layout around the content) never changes, so it is split
+# and encoded once at import time. It links the stylesheet served from
+# /static/ (see gradebook.assets); pages saved outside the server, such as
+# report cards, use the standalone shell with the stylesheet inlined.
+# Fragments built from the database, such as the class dropdown, are cached
+# until invalidated.
+import html
+import threading
+
+from gradebook import assets, db, terms
+
+_PAGE_TEMPLATE = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8" />
+        <meta name="viewport" content="width=device-width, initial-scale=1.0"/>
+        <title>KAFUMBWE GRADE BOOK SYSTEM</title>
+        {head}
+    </head>
+    <body>
+        <div class="container">
+            <h1>KAFUMBWE GRADE BOOK SYSTEM</h1>
+            {content}
+        </div>
+    </body>
+    </html>
+    """
+
+_LINKED_TEMPLATE = _PAGE_TEMPLATE.replace("{head}", f'<link rel="stylesheet" href="{assets.url("style.css")}" />')
+SHELL_PREFIX, SHELL_SUFFIX = (part.encode() for part in _LINKED_TEMPLATE.split("{content}"))
+_STANDALONE_TEMPLATE = _PAGE_TEMPLATE.replace("{head}", f"<style>\n{assets.text('style.css')}</style>")
+STANDALONE_PREFIX, STANDALONE_SUFFIX = (part.encode() for part in _STANDALONE_TEMPLATE.split("{content}"))
+
+
+# Helper function to generate styled HTML with background
+def get_html(content):
+    return _LINKED_TEMPLATE.replace("{content}", content)
+
+
+# Same page as get_html(), already encoded for the response
+def page(content):
+    return b"".join((SHELL_PREFIX, content.encode(), SHELL_SUFFIX))
+
+
+# Same page with the stylesheet inlined, for files opened away from the server
+def standalone_page(content):
+    return b"".join((STANDALONE_PREFIX, content.encode(), STANDALONE_SUFFIX))
+
+
+# Same page again, as a generator for streaming.send_stream(): `parts` is an
+# iterable of content strings (e.g. table rows)
+def stream_page(parts):
+    yield SHELL_PREFIX
+    yield from parts
+    yield SHELL_SUFFIX
+
+
+# A results table, one <tr> per (subject, score) row, yielded as each is rendered
+def result_table(rows):
+    yield "<table><tr><th>Subject</th><th>Score</th></tr>"
+    for subject, score in rows:
+        yield f"<tr><td>{html.escape(str(subject))}</td><td>{score}</td></tr>"
+    yield "</table>"
+
+
+# Cache for rendered fragments. The generation counter stops a build that
+# raced with invalidate() from storing a stale value.
+class FragmentCache:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key, build):
+        value = self._values.get(key)
+        if value is not None:
+            return value
+        generation = self._generation
+        value = build()
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = value
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._values.clear()
+
+
+fragments = FragmentCache()
+
+
+def _build_class_options():
+    classes = db.get_connection().execute("SELECT ClassID, ClassName FROM Class ORDER BY ClassID").fetchall()
+    return "".join(f'<option value="{c[0]}">{html.escape(str(c[1]))}</option>' for c in classes)
+
+
+# <option> list for every class
+def class_options():
+    return fragments.get("class_options", _build_class_options)
+
+
+def _build_term_options():
+    return "".join(f'<option value="{t.term_id}"{" selected" if t.is_current else ""}>'
+                   f'{html.escape(f"{t.year} {t.name}")}</option>'
+                   for t in terms.list_terms(db.get_connection()))
+
+
+# <option> list for every term, the current one selected
+def term_options():
+    return fragments.get("term_options", _build_term_options)
+
+
+# `options` with `value` selected instead of the default
+def select(options, value):
+    value = html.escape(str(value))
+    return options.replace(" selected>", ">").replace(f'value="{value}">', f'value="{value}" selected>')
+
+
+# Must be called after any write to the Class or Term tables: drops the
+# dropdowns and every cached page built from them
+def invalidate_classes():
+    terms.invalidate()
+    fragments.invalidate()
@@ -0,0 +1,223 @@
+# Batch report cards: one card per pupil, written into a ZIP (one HTML page
+# per pupil) or a single printable HTML document (one card per printed page).
+#
+# Each class is read with a single query. Cards are rendered in parallel by a
+# process pool while the next class is being read, then collected in order.
+# Cards use the same page styling as the web pages, inlined so they can be
+# opened and printed without the server (render.standalone_page).
+#
+#   python -m gradebook.reportcards cards.zip
+#   python -m gradebook.reportcards cards.html --class-id 1 2 --term-id 3
+import argparse
+import collections
+import concurrent.futures
+import os
+import re
+import sys
+import time
+import zipfile
+from html import escape
+
+from gradebook import analytics, db, migrations, render, terms
+
+FORMATS = ("zip", "html")
+
+# Cards handed to a worker process at a time
+BATCH_SIZE = 200
+
+Card = collections.namedtuple("Card", "exam_number name class_name term rows total average status position")
+
+
+class ReportCardReport:
+    def __init__(self):
+        self.classes = 0
+        self.pupils = 0
+        self.seconds = 0.0
+
+    @property
+    def pupils_per_second(self):
+        return self.pupils / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "classes": self.classes,
+            "pupils": self.pupils,
+            "seconds": round(self.seconds, 3),
+            "pupils_per_second": round(self.pupils_per_second, 1),
+        }
+
+
+def _grade(score):
+    for minimum, grade in analytics.GRADE_BANDS:
+        if score >= minimum:
+            return grade
+    return analytics.GRADE_BANDS[-1][1]
+
+
+# Every pupil's card for one class (only `term`, a terms.Term, if given), from
+# one query whose rows are grouped into pupils as they are read off the cursor.
+# The cards themselves are kept: positions need every pupil's average before
+# the first card can be rendered.
+# Returns (class name, [Card]) with cards in name order and positions ranked
+# on the marks shown.
+def fetch_class(conn, class_id, term=None):
+    row = conn.execute("SELECT ClassName FROM Class WHERE ClassID=?", (class_id,)).fetchone()
+    class_name = row[0] if row else str(class_id)
+    where, params = "s.ClassID=?", [class_id]
+    if term:
+        where += " AND r.TermID=?"
+        params.append(term.term_id)
+    cursor = conn.execute(f"""
+        SELECT s.StudentID, s.ExamNumber, s.Name, r.Term, r.Subject, r.Score
+        FROM Student s JOIN {terms.results_table(conn, term)} r ON r.StudentID = s.StudentID
+        WHERE {where}
+        ORDER BY s.Name, s.StudentID, r.Term, r.Subject
+    """, params)
+
+    pupils = []
+    current, marks = None, []
+    for student_id, exam_number, name, row_term, subject, score in cursor:
+        if student_id != current:
+            if marks:
+                pupils.append((exam, pupil_name, marks))
+            current, exam, pupil_name, marks = student_id, exam_number, name, []
+        marks.append((row_term, subject, score))
+    if marks:
+        pupils.append((exam, pupil_name, marks))
+
+    averages = sorted((sum(score for _, _, score in marks) / len(marks) for _, _, marks in pupils), reverse=True)
+    positions = {}
+    for index, average in enumerate(averages):
+        positions.setdefault(average, index + 1)
+
+    term_name = f"{term.year} {term.name}" if term else None
+    cards = []
+    for exam_number, name, marks in pupils:
+        total = sum(score for _, _, score in marks)
+        average = total / len(marks)
+        cards.append(Card(str(exam_number), name, class_name, term_name, tuple(marks), total, round(average, 1),
+                          "Passed" if average >= analytics.PASS_MARK else "Failed", positions[average]))
+    return class_name, cards
+
+
+def card_content(card, class_size):
+    rows = "".join(
+        f"<tr><td>{escape(str(term))}</td><td>{escape(str(subject))}</td><td>{score}</td><td>{_grade(score)}</td></tr>"
+        for term, subject, score in card.rows)
+    return f"""
+        <h2>Report Card</h2>
+        <p><b>Name:</b> {escape(str(card.name))} &nbsp; <b>Exam Number:</b> {escape(card.exam_number)}<br/>
+           <b>Class:</b> {escape(str(card.class_name))} &nbsp; <b>Term:</b> {escape(card.term or "All terms")}</p>
+        <table><tr><th>Term</th><th>Subject</th><th>Score</th><th>Grade</th></tr>{rows}</table>
+        <h4>Total: {card.total} &nbsp; Average: {card.average} &nbsp; Grade: {_grade(card.average)}
+            &nbsp; Status: {card.status} &nbsp; Position: {card.position} of {class_size}</h4>
+    """
+
+
+# Worker: render a batch of cards. zip -> [(file name, page bytes)],
+# html -> [card fragment bytes] for one combined document.
+def _render_batch(cards, class_size, fmt):
+    if fmt == "zip":
+        return [(card_filename(card), render.standalone_page(card_content(card, class_size))) for card in cards]
+    return [f'<div class="report-card">{card_content(card, class_size)}</div>'.encode() for card in cards]
+
+
+def card_filename(card):
+    def clean(text):
+        return re.sub(r"[^A-Za-z0-9._-]+", "_", str(text)).strip("_") or "unnamed"
+    return f"{clean(card.class_name)}/{clean(card.exam_number)}-{clean(card.name)}.html"
+
+
+_PRINT_STYLE = """<style>
+    .report-card { page-break-after: always; break-after: page; }
+    .report-card:last-child { page-break-after: auto; break-after: auto; }
+</style>"""
+
+
+def _class_ids(conn, class_ids):
+    if class_ids:
+        return list(class_ids)
+    return [row[0] for row in conn.execute("SELECT ClassID FROM Class ORDER BY ClassID")]
+
+
+# Write report cards for the given classes (all if None) to `output`, a path
+# or a binary file object. processes=1 renders in this process (no pool).
+def generate(conn, output, class_ids=None, term=None, fmt="zip", processes=None):
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    report = ReportCardReport()
+    started = time.perf_counter()
+    processes = processes or os.cpu_count() or 1
+    pool = concurrent.futures.ProcessPoolExecutor(processes) if processes > 1 else None
+
+    def submit(cards, class_size):
+        if pool is None:
+            return _render_batch(cards, class_size, fmt)
+        return pool.submit(_render_batch, cards, class_size, fmt)
+
+    try:
+        # Batches are queued while later classes are still being read
+        batches = []
+        for class_id in _class_ids(conn, class_ids):
+            _, cards = fetch_class(conn, class_id, term)
+            report.classes += 1
+            report.pupils += len(cards)
+            for i in range(0, len(cards), BATCH_SIZE):
+                batches.append(submit(cards[i:i + BATCH_SIZE], len(cards)))
+
+        rendered = (batch.result() if pool else batch for batch in batches)
+        if fmt == "zip":
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+                for batch in rendered:
+                    for name, page in batch:
+                        archive.writestr(name, page)
+        else:
+            out = open(output, "wb") if isinstance(output, (str, os.PathLike)) else output
+            try:
+                out.write(render.STANDALONE_PREFIX)
+                out.write(_PRINT_STYLE.encode())
+                for batch in rendered:
+                    out.writelines(batch)
+                out.write(render.STANDALONE_SUFFIX)
+            finally:
+                if out is not output:
+                    out.close()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate report cards for every pupil")
+    parser.add_argument("output", help="output file: .zip (one page per pupil) or .html (one printable document)")
+    parser.add_argument("--class-id", nargs="+", help="only these classes (default: all)")
+    parser.add_argument("--term-id", type=int, help="only this term's results, see gradebook.terms list "
+                                                    "(default: all terms of open years)")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: from the file extension)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="rendering processes (default: %(default)s)")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("html" if args.output.lower().endswith((".html", ".htm")) else "zip")
+    conn = db.connect(args.db)
+    try:
+        migrations.migrate(conn)
+        term = None
+        if args.term_id is not None:
+            term = terms.get(conn, args.term_id)
+            if term is None:
+                print(f"no term with id {args.term_id}", file=sys.stderr)
+                return 1
+        report = generate(conn, args.output, args.class_id, term, fmt, args.processes)
+    finally:
+        conn.close()
+    print(f"Wrote {report.pupils} report cards for {report.classes} classes to {args.output} "
+          f"in {report.seconds:.2f}s ({report.pupils_per_second:.0f} pupils/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# Data access shared by both front ends (How.py and viewResults.py).
+#
+# Handlers call these instead of writing SQL, so each statement exists once.
+# The SQL text is fixed for each function, which lets every pooled
+# connection's statement cache (db.STATEMENT_CACHE_SIZE) prepare it once and
+# reuse it for the life of the worker thread.
+from gradebook import db, migrations, writer
+from gradebook.edits import parse_score
+
+_ACCOUNT = "SELECT Password, Role FROM Teachers WHERE Username=?"
+_SET_PASSWORD = "UPDATE Teachers SET Password=? WHERE Username=?"
+_STUDENT_BY_EXAM = "SELECT StudentID, ClassID FROM Student WHERE ExamNumber=?"
+_INSERT_STUDENT = "INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)"
+_INSERT_RESULT = "INSERT INTO Results (StudentID, Subject, Score, Term, TermID) VALUES (?, ?, ?, ?, ?)"
+_EDITOR_ROWS = """
+    SELECT r.ResultID, r.Subject, r.Score, r.Term, s.Name
+    FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+    WHERE s.ExamNumber=?
+    ORDER BY r.ResultID
+"""
+
+
+# Apply pending schema migrations (existing data is kept)
+def init_db(path=None):
+    conn = db.connect(path)
+    try:
+        for version, description in migrations.migrate(conn):
+            print(f"Applied migration {version}: {description}")
+    finally:
+        conn.close()
+
+
+# (stored password, role) for a login name, or None
+def find_account(conn, username):
+    return conn.execute(_ACCOUNT, (username,)).fetchone()
+
+
+def set_password_hash(conn, username, hashed):
+    with conn:
+        conn.execute(_SET_PASSWORD, (hashed, username))
+
+
+# Validate parallel subject/score lists into [(subject, score)]. Raises
+# ValueError describing the first bad entry.
+def parse_marks(subjects, scores):
+    if len(subjects) != len(scores):
+        raise ValueError("Number of subjects and scores do not match.")
+    return [(subject, parse_score(score)) for subject, score in zip(subjects, scores)]
+
+
+# Add marks for a student, creating the student if the exam number is new
+# (an existing student keeps their class). Written by the group-commit writer
+# (gradebook.writer) and reported to hooks.results_changed() before this
+# returns. Returns the student's class.
+def add_results(exam_number, name, class_id, marks, term):
+    def work(conn):
+        student_class = class_id
+        row = conn.execute(_STUDENT_BY_EXAM, (exam_number,)).fetchone()
+        if row:
+            student_id, student_class = row
+        else:
+            student_id = conn.execute(_INSERT_STUDENT, (exam_number, name, class_id)).lastrowid
+        conn.executemany(_INSERT_RESULT, [(student_id, subject, score, term.name, term.term_id)
+                                          for subject, score in marks])
+        return [exam_number], [student_class]
+
+    return writer.write(work)[1][0]
+
+
+# (ResultID, Subject, Score, Term, Name) for every result of one exam number
+def editor_rows(conn, exam_number):
+    return conn.execute(_EDITOR_ROWS, (exam_number,)).fetchall()
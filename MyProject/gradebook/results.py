@@ -0,0 +1,232 @@
+# Read-through cache for a student's results page data.
+#
+# Results are written rarely (a teacher posts once) and read constantly
+# (every pupil, every refresh), so lookups by (exam number, class) are served
+# from an in-memory LRU. Write paths report the exam numbers they touched via
+# hooks.results_changed(), which invalidates them here; entries also expire
+# after RESULT_CACHE_MAX_AGE so writes made by other processes are picked up.
+import base64
+import collections
+import json
+
+from gradebook import analytics, db, hooks, terms
+from gradebook.cache import LRUCache
+
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_MAX_AGE = 10.0
+
+StudentResults = collections.namedtuple("StudentResults", "student_id version updated_at summary rows")
+
+# Row of StudentSummary for one term: None for a student without results
+Summary = collections.namedtuple("Summary", "total subjects average status class_rank")
+
+# Cached marker for "no such student", so repeated bad lookups skip the DB too
+NOT_FOUND = StudentResults(None, None, None, None, ())
+
+cache = LRUCache(RESULT_CACHE_SIZE, max_age=RESULT_CACHE_MAX_AGE)
+
+
+def _key(exam_number, class_id, term_id=None):
+    return str(exam_number), str(class_id), term_id
+
+
+# StudentResults for the student (NOT_FOUND if there is none), from the cache
+# when possible. With a term (terms.Term) only that term's marks are read and
+# the summary is the term's StudentSummary row; archived terms have none, so
+# theirs is worked out from the marks (no class rank). Without a term, every
+# mark in the live Results table, summarised the same way. The marks are read
+# into the cached entry; pages render them with render.result_table.
+def lookup(exam_number, class_id, term=None):
+    key = _key(exam_number, class_id, term.term_id if term else None)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    generation = cache.generation()
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT s.StudentID, s.ResultsVersion, s.ResultsUpdatedAt,
+               ss.Total, ss.Subjects, ss.Average, ss.Status, ss.ClassRank
+        FROM Student s LEFT JOIN StudentSummary ss ON ss.StudentID = s.StudentID AND ss.TermID = ?
+        WHERE s.ExamNumber=? AND s.ClassID=?
+    """, (term.term_id if term else None, exam_number, class_id))
+    row = cursor.fetchone()
+    if row:
+        student_id, version, updated_at = row[:3]
+        if term is None:
+            cursor.execute("SELECT Subject, Score FROM Results WHERE StudentID=?", (student_id,))
+        else:
+            cursor.execute(f"SELECT Subject, Score FROM {terms.results_table(conn, term)} "
+                           f"WHERE StudentID=? AND TermID=?", (student_id, term.term_id))
+        rows = tuple(cursor.fetchall())
+        summary = Summary(*row[3:]) if row[3] is not None else _term_summary(rows)
+        entry = StudentResults(student_id, version, updated_at, summary, rows)
+    else:
+        entry = NOT_FOUND
+    cache.set(key, entry, tag=key[0], generation=generation)
+    return entry
+
+
+# Whether lookup() would be answered from the cache without touching the
+# database. `term_id` is as the request gave it ("" or None: the current term).
+def is_cached(exam_number, class_id, term_id=None):
+    term = terms.cached(term_id)
+    return term is not None and _key(exam_number, class_id, term.term_id) in cache
+
+
+def _term_summary(rows):
+    if not rows:
+        return None
+    total = sum(score for _, score in rows)
+    average = total / len(rows)
+    return Summary(total, len(rows), average, "Passed" if average >= analytics.PASS_MARK else "Failed", None)
+
+
+# Exam numbers one batch lookup (/api/results) may ask for
+MAX_BATCH = 500
+
+# A student's marks for one term in a batch lookup; student_id is None for
+# an exam number that matches no student
+BatchResult = collections.namedtuple("BatchResult", "exam_number student_id name class_id summary rows")
+
+
+# Results of many students for one term (terms.Term), read with a single
+# query and yielded in the order asked, one BatchResult per distinct exam
+# number. The exam numbers go in as one JSON array joined through json_each,
+# so the statement text is the same for every batch and stays prepared.
+# Not cached: each batch is read straight from the database. Raises
+# ValueError straight away (before anything is read) for too many exam numbers.
+def lookup_many(exam_numbers, term):
+    exam_numbers = list(dict.fromkeys(str(exam) for exam in exam_numbers))
+    if not exam_numbers or len(exam_numbers) > MAX_BATCH:
+        raise ValueError(f"between 1 and {MAX_BATCH} exam numbers are required")
+    return _read_batch(exam_numbers, term)
+
+
+def _read_batch(exam_numbers, term):
+    conn = db.get_connection()
+    cursor = conn.execute(f"""
+        SELECT wanted.value, s.StudentID, s.Name, s.ClassID, r.Subject, r.Score
+        FROM json_each(?) wanted
+        LEFT JOIN Student s ON s.ExamNumber = wanted.value
+        LEFT JOIN {terms.results_table(conn, term)} r ON r.StudentID = s.StudentID AND r.TermID = ?
+        ORDER BY wanted.key, r.ResultID
+    """, (json.dumps(exam_numbers), term.term_id))
+    current, rows = None, []
+    for exam_number, student_id, name, class_id, subject, score in cursor:
+        if current is None or exam_number != current[0]:
+            if current is not None:
+                yield BatchResult(*current, _term_summary(rows), tuple(rows))
+            current, rows = (exam_number, student_id, name, class_id), []
+        if subject is not None:
+            rows.append((subject, score))
+    if current is not None:
+        yield BatchResult(*current, _term_summary(rows), tuple(rows))
+
+
+# One row of a class listing
+ClassResult = collections.namedtuple("ClassResult", "result_id student_id exam_number name subject score term")
+
+SORTS = ("name", "score")
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Keyset pagination: each page continues strictly after the last row of the
+# previous one, so the database seeks straight to it instead of counting past
+# OFFSET rows and the last page costs the same as the first.
+#   name:  (Name, StudentID, ResultID) ascending, walked via idx_Student_ClassID_Name
+#   score: (Score, ResultID) descending
+_ORDER = {
+    "name": ("(s.Name, s.StudentID, r.ResultID) > (?, ?, ?)", "s.Name, s.StudentID, r.ResultID"),
+    "score": ("(r.Score, r.ResultID) < (?, ?)", "r.Score DESC, r.ResultID DESC"),
+}
+
+
+def _page_key(sort, row):
+    if sort == "name":
+        return [row.name, row.student_id, row.result_id]
+    return [row.score, row.result_id]
+
+
+# Opaque token for the page after `row`
+def encode_cursor(sort, row):
+    return base64.urlsafe_b64encode(json.dumps(_page_key(sort, row)).encode()).decode().rstrip("=")
+
+
+# A value SQLite can bind: cursors come from the client, so check every one
+def _cursor_value(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return -2 ** 63 <= value < 2 ** 63
+    return value is None or isinstance(value, (str, float))
+
+
+def decode_cursor(sort, token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        raise ValueError("invalid page cursor") from None
+    if not isinstance(key, list) or len(key) != len(_page_key(sort, ClassResult(*[None] * 7))):
+        raise ValueError("page cursor does not match the sort order")
+    if not all(_cursor_value(value) for value in key):
+        raise ValueError("invalid page cursor")
+    return key
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"limit must be a whole number, got {value!r}") from None
+    if limit < 1:
+        raise ValueError(f"limit must be at least 1, got {limit}")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# One page of a class's results, optionally only one term (terms.Term) and/or
+# subject. Returns (rows, cursor for the next page or None). Raises ValueError
+# for a bad sort, cursor or limit. A page (at most MAX_PAGE_SIZE rows) is read
+# whole, since the next-page cursor needs its last row; what streams is the
+# rendering of it (How.py class_results_parts).
+def class_results(class_id, term=None, subject=None, sort="name", cursor=None, limit=PAGE_SIZE):
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    limit = parse_limit(limit)
+    seek, order = _ORDER[sort]
+    where, params = ["s.ClassID=?"], [class_id]
+    if term:
+        where.append("r.TermID=?")
+        params.append(term.term_id)
+    if subject:
+        where.append("r.Subject=?")
+        params.append(subject)
+    if cursor:
+        where.append(seek)
+        params.extend(decode_cursor(sort, cursor))
+    conn = db.get_connection()
+    cursor = conn.execute(f"""
+        SELECT r.ResultID, s.StudentID, s.ExamNumber, s.Name, r.Subject, r.Score, r.Term
+        FROM Student s JOIN {terms.results_table(conn, term)} r ON r.StudentID = s.StudentID
+        WHERE {' AND '.join(where)}
+        ORDER BY {order}
+        LIMIT ?
+    """, params + [limit + 1])
+    rows = [ClassResult(*row) for row in cursor]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(sort, rows[-1])
+    return rows, None
+
+
+def invalidate_exam(exam_number):
+    cache.invalidate_tag(str(exam_number))
+
+
+@hooks.on_results_changed
+def _results_changed(exam_numbers, class_ids):
+    for exam_number in exam_numbers:
+        invalidate_exam(exam_number)
+
+
+def stats():
+    return cache.stats()
@@ -0,0 +1,162 @@
+import os
+import queue
+import signal
+import socketserver
+import threading
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+DEFAULT_BACKLOG = 128
+
+REJECT_BODY = b"<h1>503 Server busy, try again</h1>"
+REJECT_RESPONSE = (
+    b"HTTP/1.0 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Type: text/html\r\n"
+    b"Content-Length: " + str(len(REJECT_BODY)).encode() + b"\r\n"
+    b"Connection: close\r\n\r\n" + REJECT_BODY
+)
+
+
+# TCP server that hands accepted connections to a fixed pool of worker threads.
+# At most `backlog` connections wait for a free worker; anything beyond that is
+# answered with a 503 straight away instead of queueing behind slow clients.
+class PooledHTTPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS,
+                 backlog=DEFAULT_BACKLOG, bind_and_activate=True):
+        self.workers = max(1, int(workers))
+        self.request_queue_size = max(1, int(backlog))  # listen() backlog
+        self._pending = queue.Queue(maxsize=self.request_queue_size)
+        self._threads = []
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    # Workers are started here rather than in __init__ so that forked
+    # children (see serve()) each get their own pool.
+    def serve_forever(self, poll_interval=0.5):
+        self._start_workers()
+        super().serve_forever(poll_interval)
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"grade-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request)
+
+    def reject_request(self, request):
+        try:
+            request.sendall(REJECT_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    # Stop listening, let the workers finish whatever is already queued, then join them
+    def server_close(self):
+        super().server_close()
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._pending.put(None)
+        for thread in threads:
+            thread.join()
+
+
+# Common command line options for both front ends
+def add_arguments(parser, port=3000):
+    parser.add_argument("--port", type=int, default=port, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="worker threads per process (default: %(default)s)")
+    parser.add_argument("--backlog", type=int, default=DEFAULT_BACKLOG,
+                        help="connections allowed to wait for a worker before getting 503 (default: %(default)s)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="forked server processes sharing the listening socket (default: %(default)s)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve connections from an asyncio event loop (keep-alive, many idle clients); "
+                             "--workers then sizes the thread pool used for database work")
+    parser.add_argument("--slow-ms", type=float, default=None,
+                        help="log requests slower than this many milliseconds, with their SQL, to stderr")
+    parser.add_argument("--no-rate-limit", dest="rate_limit", action="store_false",
+                        help="turn off the per-IP and per-account limits on logins and result lookups "
+                             "(e.g. for load tests from one machine)")
+    parser.add_argument("--no-gzip", dest="gzip", action="store_false",
+                        help="send responses uncompressed even to clients that accept gzip")
+    parser.add_argument("--no-group-commit", dest="group_commit", action="store_false",
+                        help="write each teacher submission in its own transaction on the request thread")
+    parser.add_argument("--flush-ms", type=float, default=2.0,
+                        help="milliseconds the writer waits for more submissions to commit together "
+                             "(default: %(default)s)")
+    parser.add_argument("--warm", choices=("background", "before", "off"), default="background",
+                        help="when to preload the dropdowns, class rankings and database pages: after the port "
+                             "is open, before it is opened, or not at all (default: %(default)s)")
+    return parser
+
+
+def _serve_until_stopped(server, on_start=None):
+    # shutdown() blocks until serve_forever returns, so it must run on another thread
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if on_start is not None:
+        on_start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# Run the server until SIGINT/SIGTERM, draining in-flight requests before exit.
+# With processes > 1 the listening socket is shared by forked children so
+# request handling can use more than one core. `on_start()` runs in each
+# serving process just before it starts accepting connections.
+def serve(server, processes=1, on_start=None):
+    if processes <= 1 or not hasattr(os, "fork"):
+        _serve_until_stopped(server, on_start)
+        return
+
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                _serve_until_stopped(server, on_start)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        server.server_close()
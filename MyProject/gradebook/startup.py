@@ -0,0 +1,121 @@
+# Fast server start-up, so a restart (a rolling restart on exam day, say)
+# leaves clients waiting milliseconds instead of refused.
+#
+# Only what must happen before a request can be answered is done before the
+# listening socket is bound: migrations, which cost one PRAGMA when the
+# schema is already at migrations.LATEST_VERSION. Everything the first
+# requests would otherwise fill one by one is warmed afterwards, according
+# to --warm:
+#
+#   background  (default) in a thread once the server is listening; requests
+#               arriving meanwhile are served, filling what they need
+#   before      before the socket is bound, so the first request finds
+#               everything ready (how the servers used to start)
+#   off         nothing is preloaded
+#
+# Warming builds the class and term dropdowns and any pages the front end
+# adds (add_step), the class ranking index (gradebook.ranking), and asks the
+# OS to read the database file into its page cache, which each connection's
+# SQLite page cache then fills from without touching the disk. The result
+# cache is not preloaded: its entries expire after
+# results.RESULT_CACHE_MAX_AGE seconds anyway.
+#
+# Start-up times are printed and reported under "startup" in /cache_stats.
+import os
+import sys
+import threading
+import time
+import traceback
+
+from gradebook import db, ranking, render
+
+WARM_MODES = ("background", "before", "off")
+READ_CHUNK = 1 << 20
+
+
+# time.monotonic() at which this process started (its fork, for a forked
+# server), or at this module's import where the OS does not say
+def _process_started():
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(0.0, age)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+
+started_at = _process_started()
+warm_mode = "background"
+
+_steps = []   # (name, function) warmed in order
+_report = {}
+
+
+def configure(mode="background"):
+    global warm_mode
+    if mode not in WARM_MODES:
+        raise ValueError(f"warm mode must be one of {', '.join(WARM_MODES)}")
+    warm_mode = mode
+
+
+# Have `function()` run when warming, after the dropdowns and before the
+# ranking index. Front ends add the pages they cache.
+def add_step(name, function):
+    _steps.append((name, function))
+
+
+def _prefetch_database():
+    for path in (db.DB_PATH, db.DB_PATH + "-wal"):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            if hasattr(os, "posix_fadvise"):
+                # The kernel reads ahead in the background; this returns at once
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while f.read(READ_CHUNK):
+                    pass
+
+
+# Run every warm-up step, recording how long each took. Errors are logged
+# and the step skipped: whatever it would have loaded is loaded on first use.
+def warm():
+    began = time.perf_counter()
+    steps = [("dropdowns", lambda: (render.class_options(), render.term_options()))] + _steps + [
+        ("ranking", ranking.index.ensure_built),
+        ("database pages", _prefetch_database),
+    ]
+    timings = {}
+    for name, function in steps:
+        step_began = time.perf_counter()
+        try:
+            function()
+        except Exception:
+            sys.stderr.write(f"warm-up step {name!r} failed\n")
+            traceback.print_exc()
+        timings[name] = round((time.perf_counter() - step_began) * 1000, 1)
+    _report.update(warm_ms=round((time.perf_counter() - began) * 1000, 1), warm_steps=timings)
+    print(f"Warmed up in {_report['warm_ms']:.0f} ms ("
+          + ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items()) + ")", flush=True)
+
+
+# Call once migrations are done, before binding the socket
+def before_listening():
+    if warm_mode == "before":
+        warm()
+
+
+# Call once the server is accepting connections (serving.serve's on_start,
+# so each forked process warms its own caches)
+def listening():
+    _report["listening_ms"] = round((time.monotonic() - started_at) * 1000, 1)
+    print(f"Listening {_report['listening_ms']:.0f} ms after start", flush=True)
+    if warm_mode == "background":
+        threading.Thread(target=warm, name="grade-warm-up", daemon=True).start()
+
+
+def stats():
+    return {"warm": warm_mode, **_report}
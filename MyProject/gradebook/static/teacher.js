@@ -0,0 +1,18 @@
+// Teacher page: extra subject/score rows and the bulk import upload.
+
+// Another row from the <template id="result-entry"> on the page
+function addResult() {
+    const row = document.getElementById('result-entry').content.cloneNode(true);
+    document.getElementById('results-container').appendChild(row);
+}
+
+function importResults(event) {
+    event.preventDefault();
+    const file = document.getElementById('import-file').files[0];
+    const report = document.getElementById('import-report');
+    report.textContent = 'Importing...';
+    fetch('/teacher/import?filename=' + encodeURIComponent(file.name), {method: 'POST', body: file})
+        .then(response => response.json())
+        .then(data => { report.textContent = JSON.stringify(data, null, 2); })
+        .catch(err => { report.textContent = 'Import failed: ' + err; });
+}
@@ -0,0 +1,63 @@
+# Streamed responses for pages whose size grows with the data (class-wide
+# and term-history tables).
+#
+# The page is produced by a generator and written out in chunks of about
+# CHUNK_SIZE bytes as it is generated, so memory per request stays constant
+# and the first bytes go out before the last rows have been read. HTTP/1.1
+# requests on an HTTP/1.1 handler (the --async server) get
+# Transfer-Encoding: chunked and keep their connection. Everything else gets
+# an HTTP/1.0-style body that ends when the connection closes. Clients that
+# accept gzip get each chunk compressed (see gradebook.compression).
+from gradebook import compression, httpcache
+
+CHUNK_SIZE = 16 * 1024
+
+
+def _chunked(handler):
+    return handler.request_version == "HTTP/1.1" and handler.protocol_version == "HTTP/1.1"
+
+
+def _write(handler, data, chunked, compressor=None):
+    if compressor is not None:
+        data = compressor.compress(data)
+    if not data:
+        return
+    if chunked:
+        handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    else:
+        handler.wfile.write(data)
+    handler.wfile.flush()
+
+
+# Send `parts` (str or bytes) as the response body without building it in
+# memory. The first part (usually the page head) is sent straight away.
+def send_stream(handler, parts, status=200, content_type="text/html", validators=None):
+    chunked = _chunked(handler)
+    compressor = compression.StreamCompressor() if compression.accepts_gzip(handler.headers) else None
+    handler.send_response(status)
+    handler.send_header("Content-type", content_type)
+    if validators:
+        httpcache.send_validators(handler, *validators)
+    compression.send_headers(handler, "gzip" if compressor else None)
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    else:
+        handler.send_header("Connection", "close")
+    handler.end_headers()
+
+    buffer, size, first = [], 0, True
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        buffer.append(part)
+        size += len(part)
+        if first or size >= CHUNK_SIZE:
+            _write(handler, b"".join(buffer), chunked, compressor)
+            buffer, size, first = [], 0, False
+    if buffer:
+        _write(handler, b"".join(buffer), chunked, compressor)
+    if compressor is not None:
+        _write(handler, compressor.finish(), chunked)
+    if chunked:
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
@@ -0,0 +1,132 @@
+# StudentSummary: one row per student and term with total, subject count,
+# average, Passed/Failed status and position in class for that term.
+#
+# Triggers (migration 10) keep the totals exact on every write to Results.
+# Class positions depend on every student in the class, so they are
+# refreshed per class once a write has committed: entry points that write
+# call install() once to register that listener.
+#
+#   python -m gradebook.summary --check     diff the table against a full rebuild
+#   python -m gradebook.summary --rebuild   rebuild it from Results
+import argparse
+import sys
+
+from gradebook import db, hooks
+
+COLUMNS = ("StudentID", "TermID", "ClassID", "Total", "Subjects", "Average", "Status", "ClassRank")
+
+# The summary as it should be, computed from scratch
+_EXPECTED = """
+    SELECT StudentID, TermID, ClassID, Total, Subjects, Average, Status,
+           RANK() OVER (PARTITION BY ClassID, TermID ORDER BY Average DESC) AS ClassRank
+    FROM (
+        SELECT s.StudentID, r.TermID, s.ClassID, SUM(r.Score) AS Total, COUNT(*) AS Subjects, AVG(r.Score) AS Average,
+               CASE WHEN AVG(r.Score) >= 40 THEN 'Passed' ELSE 'Failed' END AS Status
+        FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+        WHERE r.TermID IS NOT NULL
+        GROUP BY s.StudentID, r.TermID
+    )
+"""
+
+# SQLite limits the number of ? placeholders in one statement
+_IN_CHUNK = 500
+
+
+# Recompute ClassRank, in every term, for the given classes (all if None).
+# Only rows whose position actually moved are written.
+def refresh_ranks(conn, class_ids=None):
+    if class_ids is None:
+        chunks = [None]
+    else:
+        class_ids = sorted({db.class_id_value(class_id) for class_id in class_ids}, key=str)
+        chunks = [class_ids[i:i + _IN_CHUNK] for i in range(0, len(class_ids), _IN_CHUNK)]
+    changed = 0
+    with conn:
+        for chunk in chunks:
+            where, params = "", ()
+            if chunk is not None:
+                where = f"WHERE ClassID IN ({','.join('?' * len(chunk))})"
+                params = tuple(chunk)
+            cursor = conn.execute(f"""
+                UPDATE StudentSummary SET ClassRank = ranked.position
+                FROM (
+                    SELECT StudentID, TermID,
+                           RANK() OVER (PARTITION BY ClassID, TermID ORDER BY Average DESC) AS position
+                    FROM StudentSummary {where}
+                ) AS ranked
+                WHERE StudentSummary.StudentID = ranked.StudentID AND StudentSummary.TermID = ranked.TermID
+                  AND StudentSummary.ClassRank IS NOT ranked.position
+            """, params)
+            changed += max(cursor.rowcount, 0)
+    return changed
+
+
+# Single indexed row: (Total, Subjects, Average, Status, ClassRank) or None
+def fetch(conn, student_id, term_id):
+    return conn.execute("SELECT Total, Subjects, Average, Status, ClassRank FROM StudentSummary "
+                        "WHERE StudentID=? AND TermID=?", (student_id, term_id)).fetchone()
+
+
+# Rows that differ between the stored table and a rebuild:
+# (missing, unexpected) lists of full rows
+def diff(conn):
+    columns = ", ".join(COLUMNS)
+    expected = f"SELECT {columns} FROM ({_EXPECTED})"
+    stored = f"SELECT {columns} FROM StudentSummary"
+    missing = conn.execute(f"{expected} EXCEPT {stored} ORDER BY StudentID, TermID").fetchall()
+    unexpected = conn.execute(f"{stored} EXCEPT {expected} ORDER BY StudentID, TermID").fetchall()
+    return missing, unexpected
+
+
+def rebuild(conn):
+    with conn:
+        conn.execute("DELETE FROM StudentSummary")
+        conn.execute(f"INSERT INTO StudentSummary ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM ({_EXPECTED})")
+    return conn.execute("SELECT COUNT(*) FROM StudentSummary").fetchone()[0]
+
+
+def _results_changed(exam_numbers, class_ids):
+    refresh_ranks(db.get_connection(), class_ids)
+
+
+_installed = False
+
+
+# Keep ClassRank current after every committed write (hooks.results_changed)
+def install():
+    global _installed
+    if not _installed:
+        hooks.on_results_changed(_results_changed)
+        _installed = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or rebuild the StudentSummary table")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--check", action="store_true", help="diff the stored table against a rebuild")
+    action.add_argument("--rebuild", action="store_true", help="rebuild the table from Results")
+    args = parser.parse_args(argv)
+
+    conn = db.connect(args.db)
+    try:
+        if args.rebuild:
+            print(f"Rebuilt StudentSummary: {rebuild(conn)} rows")
+            return 0
+        missing, unexpected = diff(conn)
+        for row in missing:
+            print("expected:", dict(zip(COLUMNS, row)))
+        for row in unexpected:
+            print("stored:  ", dict(zip(COLUMNS, row)))
+        if missing or unexpected:
+            print(f"StudentSummary is inconsistent: {len(missing)} expected rows missing, "
+                  f"{len(unexpected)} stored rows wrong (run with --rebuild to fix)")
+            return 1
+        print("StudentSummary is consistent")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# Academic years and terms.
+#
+# Every result belongs to a Term (Results.TermID), and every term to an
+# AcademicYear. Exactly one term is current: it is what the add/view forms
+# default to. Results are looked up by (StudentID, TermID), so current-term
+# pages cost the same however many years are stored.
+#
+# A closed year can be archived: its results are moved into a separate
+# SQLite file (gradesystem-<year>.db next to the database) and read back by
+# attaching that file when an archived term is asked for.
+#
+#   python -m gradebook.terms list
+#   python -m gradebook.terms add-year 2026 --terms 3 --current
+#   python -m gradebook.terms set-current 4
+#   python -m gradebook.terms archive 2025
+import argparse
+import collections
+import os
+import re
+import sys
+import threading
+
+from gradebook import db, hooks, migrations, summary
+
+Term = collections.namedtuple("Term", "term_id year_id year name position is_current archive_path")
+
+_TERMS_SQL = """
+    SELECT t.TermID, y.YearID, y.Name, t.Name, t.Position, t.IsCurrent, y.ArchivePath
+    FROM Term t JOIN AcademicYear y ON y.YearID = t.YearID
+"""
+
+
+def list_terms(conn):
+    return [Term(*row) for row in conn.execute(_TERMS_SQL + " ORDER BY y.Name, t.Position")]
+
+
+def get(conn, term_id):
+    row = conn.execute(_TERMS_SQL + " WHERE t.TermID=?", (term_id,)).fetchone()
+    return Term(*row) if row else None
+
+
+def current(conn):
+    row = conn.execute(_TERMS_SQL + " WHERE t.IsCurrent=1").fetchone()
+    return Term(*row) if row else None
+
+
+# Terms by id (None: the current term) for the request handlers. They only
+# change through this module's command line (servers are restarted) or when an
+# import names a new term, so they are kept until invalidate().
+_cache = {}
+
+
+def _key(term_id):
+    return None if term_id in (None, "") else int(term_id)
+
+
+def find(term_id=None):
+    try:
+        key = _key(term_id)
+    except ValueError:
+        return None
+    if key not in _cache:
+        conn = db.get_connection()
+        term = current(conn) if key is None else get(conn, key)
+        if term is None:
+            return None
+        _cache[key] = term
+    return _cache[key]
+
+
+# The term if find() has already loaded it, else None; never reads the database
+def cached(term_id=None):
+    try:
+        return _cache.get(_key(term_id))
+    except ValueError:
+        return None
+
+
+def invalidate():
+    _cache.clear()
+
+
+# (TermID, created) for a term name in the current year, adding the term if
+# it does not exist yet. Call inside the caller's transaction.
+def resolve(conn, name):
+    year_id = conn.execute("SELECT YearID FROM Term WHERE IsCurrent=1").fetchone()[0]
+    row = conn.execute("SELECT TermID FROM Term WHERE YearID=? AND Name=?", (year_id, name)).fetchone()
+    if row:
+        return row[0], False
+    position = conn.execute("SELECT COALESCE(MAX(Position), 0) + 1 FROM Term WHERE YearID=?", (year_id,)).fetchone()[0]
+    return conn.execute("INSERT INTO Term (YearID, Name, Position) VALUES (?, ?, ?)",
+                        (year_id, name, position)).lastrowid, True
+
+
+def set_current(conn, term_id):
+    with conn:
+        if not conn.execute("SELECT 1 FROM Term WHERE TermID=?", (term_id,)).fetchone():
+            raise ValueError(f"no term with id {term_id}")
+        conn.execute("UPDATE Term SET IsCurrent=0 WHERE IsCurrent=1")
+        conn.execute("UPDATE Term SET IsCurrent=1 WHERE TermID=?", (term_id,))
+
+
+def add_year(conn, name, terms=3, make_current=False):
+    with conn:
+        year_id = conn.execute("INSERT INTO AcademicYear (Name) VALUES (?)", (name,)).lastrowid
+        conn.executemany("INSERT INTO Term (YearID, Name, Position) VALUES (?, ?, ?)",
+                         [(year_id, f"Term {n}", n) for n in range(1, terms + 1)])
+    if make_current:
+        set_current(conn, conn.execute("SELECT TermID FROM Term WHERE YearID=? AND Position=1",
+                                       (year_id,)).fetchone()[0])
+    return year_id
+
+
+# Schema names of the archives attached to each pooled connection
+_attached = threading.local()
+
+
+def _schema(year_id):
+    return f"archive_{int(year_id)}"
+
+
+def archive_file(db_path, year_name):
+    base, ext = os.path.splitext(db_path)
+    return f"{base}-{re.sub(r'[^A-Za-z0-9_-]+', '_', str(year_name))}{ext or '.db'}"
+
+
+# The Results table holding a term's rows: "Results" for open years,
+# "archive_<YearID>.Results" (attached on first use) for archived ones
+def results_table(conn, term):
+    if term is None or not term.archive_path:
+        return "Results"
+    schema = _schema(term.year_id)
+    attached = getattr(_attached, "schemas", None)
+    if attached is None or attached[0] is not conn:
+        attached = _attached.schemas = (conn, set())
+    if schema not in attached[1]:
+        if not conn.execute("SELECT 1 FROM pragma_database_list WHERE name=?", (schema,)).fetchone():
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (term.archive_path,))
+        attached[1].add(schema)
+    return f"{schema}.Results"
+
+
+# Move every result of a closed year into its own SQLite file. The year and
+# its terms stay listed; reads of those terms go to the archive.
+def archive_year(conn, year_name, path=None):
+    row = conn.execute("SELECT YearID, ArchivePath FROM AcademicYear WHERE Name=?", (year_name,)).fetchone()
+    if row is None:
+        raise ValueError(f"no academic year {year_name!r}")
+    year_id, archived = row
+    if archived:
+        raise ValueError(f"{year_name} is already archived in {archived}")
+    if conn.execute("SELECT 1 FROM Term WHERE YearID=? AND IsCurrent=1", (year_id,)).fetchone():
+        raise ValueError(f"{year_name} holds the current term; make a later term current first")
+    path = os.path.abspath(path or archive_file(conn.execute("PRAGMA database_list").fetchone()[2], year_name))
+    schema = _schema(year_id)
+
+    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    try:
+        with conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {schema}.Results (
+                    ResultID INTEGER PRIMARY KEY,
+                    StudentID INTEGER,
+                    Subject TEXT,
+                    Score INTEGER,
+                    Term TEXT,
+                    TermID INTEGER
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_Results_StudentID_TermID "
+                         f"ON Results (StudentID, TermID)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.Term AS SELECT * FROM Term WHERE 0")
+            conn.execute(f"INSERT INTO {schema}.Term SELECT * FROM Term WHERE YearID=?", (year_id,))
+            moved = conn.execute(f"""
+                INSERT INTO {schema}.Results (ResultID, StudentID, Subject, Score, Term, TermID)
+                SELECT ResultID, StudentID, Subject, Score, Term, TermID FROM Results
+                WHERE TermID IN (SELECT TermID FROM Term WHERE YearID=?)
+            """, (year_id,)).rowcount
+            students = [row[0] for row in conn.execute("""
+                SELECT DISTINCT s.ExamNumber FROM Student s JOIN Results r ON r.StudentID = s.StudentID
+                WHERE r.TermID IN (SELECT TermID FROM Term WHERE YearID=?)
+            """, (year_id,))]
+            conn.execute("DELETE FROM Results WHERE TermID IN (SELECT TermID FROM Term WHERE YearID=?)", (year_id,))
+            conn.execute("UPDATE AcademicYear SET Closed=1, ArchivePath=? WHERE YearID=?", (path, year_id))
+    finally:
+        conn.execute(f"DETACH DATABASE {schema}")
+    hooks.results_changed(students, None)
+    return path, moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage academic years and terms")
+    parser.add_argument("--db", default=db.DB_PATH, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list years and terms")
+    add = commands.add_parser("add-year", help="add an academic year with its terms")
+    add.add_argument("name")
+    add.add_argument("--terms", type=int, default=3)
+    add.add_argument("--current", action="store_true", help="make its first term the current term")
+    set_term = commands.add_parser("set-current", help="make a term the current term")
+    set_term.add_argument("term_id", type=int)
+    archive = commands.add_parser("archive", help="move a closed year's results into their own file")
+    archive.add_argument("year")
+    archive.add_argument("--path", help="archive file (default: next to the database)")
+    args = parser.parse_args(argv)
+
+    db.DB_PATH = args.db
+    summary.install()
+    conn = db.get_connection()
+    try:
+        migrations.migrate(conn)
+        if args.command == "add-year":
+            add_year(conn, args.name, args.terms, args.current)
+        elif args.command == "set-current":
+            set_current(conn, args.term_id)
+        elif args.command == "archive":
+            path, moved = archive_year(conn, args.year, args.path)
+            print(f"Moved {moved} results of {args.year} to {path}")
+        for term in list_terms(conn):
+            flags = (" (current)" if term.is_current else "") + (f" [archived: {term.archive_path}]"
+                                                                  if term.archive_path else "")
+            print(f"{term.term_id:>4}  {term.year}  {term.name}{flags}")
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        db.pool.close_all()
+    if args.command != "list":
+        print("Restart running servers to see term changes in their forms.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# Background writer with group commit for teacher submissions.
+#
+# SQLite lets one connection write at a time. When many teachers save at
+# once, request threads each opening a write transaction queue up on that
+# lock (and give up with "database is locked" after db.BUSY_TIMEOUT).
+# Instead, handlers hand their write to one writer thread and wait for it:
+#
+#   - the writer takes every submission already queued (up to MAX_BATCH) and,
+#     if there is room, waits up to the flush interval for more;
+#   - it applies them in a single transaction, each inside its own SAVEPOINT
+#     so a bad submission fails alone without undoing the others;
+#   - after the commit it calls hooks.results_changed() once for the whole
+#     batch (one class-rank refresh instead of one per submission), then
+#     tells every waiting handler its write is done.
+#
+# A lone submission is written straight away; the flush interval only bounds
+# how long the writer holds a batch open for company. The thread starts on
+# first use in each process, so forked servers (--processes) each have one.
+#
+# Handlers wait for their write without a timeout of their own: a handler
+# giving up could not tell whether the write would still commit. The writer
+# keeps the deadline instead. A submission still queued WRITE_TIMEOUT
+# seconds after it arrived is not started and fails with WriteTimeout, so
+# nothing of it is written.
+import atexit
+import concurrent.futures
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from gradebook import db, hooks
+
+FLUSH_INTERVAL = 0.002  # seconds a batch waits for more submissions
+MAX_BATCH = 256
+WRITE_TIMEOUT = 30.0    # seconds a submission may wait in the queue before it is refused
+
+enabled = True
+flush_interval = FLUSH_INTERVAL
+
+
+# Raised for a submission the writer did not start in time; none of it was written
+class WriteTimeout(TimeoutError):
+    pass
+
+
+def configure(enable=True, interval=None):
+    global enabled, flush_interval
+    enabled = enable
+    if interval is not None:
+        flush_interval = max(0.0, interval)
+
+
+class GroupCommitWriter:
+    def __init__(self, path=None, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH, timeout=WRITE_TIMEOUT):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, int(max_batch))
+        self.timeout = timeout
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submissions = 0
+        self.batches = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.largest_batch = 0
+
+    # `work(conn)` runs inside the batch's transaction (it must not commit)
+    # and returns (exam_numbers, class_ids) it changed, as for
+    # hooks.results_changed. The future resolves to that pair after the commit,
+    # or fails with the error that kept it from being written.
+    def submit(self, work):
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="grade-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((work, future, time.monotonic() + self.timeout))
+        return future
+
+    # Write everything already submitted, then stop the thread
+    def stop(self, timeout=WRITE_TIMEOUT):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        conn = None
+        try:
+            conn = db.connect(self.path)
+            conn.isolation_level = None  # transactions are managed here
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch, stopping = self._collect(item)
+                self._apply(conn, batch)
+                if stopping:
+                    return
+        except Exception as exc:
+            sys.stderr.write("group-commit writer stopped\n")
+            traceback.print_exc()
+            self._fail_queued(exc)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # The thread is going away on an error: fail whatever is queued, so no
+    # handler waits for it, and let the next submit() start a new thread
+    def _fail_queued(self, exc):
+        with self._lock:
+            self._thread = None
+            pending, self._queue = self._queue, queue.SimpleQueue()
+        while True:
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                self.failures += 1
+                item[1].set_exception(exc)
+
+    # The first submission plus whatever arrives before the batch is full or
+    # the flush interval has passed. Returns (batch, whether stop() was called).
+    def _collect(self, item):
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _apply(self, conn, batch):
+        self.submissions += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        done, exam_numbers, class_ids = [], [], set()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for work, future, deadline in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if time.monotonic() > deadline:
+                    self.timeouts += 1
+                    future.set_exception(WriteTimeout(f"not started within {self.timeout:g} s; nothing was saved"))
+                    continue
+                conn.execute("SAVEPOINT submission")
+                try:
+                    changed = work(conn)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO submission")
+                    conn.execute("RELEASE submission")
+                    self.failures += 1
+                    future.set_exception(exc)
+                    continue
+                conn.execute("RELEASE submission")
+                done.append((future, changed))
+                exam_numbers.extend(changed[0])
+                if class_ids is not None and changed[1] is not None:
+                    class_ids.update(changed[1])
+                else:
+                    class_ids = None
+            conn.execute("COMMIT")
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Nothing in the batch was written
+            for _, future, _ in batch:
+                if not future.done():
+                    self.failures += 1
+                    future.set_exception(exc)
+            return
+        if done:
+            try:
+                hooks.results_changed(exam_numbers, class_ids)
+            except Exception:
+                sys.stderr.write("results_changed hook failed after a group commit\n")
+                traceback.print_exc()
+        for future, changed in done:
+            future.set_result(changed)
+
+    def stats(self):
+        return {
+            "submissions": self.submissions,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "mean_batch": round(self.submissions / self.batches, 2) if self.batches else 0.0,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+        }
+
+
+_writer = None
+_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer, _pid
+    with _writer_lock:
+        # A forked child does not inherit the parent's thread
+        if _writer is None or _pid != os.getpid():
+            _writer, _pid = GroupCommitWriter(flush_interval=flush_interval), os.getpid()
+        return _writer
+
+
+# Run `work` (see GroupCommitWriter.submit) and return its (exam_numbers,
+# class_ids) once committed and reported to hooks.results_changed. Goes
+# through the writer thread, or straight to this thread's pooled connection
+# when group commit is off. Raises WriteTimeout if the writer was too busy to
+# start it, or whatever `work` or the commit raised; nothing is written then.
+def write(work):
+    if enabled:
+        return _get_writer().submit(work).result()
+    conn = db.get_connection()
+    with conn:
+        # An explicit transaction, as on the writer thread, so `work` may use savepoints
+        conn.execute("BEGIN IMMEDIATE")
+        changed = work(conn)
+    hooks.results_changed(*changed)
+    return changed
+
+
+def stats():
+    if not enabled:
+        return {"enabled": False}
+    return {"enabled": True, "flush_interval": flush_interval, **(_writer.stats() if _writer else {})}
+
+
+# Write what is queued and stop this process's writer thread; the next
+# write() starts a new one (on the then current db.DB_PATH)
+@atexit.register
+def stop():
+    global _writer
+    with _writer_lock:
+        current, _writer = (_writer if _pid == os.getpid() else None), None
+    if current is not None:
+        current.stop()
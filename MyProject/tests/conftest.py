@@ -0,0 +1,41 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gradebook import db, migrations, render, results, writer  # noqa: E402
+
+
+# A database migrated to the latest version, made once per test session
+# (hashing the sample passwords is the slow part)
+@pytest.fixture(scope="session")
+def migrated_template(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("template") / "gradesystem.db")
+    conn = db.connect(path)
+    try:
+        migrations.migrate(conn)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return path
+
+
+# A fresh copy of the migrated database, installed as db.DB_PATH with empty
+# connection pool and caches and no writer thread left from another test
+@pytest.fixture
+def database(tmp_path, migrated_template, monkeypatch):
+    path = str(tmp_path / "gradesystem.db")
+    shutil.copy(migrated_template, path)
+    writer.stop()
+    db.pool.close_all()
+    monkeypatch.setattr(db, "DB_PATH", path)
+    results.cache.clear()
+    render.invalidate_classes()
+    yield path
+    writer.stop()
+    db.pool.close_all()
+    results.cache.clear()
+    render.invalidate_classes()
@@ -0,0 +1,63 @@
+import threading
+
+from gradebook import analytics
+
+
+class Term:
+    def __init__(self, term_id):
+        self.term_id = term_id
+
+
+# compute() stand-in that blocks term 1 until released and records its calls
+class SlowCompute:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, conn, term, class_ids=None):
+        self.calls.append((term.term_id, None if class_ids is None else set(class_ids)))
+        if term.term_id == 1:
+            self.started.set()
+            assert self.release.wait(5)
+        return {class_id: (term.term_id, len(self.calls)) for class_id in (class_ids or ["1", "2"])}
+
+
+def test_recompute_does_not_hold_the_engine_lock(monkeypatch):
+    slow = SlowCompute()
+    monkeypatch.setattr(analytics, "compute", slow)
+    engine = analytics.AnalyticsEngine()
+    reader = threading.Thread(target=engine.refresh, args=(Term(1), object()))
+    reader.start()
+    try:
+        assert slow.started.wait(5)
+        # Neither a write nor a reader of another term waits for term 1
+        other = []
+        meanwhile = threading.Thread(target=lambda: (engine.mark_dirty(["2"]),
+                                                     other.append(engine.refresh(Term(2), object()))))
+        meanwhile.start()
+        meanwhile.join(2)
+        assert other == [{"1": (2, 2), "2": (2, 2)}]
+    finally:
+        slow.release.set()
+        reader.join(5)
+    # The write during term 1's computation is not lost
+    assert engine._terms[1].dirty == {"2"}
+    monkeypatch.setattr(analytics.db, "get_connection", object)
+    assert engine.snapshot(Term(1))["2"] == (1, 3)
+    assert slow.calls[-1] == (1, {"2"})
+
+
+def test_forgetting_everything_during_a_recompute_expires_its_result(monkeypatch):
+    slow = SlowCompute()
+    monkeypatch.setattr(analytics, "compute", slow)
+    monkeypatch.setattr(analytics.db, "get_connection", object)
+    engine = analytics.AnalyticsEngine()
+    reader = threading.Thread(target=engine.snapshot, args=(Term(1),))
+    reader.start()
+    assert slow.started.wait(5)
+    engine.mark_dirty(None)
+    slow.release.set()
+    reader.join(5)
+    engine.snapshot(Term(1))
+    assert slow.calls == [(1, None), (1, None)]
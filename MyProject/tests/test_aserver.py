@@ -0,0 +1,111 @@
+import asyncio
+import http.server
+import time
+
+import pytest
+
+from gradebook import aserver
+
+
+def read_request(data):
+    async def read():
+        reader = asyncio.StreamReader(limit=aserver.MAX_HEADER)
+        reader.feed_data(data)
+        reader.feed_eof()
+        server = aserver.AsyncHTTPServer(("", 0), object)
+        return await server._read_request(reader, True)
+
+    return asyncio.run(read())
+
+
+def test_content_length_body_is_read():
+    request = b"POST /x HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+    assert read_request(request + b"GET /next") == request
+
+
+def test_chunked_body_is_decoded_and_given_a_length():
+    request = read_request(b"POST /x HTTP/1.1\r\nHost: a\r\nTransfer-Encoding: chunked\r\n\r\n"
+                           b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nTrailer: x\r\n\r\n")
+    assert request == b"POST /x HTTP/1.1\r\nHost: a\r\nContent-Length: 11\r\n\r\nhello world"
+
+
+@pytest.mark.parametrize("head, body, status", [
+    (b"Transfer-Encoding: gzip", b"", 501),
+    (b"Transfer-Encoding: chunked\r\nContent-Length: 3", b"0\r\n\r\n", 400),
+    (b"Content-Length: 1\r\nContent-Length: 2", b"ab", 400),
+    (b"Content-Length: -1", b"", 400),
+    (b"Transfer-Encoding: chunked", b"zz\r\n", 400),
+    (b"Transfer-Encoding: chunked", b"3\r\nabcd\r\n0\r\n\r\n", 400),
+    (b"Content-Length: %d" % (aserver.MAX_BODY + 1), b"", 413),
+])
+def test_unreadable_requests_are_refused(head, body, status):
+    with pytest.raises(aserver._Refused) as refused:
+        read_request(b"POST /x HTTP/1.1\r\n" + head + b"\r\n\r\n" + body)
+    assert refused.value.status == status
+
+
+def test_oversized_chunked_body_is_refused(monkeypatch):
+    monkeypatch.setattr(aserver, "MAX_BODY", 8)
+    with pytest.raises(aserver._Refused) as refused:
+        read_request(b"POST /x HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n5\r\nworld\r\n0\r\n\r\n")
+    assert refused.value.status == 413
+
+
+class Slow(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(float(self.path[1:] or 0))
+        self.send_response(200)
+        self.send_header("Content-Length", "5")
+        self.end_headers()
+        self.wfile.write(b"hello")
+
+    def log_message(self, *args):
+        pass
+
+
+# Requests each given path on its own kept-alive connection, stops the
+# server once `stop_after` responses have arrived, and returns (seconds the
+# shutdown took, responses, errors the event loop reported)
+def shut_down_with(paths, stop_after):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+        server = aserver.AsyncHTTPServer(("127.0.0.1", 0), Slow, workers=2)
+        stop, started = asyncio.Event(), asyncio.Event()
+        serving = asyncio.create_task(server.serve(stop, started.set))
+        await started.wait()
+        port = server._server.sockets[0].getsockname()[1]
+        responses = []
+
+        async def client(path):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            responses.append(await reader.readuntil(b"hello"))
+            # Kept alive until the server closes it
+            assert await reader.read() == b""
+            writer.close()
+
+        clients = [asyncio.create_task(client(path)) for path in paths]
+        while sum(response.endswith(b"hello") for response in responses) < stop_after:
+            await asyncio.sleep(0.01)
+        start = loop.time()
+        stop.set()
+        await serving
+        await asyncio.gather(*clients)
+        return loop.time() - start, responses, errors
+
+    return asyncio.run(scenario())
+
+
+def test_shutdown_closes_idle_connections_at_once():
+    took, responses, errors = shut_down_with(["/", "/"], 2)
+    assert took < 1 and errors == []
+    assert all(response.endswith(b"hello") for response in responses)
+
+
+def test_shutdown_lets_requests_in_flight_finish():
+    took, responses, errors = shut_down_with(["/", "/0.3"], 1)
+    assert 0.1 < took < 1 and errors == []
+    assert all(response.endswith(b"hello") for response in responses)
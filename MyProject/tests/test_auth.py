@@ -0,0 +1,89 @@
+import pytest
+
+from gradebook import auth, db
+
+CHEAP = {"scrypt": 4, "pbkdf2_sha256": 1000}
+
+
+@pytest.mark.parametrize("algorithm", [name for name in auth.ALGORITHMS
+                                       if name != "scrypt" or hasattr(auth.hashlib, "scrypt")])
+def test_hashed_password_verifies(algorithm):
+    stored = auth.hash_password("pass123", algorithm, CHEAP[algorithm])
+    assert stored.startswith(f"{algorithm}${CHEAP[algorithm]}$")
+    assert auth.is_hashed(stored)
+    assert auth.verify_password(stored, "pass123")
+    assert not auth.verify_password(stored, "pass124")
+
+
+def test_plaintext_password_verifies_and_needs_rehash():
+    assert not auth.is_hashed("pass123")
+    assert auth.verify_password("pass123", "pass123")
+    assert not auth.verify_password("pass123", "wrong")
+    assert auth.needs_rehash("pass123")
+
+
+def test_hash_with_another_cost_needs_rehash(monkeypatch):
+    monkeypatch.setattr(auth, "cost", CHEAP[auth.algorithm])
+    assert not auth.needs_rehash(auth.hash_password("pass123"))
+    assert auth.needs_rehash(auth.hash_password("pass123", hash_cost=CHEAP[auth.algorithm] + 1))
+
+
+def test_unknown_user_is_refused(monkeypatch):
+    monkeypatch.setattr(auth, "cost", CHEAP[auth.algorithm])
+    assert auth.verify_password(None, "anything") is False
+
+
+def test_session_cookie_round_trip():
+    store = auth.SessionStore()
+    session = store.create("teacher1", "teacher")
+    assert store.from_cookie(session.cookie) is session
+    assert len(store) == 1
+
+
+def test_cookie_from_another_process_is_adopted():
+    session = auth.SessionStore().create("teacher1", "teacher")
+    other = auth.SessionStore()
+    adopted = other.from_cookie(session.cookie)
+    assert (adopted.username, adopted.role, adopted.expires) == ("teacher1", "teacher", session.expires)
+
+
+def test_forged_cookies_are_refused():
+    session = auth.SessionStore().create("teacher1", "pupil")
+    payload, signature = session.cookie.split(".")
+    store = auth.SessionStore()
+    assert store.from_cookie(payload + "." + signature[::-1]) is None
+    assert store.from_cookie(payload) is None
+    assert store.from_cookie("") is None
+    assert store.from_cookie(None) is None
+
+
+def test_expired_sessions_are_refused_and_swept(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(auth.time, "time", lambda: now[0])
+    store = auth.SessionStore(ttl=60, sweep_interval=10)
+    session = store.create("teacher1", "teacher")
+    now[0] += 61
+    assert store.from_cookie(session.cookie) is None
+    assert auth.SessionStore().from_cookie(session.cookie) is None
+    store.create("teacher2", "teacher")
+    now[0] += 61
+    assert store.sweep() == 1
+    assert len(store) == 0
+
+
+def test_logged_out_cookie_is_not_taken_back():
+    store = auth.SessionStore()
+    session = store.create("teacher1", "teacher")
+    store.logout(session)
+    assert store.from_cookie(session.cookie) is None
+
+
+def test_set_password_updates_and_adds_users(database, monkeypatch):
+    monkeypatch.setattr(auth, "cost", CHEAP[auth.algorithm])
+    conn = db.get_connection()
+    assert auth.set_password(conn, "teacher1", "new secret") is False
+    assert auth.set_password(conn, "pupil7", "pupil pass", role="pupil") is True
+    stored = dict(conn.execute("SELECT Username, Password FROM Teachers WHERE Username IN ('teacher1', 'pupil7')"))
+    assert auth.verify_password(stored["teacher1"], "new secret")
+    assert auth.verify_password(stored["pupil7"], "pupil pass")
+    assert conn.execute("SELECT Role FROM Teachers WHERE Username='pupil7'").fetchone() == ("pupil",)
@@ -0,0 +1,61 @@
+from gradebook import hooks, repository, results, terms
+from gradebook.cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("gradebook.cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(10, max_age=5)
+    cache.set("a", 1)
+    now[0] += 4
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a", "gone") == "gone"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate_tag_drops_every_entry_of_the_tag():
+    cache = LRUCache(10)
+    cache.set(("E1", "1", None), "all terms", tag="E1")
+    cache.set(("E1", "1", 3), "term 3", tag="E1")
+    cache.set(("E2", "1", None), "other", tag="E2")
+    cache.invalidate_tag("E1")
+    assert cache.get(("E1", "1", None)) is None
+    assert cache.get(("E1", "1", 3)) is None
+    assert cache.get(("E2", "1", None)) == "other"
+
+
+def test_read_racing_an_invalidation_is_not_stored():
+    cache = LRUCache(10)
+    generation = cache.generation()
+    cache.invalidate("a")
+    assert cache.set("a", "stale", generation=generation) is False
+    assert cache.get("a") is None
+
+
+def test_lookup_is_cached_until_results_change(database):
+    term = terms.find()
+    first = results.lookup("EXAM001", 1, term)
+    assert results.lookup("EXAM001", 1, term) is first
+    repository.add_results("EXAM001", "Alice", 1, [("Science", 64)], term)
+    second = results.lookup("EXAM001", 1, term)
+    assert second is not first
+    assert ("Science", 64) in second.rows
+
+
+def test_missing_students_are_cached_and_invalidated(database):
+    term = terms.find()
+    assert results.lookup("NEW1", 1, term) is results.NOT_FOUND
+    hooks.results_changed(["NEW1"], [1])
+    assert results.cache.get(("NEW1", "1", term.term_id)) is None
@@ -0,0 +1,40 @@
+from gradebook import compression, httpcache
+
+
+class Handler:
+    def __init__(self):
+        self.status = None
+        self.headers = []
+
+    def send_response(self, status):
+        self.status = status
+
+    def send_header(self, name, value):
+        self.headers.append((name, value))
+
+    def end_headers(self):
+        pass
+
+
+def test_etag_matches_weakly_and_in_lists():
+    etag = httpcache.make_etag(1, 2, 3)
+    assert httpcache.not_modified({"If-None-Match": etag}, etag)
+    assert httpcache.not_modified({"If-None-Match": f'"x", {etag[2:]}'}, etag)
+    assert not httpcache.not_modified({"If-None-Match": '"x"'}, etag)
+    assert not httpcache.not_modified({}, etag)
+
+
+def test_if_modified_since_is_used_without_an_etag():
+    headers = {"If-Modified-Since": httpcache.http_date(1000)}
+    assert httpcache.not_modified(headers, "W/\"x\"", 1000)
+    assert not httpcache.not_modified(headers, "W/\"x\"", 1001)
+    assert not httpcache.not_modified({"If-Modified-Since": "yesterday"}, "W/\"x\"", 1000)
+
+
+def test_not_modified_repeats_the_full_response_headers():
+    full, not_modified = Handler(), Handler()
+    httpcache.send_validators(full, 'W/"x"', 1000)
+    compression.send_headers(full, "gzip")
+    httpcache.send_not_modified(not_modified, 'W/"x"', 1000)
+    assert not_modified.status == 304
+    assert set(not_modified.headers) == {(name, value) for name, value in full.headers if name != "Content-Encoding"}
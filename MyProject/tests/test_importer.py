@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+
+from gradebook import db, importer, writer
+
+
+def run_import(text, fmt, batch_size=importer.BATCH_SIZE):
+    return importer.import_stream(io.BytesIO(text.encode()), fmt, batch_size)
+
+
+def marks(conn, exam_number):
+    return conn.execute("""
+        SELECT r.Subject, r.Score FROM Results r JOIN Student s ON s.StudentID = r.StudentID
+        WHERE s.ExamNumber=? ORDER BY r.ResultID
+    """, (exam_number,)).fetchall()
+
+
+def record(exam_number, subject="Math", score=50, **extra):
+    return {"exam_number": exam_number, "name": f"Pupil {exam_number}", "class_id": 1,
+            "subject": subject, "score": score, **extra}
+
+
+@pytest.fixture(params=[True, False], ids=["group-commit", "direct"])
+def database(request, database, monkeypatch):
+    monkeypatch.setattr(writer, "enabled", request.param)
+    return database
+
+
+def test_json_array_and_lines_are_read_one_record_at_a_time():
+    records = [record(f"J{n}", score=n) for n in range(50)]
+    array = io.StringIO(json.dumps(records))
+    lines = io.StringIO("\n".join(json.dumps(r) for r in records) + "\n")
+    assert list(importer.iter_json_records(array, chunk_size=7)) == list(enumerate(records, 1))
+    assert list(importer.iter_json_records(lines, chunk_size=7)) == list(enumerate(records, 1))
+
+
+def test_numbers_split_across_chunks_are_not_cut_short():
+    assert list(importer.iter_json_records(io.StringIO("[12345, 678]"), chunk_size=3)) == [(1, 12345), (2, 678)]
+
+
+def test_malformed_json_stops_at_its_row_without_reading_the_rest():
+    class Source(io.StringIO):
+        reads = 0
+
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    source = Source(json.dumps(record("A")) + "\n{oops}\n" + "x" * 100000)
+    records = importer.iter_json_records(source, chunk_size=64)
+    assert next(records)[0] == 1
+    with pytest.raises(importer.RecordError) as error:
+        next(records)
+    assert error.value.row == 2
+    assert source.reads < 5
+
+
+def test_unclosed_array_is_reported():
+    with pytest.raises(importer.RecordError, match="not closed"):
+        list(importer.iter_json_records(io.StringIO(json.dumps([record("A")])[:-1])))
+
+
+def test_csv_import(database):
+    report = run_import("exam_number,name,class_id,subject,score\nC1,Ann,1,Math,70\nC1,Ann,1,English,bad\n"
+                        "C2,Ben,2,Math,101\nC2,Ben,2,Math,40\n", "csv")
+    assert (report.rows, report.imported, report.students_created) == (4, 2, 2)
+    assert [row for row, _ in report.errors] == [3, 4]
+    conn = db.get_connection()
+    assert marks(conn, "C1") == [("Math", 70)]
+    assert marks(conn, "C2") == [("Math", 40)]
+
+
+def test_bad_json_keeps_earlier_rows_and_names_the_row(database):
+    report = run_import(json.dumps(record("J1")) + "\n" + json.dumps(record("J2")) + "\n{nope\n", "json")
+    assert report.imported == 2
+    assert report.errors == [(3, "invalid JSON: Expecting property name enclosed in double quotes")]
+
+
+def test_database_errors_are_reported_per_row(database):
+    conn = db.get_connection()
+    conn.execute("""CREATE TRIGGER refuse_bad BEFORE INSERT ON Results WHEN NEW.Subject = 'Refused'
+                    BEGIN SELECT RAISE(ABORT, 'subject refused'); END""")
+    conn.commit()
+    rows = [record("D1"), record("D2", subject="Refused"), record("D3")]
+    report = run_import("\n".join(json.dumps(r) for r in rows), "json")
+    assert report.imported == 2
+    assert len(report.errors) == 1
+    row, message = report.errors[0]
+    assert row == 2 and "subject refused" in message
+    assert marks(conn, "D1") == [("Math", 50)]
+    assert marks(conn, "D2") == []
+    assert marks(conn, "D3") == [("Math", 50)]
+
+
+def test_batches_report_students_and_terms(database):
+    rows = [record(f"B{n % 5}", subject=f"S{n}", term="Extra Term") for n in range(12)]
+    report = run_import(json.dumps(rows), "json", batch_size=4)
+    assert (report.imported, report.students_created, report.terms_created) == (12, 5, 1)
+    assert report.error_count == 0
+    assert len(marks(db.get_connection(), "B0")) == 3
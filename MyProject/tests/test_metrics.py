@@ -0,0 +1,40 @@
+import types
+
+import pytest
+
+from gradebook import metrics
+
+
+@pytest.fixture
+def routes():
+    metrics.configure(routes=("/", "/teacher", "/static/*"))
+    yield
+    metrics.configure()
+
+
+def handler(path, address="127.0.0.1"):
+    return types.SimpleNamespace(path=path, client_address=(address, 50000))
+
+
+@pytest.mark.parametrize("path, route", [
+    ("/teacher?class_id=3", "/teacher"),
+    ("/", "/"),
+    ("/static/app.1a2b.css", "/static/*"),
+    ("/teacher/../../etc/passwd", "unmatched"),
+    ("/made-up-" + "x" * 50, "unmatched"),
+])
+def test_paths_are_labelled_from_the_route_table(routes, path, route):
+    assert metrics._route(handler(path), 200) == route
+
+
+def test_not_found_is_unmatched(routes):
+    assert metrics._route(handler("/teacher"), 404) == "unmatched"
+
+
+def test_label_values_are_escaped():
+    assert metrics._labels(route='a"b\\c\nd') == '{route="a\\"b\\\\c\\nd"}'
+
+
+@pytest.mark.parametrize("address, local", [("127.0.0.1", True), ("::1", True), ("10.0.0.5", False), ("", False)])
+def test_only_loopback_clients_are_local(address, local):
+    assert metrics.is_local(handler("/metrics", address)) is local
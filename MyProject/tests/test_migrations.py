@@ -0,0 +1,50 @@
+import pytest
+
+from gradebook import auth, db, migrations
+
+
+# A new database migrated up to (and including) `version`
+@pytest.fixture
+def migrated_to(tmp_path, monkeypatch):
+    monkeypatch.setattr(auth, "cost", {"scrypt": 4, "pbkdf2_sha256": 1000}[auth.algorithm])
+    conn = db.connect(str(tmp_path / "old.db"))
+
+    def migrate_to(version):
+        with monkeypatch.context() as patch:
+            patch.setattr(migrations, "MIGRATIONS", [step for step in migrations.MIGRATIONS if step[0] <= version])
+            patch.setattr(migrations, "LATEST_VERSION", version)
+            migrations.migrate(conn)
+        return conn
+
+    yield migrate_to
+    conn.close()
+
+
+def add_student(conn, exam_number, name, class_id, score):
+    with conn:
+        student_id = conn.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)",
+                                  (exam_number, name, class_id)).lastrowid
+        conn.execute("INSERT INTO Results (StudentID, Subject, Score, Term, TermID) "
+                     "VALUES (?, 'Math', ?, 'Term 1', (SELECT TermID FROM Term WHERE IsCurrent = 1))",
+                     (student_id, score))
+    return student_id
+
+
+def test_students_entered_twice_are_merged_and_reported(migrated_to, capsys):
+    conn = migrated_to(8)
+    first = add_student(conn, "DUP1", "Dee", 1, 40)
+    second = add_student(conn, "DUP1", "Dee", 1, 60)
+    migrations.migrate(conn)
+    assert conn.execute("SELECT StudentID FROM Student WHERE ExamNumber = 'DUP1'").fetchall() == [(first,)]
+    assert conn.execute("SELECT Average FROM StudentSummary WHERE StudentID = ?", (first,)).fetchone() == (50.0,)
+    assert f"StudentID {second} into {first}, 1 results moved" in capsys.readouterr().err
+
+
+def test_different_pupils_sharing_an_exam_number_stop_the_migration(migrated_to):
+    conn = migrated_to(8)
+    add_student(conn, "DUP2", "Dee", 1, 40)
+    add_student(conn, "DUP2", "Dan", 2, 60)
+    with pytest.raises(migrations.MigrationError, match="DUP2: StudentID .* \\('Dan', class 2\\)"):
+        migrations.migrate(conn)
+    assert migrations.schema_version(conn) == 8
+    assert conn.execute("SELECT COUNT(*) FROM Student WHERE ExamNumber = 'DUP2'").fetchone() == (2,)
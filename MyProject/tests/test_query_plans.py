@@ -0,0 +1,33 @@
+import pytest
+
+from gradebook import db, migrations
+
+
+@pytest.fixture
+def conn(database):
+    conn = db.connect(database)
+    yield conn
+    conn.close()
+
+
+def test_database_is_at_latest_version(conn):
+    assert migrations.schema_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == []
+
+
+@pytest.mark.parametrize("name", sorted(migrations.HOT_QUERIES))
+def test_hot_query_uses_an_index(conn, name):
+    sql, params = migrations.HOT_QUERIES[name]
+    plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    # Walking a json_each() list of keys is expected; any other SCAN is a table scan
+    scans = [detail for detail in plan if detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail]
+    assert not scans, f"{name}: {plan}"
+
+
+def test_check_query_plans_reports_nothing(conn):
+    assert migrations.check_query_plans(conn) == []
+
+
+def test_check_query_plans_reports_a_table_scan(conn, monkeypatch):
+    monkeypatch.setitem(migrations.HOT_QUERIES, "unindexed", ("SELECT * FROM Results WHERE Score=?", (50,)))
+    assert [name for name, _ in migrations.check_query_plans(conn)] == ["unindexed"]
@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from gradebook import db, ranking, repository, terms
+
+
+@pytest.fixture
+def index(database):
+    index = ranking.RankingIndex()
+    index.build()
+    return index
+
+
+def add(index, exam_number, score, class_id=2):
+    repository.add_results(exam_number, f"Pupil {exam_number}", class_id, [("Math", score)], terms.find())
+    index.update([exam_number])
+
+
+def student_id(exam_number):
+    return db.get_connection().execute("SELECT StudentID FROM Student WHERE ExamNumber=?", (exam_number,)).fetchone()[0]
+
+
+def test_positions_share_ties(index):
+    term = terms.find()
+    for exam_number, score in (("R1", 90), ("R2", 70), ("R3", 70), ("R4", 50)):
+        add(index, exam_number, score, class_id=9)
+    positions = {exam: index.position(student_id(exam), 9, term) for exam in ("R1", "R2", "R3", "R4")}
+    assert positions["R1"] == ranking.Position(1, 4, 87.5)
+    assert positions["R2"] == positions["R3"] == ranking.Position(2, 4, 50.0)
+    assert positions["R4"] == ranking.Position(4, 4, 12.5)
+    assert index.position(student_id("R1"), 8, term) is None
+
+
+def test_versions_only_go_up_and_only_on_change(index):
+    term = terms.find()
+    add(index, "V1", 60)
+    first = index.version(2, term)
+    add(index, "V2", 80)
+    second = index.version(2, term)
+    assert second[0] > first[0]
+    index.build()
+    assert index.version(2, term) == second
+    index.update(["V1"])
+    assert index.version(2, term) == second
+
+
+def test_update_moves_a_pupil_to_their_new_class(index):
+    term = terms.find()
+    add(index, "M1", 60, class_id=5)
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE Student SET ClassID=6 WHERE ExamNumber='M1'")
+    before = index.version(5, term)
+    index.update(["M1"])
+    assert index.position(student_id("M1"), 5, term) is None
+    assert index.position(student_id("M1"), 6, term) == ranking.Position(1, 1, 50.0)
+    assert index.version(5, term)[0] > before[0]
+
+
+# Connection whose first statement returns its rows only after `during()` ran
+class Racing:
+    def __init__(self, conn, during):
+        self.conn = conn
+        self.during = during
+
+    def execute(self, sql, params=()):
+        if self.during is None:
+            return self.conn.execute(sql, params)
+        rows = self.conn.execute(sql, params).fetchall()
+        during, self.during = self.during, None
+        during()
+        return Rows(rows)
+
+
+class Rows(list):
+    def fetchall(self):
+        return list(self)
+
+
+def test_writes_during_a_build_are_replayed(index):
+    term = terms.find()
+    index.build(Racing(db.get_connection(), lambda: add(index, "B1", 99, class_id=7)))
+    assert index.position(student_id("B1"), 7, term) == ranking.Position(1, 1, 50.0)
+
+
+def test_stale_rows_are_not_applied_over_newer_ones(index):
+    term = terms.find()
+    add(index, "S1", 40, class_id=7)
+    add(index, "S2", 60, class_id=7)
+    read, release = threading.Event(), threading.Event()
+
+    def stall():
+        read.set()
+        release.wait(5)
+
+    # The first update reads S1 at 40, then stalls before applying it
+    stale = threading.Thread(target=index.update, args=(["S1"], Racing(db.get_connection(), stall)))
+    stale.start()
+    read.wait(5)
+    # Meanwhile S1 reaches 100 and its update is reported
+    repository.add_results("S1", "Pupil S1", 7, [("English", 160)], term)
+    fresh = threading.Thread(target=index.update, args=(["S1"],))
+    fresh.start()
+    release.set()
+    stale.join(5)
+    fresh.join(5)
+    assert index.position(student_id("S1"), 7, term) == ranking.Position(1, 2, 75.0)
@@ -0,0 +1,57 @@
+from gradebook import ratelimit, results, terms
+from gradebook.ratelimit import TokenBuckets
+
+
+def test_burst_then_refusal_with_wait():
+    buckets = TokenBuckets(rate=2.0, burst=3)
+    assert [buckets.take("ip", now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert buckets.take("ip", now=0.0) == 0.5
+    assert buckets.rejected == 1
+
+
+def test_tokens_refill_up_to_the_burst():
+    buckets = TokenBuckets(rate=1.0, burst=2)
+    buckets.take("ip", now=0.0)
+    buckets.take("ip", now=0.0)
+    assert buckets.take("ip", now=1.0) == 0.0
+    assert buckets.take("ip", now=100.0) == 0.0
+    assert buckets.take("ip", now=100.0) == 0.0
+    assert buckets.take("ip", now=100.0) > 0
+
+
+def test_keys_are_limited_separately():
+    buckets = TokenBuckets(rate=1.0, burst=1)
+    assert buckets.take("a", now=0.0) == 0.0
+    assert buckets.take("b", now=0.0) == 0.0
+    assert buckets.take("a", now=0.0) > 0
+
+
+def test_least_recently_used_key_is_dropped():
+    buckets = TokenBuckets(rate=1.0, burst=1, max_keys=2)
+    buckets.take("a", now=0.0)
+    buckets.take("b", now=0.0)
+    buckets.take("a", now=0.0)
+    buckets.take("c", now=0.0)
+    assert len(buckets) == 2
+    # "b" was dropped, so it would start full again; "a" is still empty
+    assert buckets.take("a", now=0.0) > 0
+    assert buckets.take("b", now=0.0) == 0.0
+
+
+def test_limits_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(ratelimit, "lookup_account", TokenBuckets(rate=0.001, burst=1))
+    monkeypatch.setattr(ratelimit, "enabled", False)
+    assert all(ratelimit.check_lookup("10.0.0.1", "EXAM001") == 0.0 for _ in range(5))
+
+
+def test_cached_lookups_are_recognised_without_the_database(database):
+    term = terms.find()
+    assert not results.is_cached("EXAM001", "1")
+    results.lookup("EXAM001", "1", term)
+    assert results.is_cached("EXAM001", "1")
+    # A term find() has not loaded yet is never treated as cached
+    assert not results.is_cached("EXAM001", "1", str(term.term_id))
+    terms.find(str(term.term_id))
+    assert results.is_cached("EXAM001", "1", str(term.term_id))
+    assert not results.is_cached("EXAM001", "2")
+    assert not results.is_cached("EXAM001", "1", "not a term")
@@ -0,0 +1,46 @@
+import base64
+import json
+
+import pytest
+
+from gradebook import repository, results, terms
+
+
+def cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+@pytest.fixture
+def pupils(database):
+    term = terms.find()
+    for n in range(5):
+        repository.add_results(f"P{n}", f"Pupil {n}", 2, [("Paging", 50 + n)], term)
+    return term
+
+
+def test_pages_follow_on_from_the_cursor(pupils):
+    first, token = results.class_results("2", term=pupils, subject="Paging", sort="score", limit="2")
+    second, _ = results.class_results("2", term=pupils, subject="Paging", sort="score", cursor=token, limit="2")
+    assert [row.score for row in first + second] == [54, 53, 52, 51]
+
+
+@pytest.mark.parametrize("key", [[{}, 1, 2], ["a", [1], 2], ["a", 2 ** 63, 1], ["a", True, 1]])
+def test_cursor_values_that_cannot_be_bound_are_refused(pupils, key):
+    with pytest.raises(ValueError, match="invalid page cursor"):
+        results.class_results("2", cursor=cursor(key))
+
+
+@pytest.mark.parametrize("token, message", [("!!", "invalid page cursor"), (cursor([1, 2]), "sort order")])
+def test_malformed_cursors_are_refused(pupils, token, message):
+    with pytest.raises(ValueError, match=message):
+        results.class_results("2", cursor=token)
+
+
+@pytest.mark.parametrize("limit, message", [("ten", "whole number"), ("0", "at least 1")])
+def test_bad_limits_are_refused(pupils, limit, message):
+    with pytest.raises(ValueError, match=message):
+        results.class_results("2", limit=limit)
+
+
+def test_limit_is_capped(pupils):
+    assert results.parse_limit(str(results.MAX_PAGE_SIZE * 2)) == results.MAX_PAGE_SIZE
@@ -0,0 +1,46 @@
+import pytest
+
+from gradebook import analytics, db, repository, results, summary, terms
+
+
+@pytest.fixture
+def two_terms(database):
+    summary.install()
+    conn = db.get_connection()
+    first = terms.find()
+    with conn:
+        second_id, _ = terms.resolve(conn, "Summary Term")
+    second = terms.get(conn, second_id)
+    repository.add_results("T1", "Top", 1, [("Math", 90), ("English", 80)], first)
+    repository.add_results("T2", "Next", 1, [("Math", 60)], first)
+    repository.add_results("T1", "Top", 1, [("Math", 30)], second)
+    repository.add_results("T2", "Next", 1, [("Math", 70)], second)
+    return first, second
+
+
+def test_summary_rows_are_kept_per_term(two_terms):
+    first, second = two_terms
+    assert results.lookup("T1", 1, first).summary[:4] == (170, 2, 85.0, "Passed")
+    assert results.lookup("T1", 1, second).summary[:4] == (30, 1, 30.0, "Failed")
+    assert summary.diff(db.get_connection()) == ([], [])
+
+
+def test_class_rank_is_per_term(two_terms):
+    first, second = two_terms
+    assert results.lookup("T1", 1, first).summary.class_rank < results.lookup("T2", 1, first).summary.class_rank
+    assert results.lookup("T2", 1, second).summary.class_rank == 1
+    assert results.lookup("T1", 1, second).summary.class_rank == 2
+
+
+def test_dashboard_statistics_are_per_term(two_terms):
+    first, second = two_terms
+    engine = analytics.AnalyticsEngine()
+    in_second = engine.snapshot(second)["1"]
+    assert [p["exam_number"] for p in in_second["positions"]] == ["T2", "T1"]
+    assert in_second["students"] == 2 and in_second["term_id"] == second.term_id
+    assert [s["count"] for s in in_second["subjects"]] == [2]
+
+    repository.add_results("T3", "Late", 1, [("Math", 100)], second)
+    engine.mark_dirty(["1"])
+    assert engine.snapshot(second)["1"]["positions"][0]["exam_number"] == "T3"
+    assert "T3" not in [p["exam_number"] for p in engine.snapshot(first)["1"]["positions"]]
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+
+import pytest
+
+from gradebook import db, hooks, writer
+from gradebook.writer import GroupCommitWriter
+
+
+def insert_class(name):
+    def work(conn):
+        conn.execute("INSERT INTO Class (ClassName) VALUES (?)", (name,))
+        return [name], None
+    return work
+
+
+def class_names():
+    return {row[0] for row in db.get_connection().execute("SELECT ClassName FROM Class")}
+
+
+@pytest.fixture
+def group(database):
+    group = GroupCommitWriter(database)
+    yield group
+    group.stop()
+
+
+def test_submissions_are_committed_and_reported(group, monkeypatch):
+    reported = []
+    monkeypatch.setattr(hooks, "results_changed", lambda *changed: reported.append(changed))
+    assert group.submit(insert_class("W1")).result(5) == (["W1"], None)
+    assert "W1" in class_names()
+    assert reported == [(["W1"], None)]
+
+
+def test_failed_submission_does_not_undo_its_batch(group):
+    release = threading.Event()
+    blocker = group.submit(lambda conn: (release.wait(5), ([], []))[1])
+
+    def failing(conn):
+        conn.execute("INSERT INTO Class (ClassName) VALUES ('W-bad')")
+        raise sqlite3.IntegrityError("refused")
+
+    futures = [group.submit(insert_class("W2")), group.submit(failing), group.submit(insert_class("W3"))]
+    release.set()
+    blocker.result(5)
+    assert futures[0].result(5) == (["W2"], None)
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[1].result(5)
+    assert futures[2].result(5) == (["W3"], None)
+    names = class_names()
+    assert {"W2", "W3"} <= names and "W-bad" not in names
+
+
+def test_submission_past_its_deadline_is_not_written(database):
+    group = GroupCommitWriter(database, timeout=0.05)
+    release = threading.Event()
+    try:
+        blocker = group.submit(lambda conn: (release.wait(5), ([], []))[1])
+        late = group.submit(insert_class("W-late"))
+        threading.Timer(0.2, release.set).start()
+        blocker.result(5)
+        with pytest.raises(writer.WriteTimeout):
+            late.result(5)
+    finally:
+        group.stop()
+    assert "W-late" not in class_names()
+    assert group.stats()["timeouts"] == 1
+
+
+def test_queued_submissions_fail_if_the_writer_cannot_start(tmp_path):
+    group = GroupCommitWriter(str(tmp_path / "missing" / "gradesystem.db"))
+    with pytest.raises(sqlite3.OperationalError):
+        group.submit(insert_class("W4")).result(5)
+
+
+@pytest.mark.parametrize("enabled", [True, False], ids=["group-commit", "direct"])
+def test_write_returns_once_committed(database, monkeypatch, enabled):
+    monkeypatch.setattr(writer, "enabled", enabled)
+    assert writer.write(insert_class("W5")) == (["W5"], None)
+    assert "W5" in class_names()
+
+
+def test_edits_go_through_the_writer(database, monkeypatch):
+    from gradebook import edits, repository, terms
+
+    reported = []
+    monkeypatch.setattr(hooks, "_listeners", hooks._listeners + [lambda *changed: reported.append(changed)])
+    repository.add_results("E1", "Edited", 1, [("Math", 40), ("English", 50)], terms.find())
+    ids = [row[0] for row in repository.editor_rows(db.get_connection(), "E1")]
+    submissions = writer.stats()["submissions"]
+    assert edits.update_results([(None, 45, ids[0])]) == 1
+    assert edits.delete_results([ids[1], 999999]) == 1
+    assert writer.stats()["submissions"] == submissions + 2
+    assert [row[2] for row in repository.editor_rows(db.get_connection(), "E1")] == [45]
+    assert reported[-2:] == [(["E1"], {"1"}), (["E1"], {"1"})]
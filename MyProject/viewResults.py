@@ -1,36 +1,32 @@
-import sqlite3
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler
 import urllib.parse
+from html import escape
 
-# Initialize the database and create tables if they don't exist
+from gradebook import (compression, httpcache, metrics, ranking, ratelimit, render, repository, results,
+                       serving, startup, streaming, summary, terms, writer)
+
+# Initialize the database: apply any pending schema migrations (shared with How.py)
 def init_db():
-    conn = sqlite3.connect("gradesystem.db")
-    cursor = conn.cursor()
-    # Create Student table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Student (
-        StudentID INTEGER PRIMARY KEY AUTOINCREMENT,
-        ExamNumber TEXT UNIQUE,
-        Name TEXT,
-        ClassID TEXT
-    )
-    """)
-    # Create Results table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Results (
-        ResultID INTEGER PRIMARY KEY AUTOINCREMENT,
-        StudentID INTEGER,
-        Subject TEXT,
-        Score INTEGER,
-        Term TEXT,
-        FOREIGN KEY(StudentID) REFERENCES Student(StudentID)
-    )
-    """)
-    conn.commit()
-    conn.close()
+    repository.init_db()
+
+# Closes the page opened by show_view_results_form
+PAGE_END = """
+            <a href="/">Back to Home</a>
+        </body>
+        </html>
+        """
+
+# Every route served, as labelled in /metrics (see gradebook.metrics);
+# /cache_stats and /metrics answer requests from this machine only
+ROUTES = ("/", "/teacher", "/add_results", "/view_results", "/cache_stats", "/metrics")
 
 class GradeServer(BaseHTTPRequestHandler):
+    # Drop clients that stall mid-request so they can't hold a worker forever
+    timeout = 30
 
+    @metrics.instrumented
     def do_GET(self):
         parsed_path = urllib.parse.urlparse(self.path)
         params = urllib.parse.parse_qs(parsed_path.query)
@@ -43,6 +39,10 @@ class GradeServer(BaseHTTPRequestHandler):
             self.process_add_results(params)
         elif parsed_path.path == "/view_results":
             self.show_view_results_form(params)
+        elif parsed_path.path == "/cache_stats" and metrics.is_local(self):
+            self.show_cache_stats()
+        elif parsed_path.path == "/metrics" and metrics.is_local(self):
+            self.show_metrics()
         else:
             self.send_response(404)
             self.end_headers()
@@ -107,12 +107,15 @@ class GradeServer(BaseHTTPRequestHandler):
                 <label>Scores (comma separated):</label>
                 <input type="text" name="score" placeholder="Score1,Score2"/>
 
+                <label>Term:</label>
+                <select name="term_id">{terms}</select>
+
                 <input type="submit" value="Add Results"/>
             </form>
             <a href="/">Back to Home</a>
         </body>
         </html>
-        """
+        """.replace("{terms}", render.term_options())
         self.send_response(200)
         self.send_header("Content-type", "text/html")
         self.end_headers()
@@ -127,35 +130,60 @@ class GradeServer(BaseHTTPRequestHandler):
         subjects = [s.strip() for s in subjects_str.split(",") if s.strip()]
         scores = [s.strip() for s in scores_str.split(",") if s.strip()]
 
-        if len(subjects) != len(scores):
+        try:
+            marks = repository.parse_marks(subjects, scores)
+        except ValueError as exc:
             self.send_response(400)
             self.end_headers()
-            self.wfile.write(b"Number of subjects and scores do not match.")
+            self.wfile.write(str(exc).encode())
+            return
+        term = terms.find(params.get("term_id", [""])[0])
+        if term is None or term.archive_path:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(b"Results can only be added to a term of an open year.")
             return
 
-        conn = sqlite3.connect("gradesystem.db")
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT StudentID FROM Student WHERE ExamNumber=?", (exam_number,))
-        row = cursor.fetchone()
-        if row:
-            student_id = row[0]
-        else:
-            cursor.execute("INSERT INTO Student (ExamNumber, Name, ClassID) VALUES (?, ?, ?)",
-                           (exam_number, name, class_id))
-            student_id = cursor.lastrowid
-
-        for subj, score in zip(subjects, scores):
-            cursor.execute("INSERT INTO Results (StudentID, Subject, Score, Term) VALUES (?, ?, ?, ?)",
-                           (student_id, subj, int(score), "Term 1"))
-        conn.commit()
-        conn.close()
+        try:
+            repository.add_results(exam_number, name, class_id, marks, term)
+        except writer.WriteTimeout:
+            self.send_response(503)
+            self.end_headers()
+            self.wfile.write(b"The server is too busy to save results right now; nothing was saved. Please try again.")
+            return
 
         self.send_response(302)
         self.send_header("Location", "/")
         self.end_headers()
 
+    # Hit/miss/eviction counters for sizing the result cache
+    def show_cache_stats(self):
+        payload = json.dumps({"results": results.stats(), "rate_limits": ratelimit.stats(),
+                              "writer": writer.stats(), "ranking": ranking.index.stats(),
+                              "startup": startup.stats()}).encode()
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def show_metrics(self):
+        payload = metrics.render()
+        self.send_response(200)
+        self.send_header("Content-type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
     def show_view_results_form(self, params):
+        if "exam_number" in params and not results.is_cached(params["exam_number"][0],
+                                                             params.get("class_id", [""])[0],
+                                                             params.get("term_id", [""])[0]):
+            wait = ratelimit.check_lookup(self.client_address[0], params["exam_number"][0])
+            if wait:
+                ratelimit.send_too_many_requests(self, wait)
+                return
+        term = terms.find(params.get("term_id", [""])[0])
         html = """
         <html>
         <head>
@@ -184,57 +212,84 @@ class GradeServer(BaseHTTPRequestHandler):
                 <label>Enter Class:</label>
                 <input type="text" name="class_id" required />
 
+                <label>Term:</label>
+                <select name="term_id">{terms}</select>
+
                 <input type="submit" value="View Results" />
             </form>
-        """
+        """.replace("{terms}", render.select(render.term_options(), term.term_id) if term else render.term_options())
 
         # If parameters provided, fetch and display results
-        if "exam_number" in params and "class_id" in params:
+        if "exam_number" in params and "class_id" in params and term is not None:
             exam_number = params["exam_number"][0]
             class_id = params["class_id"][0]
+            # Comes from the result cache when possible, so a 304 for an unchanged page costs no DB work
+            entry = results.lookup(exam_number, class_id, term)
+            if entry is not results.NOT_FOUND:
+                # A classmate's new marks can move the position, hence the class version
+                class_version, class_changed = ranking.index.version(class_id, term)
+                validators = (httpcache.make_etag(entry.student_id, entry.version, term.term_id, class_version, html),
+                              max(entry.updated_at or 0, class_changed) or None)
+                if httpcache.not_modified(self.headers, *validators):
+                    httpcache.send_not_modified(self, *validators)
+                    return
+                position = ranking.index.position(entry.student_id, class_id, term)
+                streaming.send_stream(self, self.results_page_parts(html, entry, term, position), validators=validators)
+                return
+            html += "<h3>Your Results:</h3>" + \
+                "<p>Student not found. Please check your exam number and class.</p>"
+        elif "exam_number" in params:
+            html += "<h3>Your Results:</h3><p>Term not found.</p>"
 
-            conn = sqlite3.connect("gradesystem.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT StudentID FROM Student WHERE ExamNumber=? AND ClassID=?", (exam_number, class_id))
-            row = cursor.fetchone()
-            if row:
-                student_id = row[0]
-                cursor.execute("SELECT Subject, Score FROM Results WHERE StudentID=?", (student_id,))
-                results = cursor.fetchall()
-                if results:
-                    total_score = sum(score for _, score in results)
-                    count = len(results)
-                    average_score = total_score / count if count > 0 else 0
-                    status = "Passed" if average_score >= 40 else "Failed"
-                    table = "<table><tr><th>Subject</th><th>Score</th></tr>"
-                    for subj, score in results:
-                        table += f"<tr><td>{subj}</td><td>{score}</td></tr>"
-                    table += "</table>"
-                    table += f"<h4>Status: {status}</h4>"
-                else:
-                    table = "<p>No results found for this student.</p>"
-            else:
-                table = "<p>Student not found. Please check your exam number and class.</p>"
-            conn.close()
-
-            html += "<h3>Your Results:</h3>" + table
-
-        html += """
-            <a href="/">Back to Home</a>
-        </body>
-        </html>
-        """
+        html += PAGE_END
+        body, encoding = compression.encode(self.headers, html.encode())
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        compression.send_headers(self, encoding)
         self.end_headers()
-        self.wfile.write(html.encode())
+        self.wfile.write(body)
+
+    # Results page generated piece by piece for streaming.send_stream()
+    @staticmethod
+    def results_page_parts(html, entry, term, position=None):
+        yield html
+        yield f"<h3>Your Results: {escape(f'{term.year} {term.name}')}</h3>"
+        if entry.rows:
+            yield from render.result_table(entry.rows)
+            # The term's StudentSummary row (see results.lookup)
+            yield f"<h4>Status: {entry.summary.status if entry.summary else 'Failed'}</h4>"
+            if position:
+                yield f"<h4>Position: {position.position} of {position.size} &nbsp; Percentile: {position.percentile:.1f}</h4>"
+        else:
+            yield "<p>No results found for this student.</p>"
+        yield PAGE_END
 
-def run(server_class=HTTPServer, handler_class=GradeServer, port=3000):
-    server_address = ('localhost', 3000)
-    print(f"Starting server at http://localhost:{3000}")
+def run(server_class=serving.PooledHTTPServer, handler_class=GradeServer, port=3000,
+        workers=serving.DEFAULT_WORKERS, backlog=serving.DEFAULT_BACKLOG, processes=1, use_async=False,
+        slow_ms=None, rate_limit=True, gzip=True, group_commit=True, flush_ms=writer.FLUSH_INTERVAL * 1000,
+        warm="background"):
+    server_address = ('localhost', port)
+    print(f"Starting server at http://localhost:{port}")
+    metrics.configure(slow_request_ms=slow_ms, routes=ROUTES)
+    ratelimit.configure(rate_limit)
+    compression.configure(gzip)
+    writer.configure(group_commit, flush_ms / 1000)
+    startup.configure(warm)
+    summary.install()
     init_db()  # Initialize database before starting server
-    httpd = server_class(server_address, handler_class)
-    httpd.serve_forever()
+    startup.before_listening()
+    if use_async:
+        from gradebook import aserver
+        aserver.run(handler_class, port, workers=workers, host='localhost', on_start=startup.listening)
+        return
+    httpd = server_class(server_address, handler_class, workers=workers, backlog=backlog)
+    serving.serve(httpd, processes=processes, on_start=startup.listening)
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Kafumbwe Grade Book results server")
+    serving.add_arguments(parser)
+    args = parser.parse_args()
+    run(port=args.port, workers=args.workers, backlog=args.backlog, processes=args.processes,
+        use_async=args.use_async, slow_ms=args.slow_ms, rate_limit=args.rate_limit, gzip=args.gzip,
+        group_commit=args.group_commit, flush_ms=args.flush_ms, warm=args.warm)
\ No newline at end of file